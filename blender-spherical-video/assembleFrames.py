@@ -1,14 +1,21 @@
-# Assembles frames into a movie.
+# Assembles frames into a movie.  The movie is written by Blender's movie output,
+# or for FFmpeg presets when an FFmpeg executable is available, by streaming the
+# frames' pixels to an FFmpeg process through a pipe.
 
 # Run in Blender, e.g.:
 # blender --background --python assembleFrames.py -- -i movie/framesFinal -o movie/results
+# blender --background --python assembleFrames.py -- -i movie/framesFinal -o movie/results -en h264 -fps 30
 
 import argparse
 import bpy
+import collections
+import numpy as np
 import os
-import shutil
 import sys
-import tempfile
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsEncoding import ENCODER_PRESETS, findFFmpeg, movieFileName, ffmpegCommand, frameBytes, FFmpegPipe
+from utilsFormats import fileFormatToExt
 
 argv = sys.argv
 if "--" not in argv:
@@ -32,6 +39,16 @@ parser.add_argument("--stretch", "-s", type=int, dest="stretch", help="stretch f
 parser.set_defaults(padding=0)
 parser.add_argument("--pad", "-p", type=int, dest="padding", help="pad with this many copies of the last frame")
 
+parser.set_defaults(encoder="avi")
+parser.add_argument("--encoder", "-en", dest="encoder", choices=list(ENCODER_PRESETS.keys()), help="container and codec preset")
+parser.set_defaults(fps=24)
+parser.add_argument("--fps", "-fps", type=int, dest="fps", help="frames per second")
+parser.add_argument("--bitrate", "-br", type=int, dest="bitrate", help="bitrate in kilobits per second (default: a constant quality)")
+parser.set_defaults(ffmpeg=findFFmpeg())
+parser.add_argument("--ffmpeg", "-ff", dest="ffmpeg", help="path to the FFmpeg executable for streaming frames to it")
+parser.set_defaults(pipe=True)
+parser.add_argument("--nopipe", "-np", dest="pipe", action="store_false", help="do NOT stream frames to FFmpeg, but use Blender's movie output")
+
 args = parser.parse_args(argv)
 
 if args.inputDir == None:
@@ -45,45 +62,78 @@ if outputDir[:-1] != "/":
     outputDir += "/"
 print("Using output directory: '{}'".format(outputDir))
 
+inputDir = args.inputDir
+inputExts = set(fileFormatToExt.values())
+frames = [f for f in os.listdir(inputDir) if os.path.splitext(f)[1].lower() in inputExts and not f.startswith(".")]
+if not frames:
+    print("No input frames with extensions {} in '{}'".format(", ".join(sorted(inputExts)), inputDir))
+    quit()
+
+# Use the most common extension, in case the directory has other images, too.
+inputExt = collections.Counter([os.path.splitext(f)[1].lower() for f in frames]).most_common(1)[0][0]
+inputFrames = [f for f in frames if os.path.splitext(f)[1].lower() == inputExt]
+inputFrames.sort()
+print("Using {} input frames with extension {}".format(len(inputFrames), inputExt))
+
+preset = ENCODER_PRESETS[args.encoder]
+if args.bitrate and preset.ffmpegArgs == None:
+    print("The --bitrate option cannot be used with the '{}' encoder".format(preset.name))
+    sys.exit(1)
+usePipe = args.pipe and args.ffmpeg != None and preset.ffmpegArgs != None
+print("Using encoder {}{}".format(preset.name, ", with FFmpeg '{}'".format(args.ffmpeg) if usePipe else ""))
+
+# Stretching and padding repeat the file names of the strip's elements, so the
+# repeated frames refer to the same input files, without copying them.
+elements = []
+for inputFrame in inputFrames:
+    elements += [inputFrame] * args.stretch
+if args.stretch > 1:
+    print("Using stretch {}".format(args.stretch))
+if args.padding > 0:
+    print("Using padding {}".format(args.padding))
+    elements += [inputFrames[-1]] * args.padding
+
+if usePipe:
+    # Each input frame is loaded and converted once, and written once per element.
+    outputPath = os.path.join(outputDir, movieFileName(len(elements), preset.ext))
+    os.makedirs(outputDir, exist_ok=True)
+    pipe = None
+    pixels = None
+    for inputFrame in inputFrames:
+        image = bpy.data.images.load(os.path.join(inputDir, inputFrame))
+        width, height = image.size
+        if pipe != None and (width, height) != frameSize:
+            # The raw frames in the pipe all must have the size given to FFmpeg.
+            bpy.data.images.remove(image)
+            pipe.abort()
+            print("Frame '{}' is {} by {}, not {} by {} like the earlier frames".format(inputFrame, width, height, *frameSize))
+            sys.exit(1)
+        if pixels is None:
+            pixels = np.empty(width * height * 4, dtype=np.float32)
+        if hasattr(image.pixels, "foreach_get"):
+            image.pixels.foreach_get(pixels)
+        else:
+            pixels[:] = image.pixels[:]
+        linear = image.is_float
+        bpy.data.images.remove(image)
+
+        if pipe == None:
+            frameSize = (width, height)
+            pipe = FFmpegPipe(ffmpegCommand(args.ffmpeg, preset, width, height, args.fps, outputPath, args.bitrate, args.width, args.height))
+        count = args.stretch
+        if inputFrame == inputFrames[-1]:
+            count += args.padding
+        pipe.write(frameBytes(pixels, width, height, linear), count)
+    pipe.close()
+    print("Saved '{}'".format(outputPath))
+    quit()
+
 seqEd = bpy.context.scene.sequence_editor_create()
+seq = seqEd.sequences.new_image(name="assemble", filepath=os.path.join(inputDir, elements[0]), channel=1, frame_start=1)
+for element in elements[1:]:
+    seq.elements.append(element)
 
-inputDir = args.inputDir
-pngs = [f for f in os.listdir(inputDir) if os.path.splitext(f)[1] == ".png"]
-pngs.sort()
-
-tmp = None
-if args.stretch > 1 or args.padding > 0:
-    tmp = tempfile.mkdtemp()
-    if args.stretch > 1:
-        print("Using stretch {}, with temporary directory {}".format(args.stretch, tmp))
-    i = 1
-    srcs = pngs.copy()
-    pngs = []
-    for src in srcs:
-        src = os.path.join(args.inputDir, src)
-        for j in range(args.stretch):
-            dst = os.path.join(tmp, str(i).zfill(4)) + ".png"
-            shutil.copy(src, dst)
-            pngs.append(os.path.split(dst)[1])
-            i += 1
-
-    if args.padding > 0:
-        print("Using padding {}, with temporary directory {}".format(args.padding, tmp))
-        src = os.path.join(args.inputDir, srcs[-1])
-        for j in range(args.padding):
-            dst = os.path.join(tmp, str(i).zfill(4)) + ".png"
-            shutil.copy(src, dst)
-            pngs.append(os.path.split(dst)[1])
-            i += 1
-
-    pngs.sort()
-    inputDir = tmp
-
-seq = seqEd.sequences.new_image(name="assemble", filepath=os.path.join(inputDir, pngs[0]), channel=1, frame_start=1)
-for png in pngs[1:]:
-    seq.elements.append(png)
-
-bpy.context.scene.frame_end = len(pngs)
+bpy.context.scene.frame_end = len(elements)
 
 bpy.context.scene.render.resolution_x = args.width
 bpy.context.scene.render.resolution_y = args.height
@@ -91,13 +141,19 @@ bpy.context.scene.render.resolution_percentage = 100
 bpy.context.scene.render.pixel_aspect_x = 1
 bpy.context.scene.render.pixel_aspect_y = 1
 
-bpy.context.scene.render.image_settings.file_format = "AVI_JPEG"
-bpy.context.scene.render.fps = 24
+bpy.context.scene.render.image_settings.file_format = preset.blenderFileFormat
+if preset.blenderFileFormat == "FFMPEG":
+    ffmpegSettings = bpy.context.scene.render.ffmpeg
+    ffmpegSettings.format = preset.blenderContainer
+    ffmpegSettings.codec = preset.blenderCodec
+    if args.bitrate:
+        ffmpegSettings.constant_rate_factor = "NONE"
+        ffmpegSettings.video_bitrate = args.bitrate
+        ffmpegSettings.maxrate = max(ffmpegSettings.maxrate, args.bitrate)
+    elif preset.qualityArgs:
+        ffmpegSettings.constant_rate_factor = "HIGH"
+bpy.context.scene.render.fps = args.fps
 
 bpy.context.scene.render.filepath = outputDir
 
 bpy.ops.render.render(animation=True)
-
-if tmp:
-    print("Removing temporary directory {}".format(tmp))
-    shutil.rmtree(tmp)
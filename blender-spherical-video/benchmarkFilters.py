@@ -0,0 +1,123 @@
+# Compares the quality and speed of the resampling filters (`--filter` in
+# sphericalVideo.py) with various numbers of subsamples.  The cube images are
+# synthetic, with fine stripes and checks that alias easily, and the reference
+# spherical image is resampled from them with the "nearest" filter and many
+# subsamples.  For each filter and subsample count, reports the number of cube
+# pixels read per final image pixel (taps), the time to compute the sampling
+# indices, the resampling speed, and the peak signal-to-noise ratio (PSNR)
+# compared to the reference image.
+
+# Run with Python (not in Blender), e.g.:
+# python benchmarkFilters.py -ow 1280 -oh 720 -r 8
+
+import argparse
+import math
+import numpy as np
+import os.path
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsProjections import getProjection, projectionNames
+from utilsSampling import Sizes, createSamplingIndices, flatSamplingIndices, flatSamplingWeights, resampleCubePixels
+
+# The (filter, subWidth, subHeight) combinations compared.
+CANDIDATES = [
+    ("nearest", 1, 1),
+    ("nearest", 2, 2),
+    ("nearest", 3, 3),
+    ("bilinear", 1, 1),
+    ("bilinear", 2, 2),
+    ("area", 1, 1),
+    ("area", 2, 2)
+]
+
+def syntheticCubePixels(cubeSize):
+    """
+    Returns an array of the pixels of six synthetic cube images of size `cubeSize`,
+    as in `getCubePixels` in sphericalVideo.py, with high-frequency patterns that
+    differ by face and by color channel, followed by the blank pixel.
+    """
+
+    y, x = np.mgrid[0:cubeSize, 0:cubeSize].astype(np.float32)
+    faces = []
+    for face in range(6):
+        period = 2 + face
+        red = 0.5 + 0.5 * np.sin(2 * math.pi * (x + 0.5 * y) / period)
+        green = ((x // period + y // period) % 2).astype(np.float32)
+        blue = 0.5 + 0.5 * np.cos(2 * math.pi * np.hypot(x, y) / (period + 1))
+        faces.append(np.stack([red, green, blue, np.ones_like(red)], axis=-1).reshape(-1, 4))
+    faces.append(np.zeros((1, 4)))
+    return np.concatenate(faces).astype(np.float32)
+
+def psnr(pixels, reference):
+    """
+    Returns the peak signal-to-noise ratio, in decibels, of the color channels of
+    the flat `pixels` compared to the flat `reference`, with values from 0 to 1.
+    """
+
+    diff = pixels.reshape(-1, 4)[:, :3] - reference.reshape(-1, 4)[:, :3]
+    mse = float(np.mean(diff * diff))
+    return float("inf") if mse == 0 else 10 * math.log10(1 / mse)
+
+def benchmarkFilter(sizes, mapToLatLon, filter, cubePixels, repeats):
+    """
+    Returns a tuple, (`pixels`, `taps`, `buildSeconds`, `framesPerSecond`), for
+    resampling `cubePixels` with `filter`, taking the best of `repeats` resamplings.
+    """
+
+    t0 = time.time()
+    samplingIndices = createSamplingIndices(sizes, mapToLatLon, cache=False, memo=False, filter=filter)
+    flatIndices = flatSamplingIndices(samplingIndices, sizes)
+    weights = flatSamplingWeights(samplingIndices, sizes)
+    buildSeconds = time.time() - t0
+
+    out = np.empty(flatIndices.shape[1] * 4, dtype=np.float32)
+    best = float("inf")
+    for i in range(repeats):
+        t0 = time.time()
+        resampleCubePixels(cubePixels, flatIndices, out, weights)
+        best = min(best, time.time() - t0)
+    return (out, flatIndices.shape[0], buildSeconds, 1 / best)
+
+def benchmarkFilters(width, height, cubeSize, mapToLatLon, referenceSubsamples, repeats):
+    """
+    Prints the comparison of the `CANDIDATES` for a final image of size `width`
+    by `height` from cube images of size `cubeSize`, with the reference image
+    using `referenceSubsamples` subsamples in each dimension.
+    """
+
+    cubePixels = syntheticCubePixels(cubeSize)
+    referenceSizes = Sizes(width, height, cubeSize, referenceSubsamples, referenceSubsamples)
+    reference, _, _, _ = benchmarkFilter(referenceSizes, mapToLatLon, "nearest", cubePixels, 1)
+
+    print("{:>9} {:>7} {:>5} {:>11} {:>10} {:>9}".format("filter", "subsamp", "taps", "build secs", "frames/sec", "PSNR dB"))
+    for filter, subWidth, subHeight in CANDIDATES:
+        sizes = Sizes(width, height, cubeSize, subWidth, subHeight)
+        pixels, taps, buildSeconds, framesPerSecond = benchmarkFilter(sizes, mapToLatLon, filter, cubePixels, repeats)
+        print("{:>9} {:>7} {:>5} {:>11.2f} {:>10.2f} {:>9.2f}".format(filter, "{}x{}".format(subWidth, subHeight), taps,
+                                                                     buildSeconds, framesPerSecond, psnr(pixels, reference)))
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(width=1280)
+    parser.add_argument("--width", "-ow", type=int, dest="width", help="width of output spherical image")
+    parser.set_defaults(height=720)
+    parser.add_argument("--height", "-oh", type=int, dest="height", help="height of output spherical image")
+    parser.add_argument("--cubeSize", "-cu", type=int, dest="cubeSize", help="width (height) of cube faces")
+    parser.set_defaults(projectionType="0")
+    parser.add_argument("--proj", "-pr", dest="projectionType", help="projection type, by number or name ({})".format(projectionNames()))
+    parser.set_defaults(referenceSubsamples=8)
+    parser.add_argument("--reference", "-r", type=int, dest="referenceSubsamples", help="subsamples in each dimension for the reference image")
+    parser.set_defaults(repeats=3)
+    parser.add_argument("--repeats", "-n", type=int, dest="repeats", help="number of resamplings timed for each filter")
+    args = parser.parse_args()
+
+    cubeSize = args.cubeSize if args.cubeSize != None else max(int(args.width * 0.75), int(args.height * 0.75))
+    try:
+        projection = getProjection(args.projectionType)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+    benchmarkFilters(args.width, args.height, cubeSize, projection, args.referenceSubsamples, args.repeats)
@@ -1,57 +1,76 @@
 # Packs each group of three consecutive input frames into one output frame, by
 # converting each input frame to grayscale and puting input frame i into one
 # channel of the output frame (e.g., red), input frame i+1 into another channel
-# (e.g., green), and i+2 into another channel (e.g., blue).
+# (e.g., green), and i+2 into another channel (e.g., blue).  The frames are
+# packed as NumPy arrays (see utilsPacking.py), with the same grayscale weights
+# as the compositor's "RGB to BW" node, and written directly, without rendering.
 
 # Run in Blender, e.g.:
 # blender --background --python packFrames.py -- -i path/inputFrames -o path/outputFrames
+# To pack with four Blender processes while sphericalVideo.py is still rendering:
+# blender --background --python packFrames.py -- -i path/spherical -o path/outputFrames -w 4 --watch
 
 import argparse
 import bpy
+import collections
+import concurrent.futures
 import datetime
+import json
+import numpy as np
 import os
 import os.path
+import queue
+import subprocess
 import sys
+import threading
 import time
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
 from utilsFormats import fileFormatToExt, unknownFormatErrorMessage
+from utilsPacking import packFramePixels, packedChannelIndices
 
-def setupImageNodes(i):
-    tree = bpy.context.scene.node_tree
-    treeLinks = tree.links
+def loadFramePixels(path, pixels=None):
+    """
+    Loads the image at `path` into the flat NumPy float32 array `pixels` (or a
+    new array, if `pixels` is `None` or has the wrong size), and then removes the
+    loaded image so images do not accumulate.  Returns a tuple, (`pixels`,
+    `linear`, `width`, `height`), where `linear` is `True` if the image has linear
+    floating-point pixels (e.g., OpenEXR) rather than 8-bit sRGB pixels.
+    """
 
-    imageNode = tree.nodes.new(type="CompositorNodeImage")
-    imageNode.name = "image" + str(i)
-    toBWNode = tree.nodes.new(type="CompositorNodeRGBToBW")
-    toBWNode.name= "toBW" + str(i)
-    treeLinks.new(imageNode.outputs["Image"], toBWNode.inputs["Image"])
+    image = bpy.data.images.load(path)
+    try:
+        width, height = image.size
+        if pixels is None or pixels.size != width * height * 4:
+            pixels = np.empty(width * height * 4, dtype=np.float32)
+        if hasattr(image.pixels, "foreach_get"):
+            image.pixels.foreach_get(pixels)
+        else:
+            pixels[:] = image.pixels[:]
+        linear = image.is_float
+    finally:
+        bpy.data.images.remove(image)
+    return (pixels, linear, width, height)
 
-    return (imageNode, toBWNode)
+def savePackedImage(outputPath, pixels, width, height, scene, image=None):
+    """
+    Saves the packed frame with the linear `pixels` to `outputPath`, applying the
+    scene's color management and file format, as the compositor's "File Output"
+    node does.  The `image` is a `bpy.types.Image` from an earlier call, which is
+    reused if it has the same size, and the image saved is returned.
+    """
 
-def setupNodes(outputFormat, packedOrder):
-    bpy.context.scene.use_nodes = True
-    tree = bpy.context.scene.node_tree
-    treeLinks = tree.links
-
-    for node in tree.nodes:
-        tree.nodes.remove(node)
-
-    (imageNode0, toBWNode0) = setupImageNodes(0)
-    (imageNode1, toBWNode1) = setupImageNodes(1)
-    (imageNode2, toBWNode2) = setupImageNodes(2)
-
-    combineNode = tree.nodes.new(type="CompositorNodeCombRGBA")
-    combineNode.name = "combine"
-    treeLinks.new(toBWNode0.outputs["Val"], combineNode.inputs[packedOrder[0]])
-    treeLinks.new(toBWNode1.outputs["Val"], combineNode.inputs[packedOrder[1]])
-    treeLinks.new(toBWNode2.outputs["Val"], combineNode.inputs[packedOrder[2]])
-
-    outputNode = tree.nodes.new(type="CompositorNodeOutputFile")
-    outputNode.format.file_format = outputFormat.upper()
-    treeLinks.new(combineNode.outputs["Image"], outputNode.inputs["Image"])
-
-    return (imageNode0, imageNode1, imageNode2, outputNode)
+    if image != None and tuple(image.size) != (width, height):
+        bpy.data.images.remove(image)
+        image = None
+    if image == None:
+        image = bpy.data.images.new("packFrames", width=width, height=height, float_buffer=True)
+    if hasattr(image.pixels, "foreach_set"):
+        image.pixels.foreach_set(pixels)
+    else:
+        image.pixels = pixels
+    image.save_render(outputPath, scene=scene)
+    return image
 
 def findInputFrames(inputDir, start, end):
     inFrames = [f for f in os.listdir(inputDir) if os.path.splitext(f)[0].isdigit()]
@@ -65,37 +84,336 @@ def findInputFrames(inputDir, start, end):
 
     return inFrames
 
-def setupRender():
-    bpy.context.scene.render.resolution_percentage = 100
-    bpy.context.scene.render.pixel_aspect_x = 1
-    bpy.context.scene.render.pixel_aspect_y = 1
-    bpy.context.scene.render.use_compositing = True
-
-def pack(inputDir, inputFrames, imageNodes, outputNode, outputDir, outputExt):
-    for imageNode in imageNodes:
-        if imageNode.image:
-            bpy.data.images.remove(imageNode.image)
-
-    i = 0
-    for inputFrame in inputFrames:
-        if i == 0:
-            outputFrame = os.path.splitext(inputFrame)[0]
-            outputPath = os.path.join(outputDir, outputFrame) + outputExt
-        if i < 3:
-            inputPath = os.path.join(inputDir, inputFrame)
-            imageNodes[i].image = bpy.data.images.load(inputPath)
-        i += 1
-        if i == 3:
-            i = 0
-
-            outputNode.base_path = os.path.join(outputDir, outputFrame)
-            bpy.ops.render.render()
-
-            # Necessary to workaround problems directly setting the output file name.
-            if os.path.exists(outputPath):
-                os.remove(outputPath)
-            os.rename(os.path.join(outputNode.base_path, "Image0001") + outputExt, outputPath)
-            os.rmdir(outputNode.base_path)
+def inputFrameTriples(inputFrames):
+    """
+    Yields the groups of three of the `inputFrames`, as from `findInputFrames`.
+    """
+
+    for i in range(0, len(inputFrames), 3):
+        yield inputFrames[i:i + 3]
+
+class ReadyFrames:
+    """
+    Tracks the frames in `inputDir` that are completely written, for packing them
+    while they are still being rendered.  If `sphericalVideo.py` is rendering into
+    the parent directory, its manifest lists the completed frames.  Otherwise, a
+    frame is complete when its file size has not changed since the last `poll`.
+    """
+    def __init__(self, inputDir):
+        self.inputDir = inputDir
+        self.manifestPath = os.path.join(os.path.dirname(os.path.normpath(inputDir)), "manifest.jsonl")
+        self.manifestOffset = 0
+        self.manifestSizes = {}
+        self.lastSizes = {}
+        self.frames = {}
+
+    def readManifest(self):
+        if not os.path.exists(self.manifestPath):
+            return False
+        with open(self.manifestPath) as f:
+            f.seek(self.manifestOffset)
+            lines = f.read()
+        # Only whole lines, as a line may be in the middle of being appended.
+        lines = lines[:lines.rfind("\n") + 1]
+        self.manifestOffset += len(lines)
+        for line in lines.splitlines():
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            if entry.get("kind") == "spherical":
+                for file, size in entry["files"].items():
+                    self.manifestSizes[os.path.basename(file)] = size
+        return True
+
+    def poll(self):
+        """
+        Checks for newly completed frames, and returns `True` if there are any.
+        The completed frames are in `frames`, mapping frame numbers to file names.
+        """
+
+        hasManifest = self.readManifest()
+        found = False
+        for entry in os.scandir(self.inputDir):
+            name = entry.name
+            if not os.path.splitext(name)[0].isdigit() or int(os.path.splitext(name)[0]) in self.frames:
+                continue
+            size = entry.stat().st_size
+            if hasManifest:
+                ready = self.manifestSizes.get(name) == size
+            else:
+                ready = size > 0 and self.lastSizes.get(name) == size
+                self.lastSizes[name] = size
+            if ready:
+                self.frames[int(os.path.splitext(name)[0])] = name
+                found = True
+        return found
+
+def watchInputFrameTriples(inputDir, start, end, step=1, timeout=None, interval=1):
+    """
+    Yields the groups of three frames in `inputDir` as soon as they are completed,
+    for frames `start`, `start` + `step`, etc., through `end`.  Stops when a group
+    would go past `end`, or when no new frames are completed for `timeout` seconds
+    (if not `None`), checking every `interval` seconds.  As in `findInputFrames`, the last frame
+    is duplicated to fill a final partial group.
+    """
+
+    readyFrames = ReadyFrames(inputDir)
+    frame = start
+    lastFound = time.time()
+    while frame <= end:
+        numbers = [n for n in range(frame, frame + 3 * step, step) if n <= end]
+        if all([n in readyFrames.frames for n in numbers]):
+            group = [readyFrames.frames[n] for n in numbers]
+            yield (group + [group[-1]] * 3)[:3]
+            frame += 3 * step
+            continue
+
+        if timeout != None and time.time() - lastFound > timeout:
+            group = []
+            for n in numbers:
+                if not n in readyFrames.frames:
+                    break
+                group.append(readyFrames.frames[n])
+            if group:
+                yield (group + [group[-1]] * 3)[:3]
+            print("No new frames for {} seconds, so stopping watching".format(timeout))
+            return
+
+        if readyFrames.poll():
+            lastFound = time.time()
+        else:
+            time.sleep(interval)
+
+def readAhead(path):
+    """
+    Reads the file at `path`, so it is in the operating system's cache when it
+    is loaded by Blender.
+    """
+
+    with open(path, "rb") as f:
+        while f.read(1 << 22):
+            pass
+
+def prefetchTriples(triples, inputDir, prefetch=4, threads=3):
+    """
+    Returns a queue of the groups of input frames from the iterable `triples`,
+    filled by a separate thread that reads the frames ahead on a pool of `threads`
+    threads.  At most `prefetch` groups are read ahead, to bound the memory, and
+    `None` marks the end of the groups.
+    """
+
+    triplesQueue = queue.Queue(maxsize=max(prefetch, 1))
+
+    def produce():
+        with concurrent.futures.ThreadPoolExecutor(threads) as executor:
+            try:
+                for triple in triples:
+                    futures = [executor.submit(readAhead, os.path.join(inputDir, f)) for f in set(triple)]
+                    triplesQueue.put((triple, futures))
+            finally:
+                triplesQueue.put(None)
+
+    threading.Thread(target=produce, daemon=True).start()
+    return triplesQueue
+
+class TriplePacker:
+    """
+    Packs groups of three frames into output frames in this Blender process, with
+    the file format `outputFormat` and the channels in `packedOrder`.  The buffers
+    and the output image are reused from one output frame to the next.
+    """
+    def __init__(self, outputFormat, packedOrder="RGB"):
+        self.scene = bpy.context.scene
+        self.scene.render.image_settings.file_format = outputFormat
+        self.packedOrder = packedOrder
+        self.framePixels = [None] * 3
+        self.linear = [True] * 3
+        self.packed = None
+        self.image = None
+
+    def pack(self, inputPaths, outputPath):
+        """
+        Packs the frames at the three `inputPaths` into the output frame saved at
+        `outputPath`.  Returns `False` if the frames have different sizes, and
+        are skipped.
+        """
+
+        sizes = set()
+        for j, inputPath in enumerate(inputPaths):
+            self.framePixels[j], self.linear[j], width, height = loadFramePixels(inputPath, self.framePixels[j])
+            sizes.add((width, height))
+        if len(sizes) > 1:
+            print("Skipping frames of different sizes: {}".format(", ".join(inputPaths)))
+            return False
+
+        if self.packed is None or self.packed.size != width * height * 4:
+            self.packed = np.empty(width * height * 4, dtype=np.float32)
+        packFramePixels(self.framePixels, self.linear, self.packedOrder, self.packed)
+        self.image = savePackedImage(outputPath, self.packed, width, height, self.scene, self.image)
+        return True
+
+    def close(self):
+        if self.image != None:
+            bpy.data.images.remove(self.image)
+            self.image = None
+
+def partialOutputPath(outputPath):
+    """
+    Returns the path at which the output frame for `outputPath` is saved before
+    being renamed to `outputPath`, so output frames appear complete and in order.
+    """
+
+    directory, name = os.path.split(outputPath)
+    base, ext = os.path.splitext(name)
+    return os.path.join(directory, "." + base + ".partial" + ext)
+
+def workerCommand(blender, outputFormat, packedOrder):
+    """
+    Returns the command to run this script as a packing worker in a background
+    instance of the Blender executable `blender`.
+    """
+
+    script = os.path.realpath(__file__)
+    return [blender, "--background", "--python", script, "--", "--worker", "-of", outputFormat, "-po", packedOrder]
+
+class PackingWorkers:
+    """
+    Packs groups of three frames in `count` background Blender processes running
+    this script with `--worker`, each with a `TriplePacker`, so decoding, packing
+    and encoding of several output frames proceed in parallel.  A group is sent to
+    an idle worker with `submit`, and `finish` waits for any worker to finish.
+    """
+    def __init__(self, blender, count, outputFormat, packedOrder):
+        self.done = queue.Queue()
+        self.processes = []
+        for i in range(count):
+            process = subprocess.Popen(workerCommand(blender, outputFormat, packedOrder), stdin=subprocess.PIPE,
+                                       stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True, bufsize=1)
+            self.processes.append(process)
+            threading.Thread(target=self.readOutput, args=(i, process), daemon=True).start()
+        self.idle = list(range(count))
+        self.pending = {}
+
+    def readOutput(self, i, process):
+        lastLines = collections.deque(maxlen=20)
+        for line in process.stdout:
+            line = line.rstrip()
+            if line.startswith(WORKER_DONE) or line.startswith(WORKER_SKIPPED):
+                self.done.put((i, line.startswith(WORKER_DONE), None))
+            else:
+                lastLines.append(line)
+        self.done.put((i, None, "\n".join(lastLines)))
+
+    def submit(self, inputPaths, outputPath, data):
+        """
+        Starts packing the frames at `inputPaths` into `outputPath` on an idle
+        worker, which must exist (i.e., `idle` must not be empty).  When finished,
+        the arbitrary `data` is returned by `finish`.
+        """
+
+        i = self.idle.pop(0)
+        self.pending[i] = data
+        self.processes[i].stdin.write(json.dumps({ "inputs": inputPaths, "output": outputPath }) + "\n")
+        self.processes[i].stdin.flush()
+
+    def finish(self):
+        """
+        Waits for a worker to finish, and returns a tuple, (`data`, `packed`), of
+        the `data` from `submit` and whether the frames were packed (not skipped).
+        """
+
+        i, packed, lastLines = self.done.get()
+        if packed == None:
+            raise RuntimeError("Packing worker {} failed, with exit code {}:\n{}".format(i, self.processes[i].wait(), lastLines))
+        self.idle.append(i)
+        return (self.pending.pop(i), packed)
+
+    def close(self):
+        for process in self.processes:
+            process.stdin.close()
+        for process in self.processes:
+            process.wait()
+
+WORKER_DONE = "Packed:"
+WORKER_SKIPPED = "Skipped:"
+
+def runWorker(outputFormat, packedOrder):
+    """
+    The loop run by a packing worker process, which packs the group of frames
+    read from each line of standard input, and then reports it on standard output.
+    """
+
+    packer = TriplePacker(outputFormat, packedOrder)
+    for line in sys.stdin:
+        request = json.loads(line)
+        packed = packer.pack(request["inputs"], request["output"])
+        print("{} {}".format(WORKER_DONE if packed else WORKER_SKIPPED, request["output"]))
+        sys.stdout.flush()
+    packer.close()
+
+def pack(inputDir, triples, outputDir, outputFormat, outputExt, packedOrder="RGB", workers=1, prefetch=4):
+    """
+    Packs each group of three input frames from the iterable `triples` (file
+    names in `inputDir`, as from `inputFrameTriples` or `watchInputFrameTriples`)
+    into an output frame in `outputDir`, named for the first frame of the group,
+    with the file format `outputFormat` and extension `outputExt`, and with the
+    channels in `packedOrder`.  The frames are read ahead by up to `prefetch`
+    groups, and with `workers` greater than one, are packed in that many
+    background Blender processes.  The output frames are completed in order.
+    """
+
+    triplesQueue = prefetchTriples(triples, inputDir, prefetch)
+    packer = None
+    pool = None
+    if workers > 1:
+        pool = PackingWorkers(bpy.app.binary_path, workers, outputFormat, packedOrder)
+    else:
+        packer = TriplePacker(outputFormat, packedOrder)
+
+    # Output frames finished out of order wait here until the earlier ones finish.
+    finished = {}
+    nextIndex = 0
+
+    def complete(index, outputPath, packed):
+        nonlocal nextIndex
+        finished[index] = (outputPath, packed)
+        while nextIndex in finished:
+            outputPath, packed = finished.pop(nextIndex)
+            if packed:
+                os.replace(partialOutputPath(outputPath), outputPath)
+                print("Packed {}".format(outputPath))
+            nextIndex += 1
+
+    index = 0
+    try:
+        while True:
+            item = triplesQueue.get()
+            if item == None:
+                break
+            triple, futures = item
+            concurrent.futures.wait(futures)
+            inputPaths = [os.path.join(inputDir, f) for f in triple]
+            outputPath = os.path.join(outputDir, os.path.splitext(triple[0])[0]) + outputExt
+
+            if pool == None:
+                complete(index, outputPath, packer.pack(inputPaths, partialOutputPath(outputPath)))
+            else:
+                while not pool.idle:
+                    (doneIndex, donePath), packed = pool.finish()
+                    complete(doneIndex, donePath, packed)
+                pool.submit(inputPaths, partialOutputPath(outputPath), (index, outputPath))
+            index += 1
+
+        if pool != None:
+            while pool.pending:
+                (doneIndex, donePath), packed = pool.finish()
+                complete(doneIndex, donePath, packed)
+    finally:
+        if pool != None:
+            pool.close()
+        if packer != None:
+            packer.close()
 
 if __name__ == "__main__":
     timeStart = datetime.datetime.now()
@@ -116,6 +434,18 @@ if __name__ == "__main__":
     parser.add_argument("--start", "-s", dest="start", type=int, help="first frame to comp")
     parser.set_defaults(end=999999)
     parser.add_argument("--end", "-e", dest="end", type=int, help="last frame to comp")
+    parser.set_defaults(step=1)
+    parser.add_argument("--step", "-j", dest="step", type=int, help="number of frames between input frames, with --watch")
+    parser.set_defaults(workers=1)
+    parser.add_argument("--workers", "-w", dest="workers", type=int, help="number of Blender processes packing frames in parallel")
+    parser.set_defaults(prefetch=4)
+    parser.add_argument("--prefetch", "-pf", dest="prefetch", type=int, help="number of groups of three input frames to read ahead")
+    parser.set_defaults(watch=False)
+    parser.add_argument("--watch", "-wa", dest="watch", action="store_true", help="pack frames as they are rendered into the input directory")
+    parser.set_defaults(watchTimeout=0)
+    parser.add_argument("--watchTimeout", "--watch-timeout", "-wt", dest="watchTimeout", type=float, help="seconds without new input frames before --watch stops (0: never)")
+    parser.set_defaults(worker=False)
+    parser.add_argument("--worker", dest="worker", action="store_true", help="run as a packing process for --workers, reading from standard input")
     args = parser.parse_args(argv)
 
     outputFormat = args.outputFormat.upper()
@@ -126,8 +456,17 @@ if __name__ == "__main__":
     print("Using output format: {}".format(outputFormat))
 
     packedOrder = args.packedOrder.upper()
+    try:
+        packedChannelIndices(packedOrder)
+    except ValueError as e:
+        print(str(e))
+        quit()
     print("Using packed order: {}".format(packedOrder))
 
+    if args.worker:
+        runWorker(outputFormat, packedOrder)
+        quit()
+
     if args.inputDir == None:
         parser.print_help()
         quit()
@@ -138,11 +477,18 @@ if __name__ == "__main__":
         outputDir += "/"
     print("Using output directory: {}".format(outputDir))
 
-    inputFrames = findInputFrames(args.inputDir, args.start, args.end)
-    (imageNode0, imageNode1, imageNode2, outputNode) = setupNodes(outputFormat, packedOrder)
-    imageNodes = [imageNode0, imageNode1, imageNode2]
-    setupRender()
-    pack(args.inputDir, inputFrames, imageNodes, outputNode, args.outputDir, outputExt)
+    os.makedirs(outputDir, exist_ok=True)
+
+    if args.watch:
+        if args.watchTimeout > 0:
+            print("Watching for input frames, until none are new for {} seconds".format(args.watchTimeout))
+        else:
+            print("Watching for input frames, through frame {}".format(args.end))
+        triples = watchInputFrameTriples(args.inputDir, args.start, args.end, args.step, args.watchTimeout or None)
+    else:
+        triples = inputFrameTriples(findInputFrames(args.inputDir, args.start, args.end))
+    print("Using {} packing process(es)".format(max(args.workers, 1)))
+    pack(args.inputDir, triples, outputDir, outputFormat, outputExt, packedOrder, args.workers, args.prefetch)
 
     timeEnd = datetime.datetime.now()
     print("Packing started at {}".format(timeStart))
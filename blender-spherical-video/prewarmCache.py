@@ -0,0 +1,129 @@
+# Builds the sampling indices cache files for a list of configurations ahead of
+# rendering, computing the configurations in parallel on several cores.  Then
+# the rendering jobs (e.g., on a render farm) all find the cache files, and do
+# not all compute the sampling indices at once.
+
+# Run with Python (not in Blender), with a configuration for each cache file, as
+# "width,height[,cubeSize[,subWidth[,subHeight[,projection[,polarCubeSize]]]]]", where omitted or
+# empty values have the same defaults as in sphericalVideo.py, e.g.:
+# python prewarmCache.py 1280,720 1920,1080,,3,3,mercator -cd /shared/samplingIndexCache
+# Use the same `--filter` and `--adaptive` as the rendering jobs, since they
+# have their own cache files.
+
+import argparse
+import datetime
+import multiprocessing
+import os
+import os.path
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsProjections import getProjection, projectionNames
+from utilsSampling import Sizes, getProjectionTag, computeFilteredSamplingIndices, SamplingIndices, FILTERS, \
+                          cacheFilePath, readSamplingIndicesFromCache, writeSamplingIndicesToCache
+
+def parseConfiguration(config, adaptive=False):
+    """
+    Returns a tuple, (`sizes`, `projection`), for the configuration string
+    `config`, in the format described at the top of this file, with adaptive
+    `sizes` if `adaptive` is `True`.  The projection is a name or number of one
+    of the `PROJECTIONS` in utilsProjections.py.
+    """
+
+    values = config.split(",")
+    if len(values) < 2 or len(values) > 7:
+        raise ValueError("Configuration '{}' must have from 2 to 7 values".format(config))
+    values += [""] * (7 - len(values))
+    width = int(values[0])
+    height = int(values[1])
+    cubeSize = int(values[2]) if values[2] else max(int(width * 0.75), int(height * 0.75))
+    subWidth = int(values[3]) if values[3] else 3
+    subHeight = int(values[4]) if values[4] else 3
+    try:
+        projection = getProjection(values[5] if values[5] else "equirectangular")
+    except ValueError:
+        raise ValueError("Configuration '{}' has unknown projection '{}'".format(config, values[5]))
+    polarCubeSize = int(values[6]) if values[6] else None
+    return (Sizes(width, height, cubeSize, subWidth, subHeight, polarCubeSize, adaptive), projection)
+
+def prewarmConfiguration(config, cacheDir=None, force=False, cacheLimit=None, filter="nearest", adaptive=False):
+    """
+    Builds the cache file for the configuration string `config`, `filter` and
+    `adaptive` (as in `parseConfiguration`) in `cacheDir` (or the default cache
+    directory if `None`), unless a valid cache file exists already and `force`
+    is `False`.  The total size of the cache files is limited to `cacheLimit`
+    megabytes, as in `createSamplingIndices`.  Returns a tuple, (`config`,
+    `path`, `built`, `seconds`), where `built` is `False` if the existing file
+    was used, and `path` is `None` if the file could not be written.
+    """
+
+    t0 = time.time()
+    sizes, mapToLatLon = parseConfiguration(config, adaptive)
+    projectionTag = getProjectionTag(mapToLatLon)
+    if not force and readSamplingIndicesFromCache(sizes, projectionTag, cacheDir, filter) != None:
+        return (config, cacheFilePath(sizes, projectionTag, cacheDir, filter), False, time.time() - t0)
+    samplingIndices = SamplingIndices(*computeFilteredSamplingIndices(sizes, mapToLatLon, filter))
+    path = writeSamplingIndicesToCache(sizes, projectionTag, samplingIndices, cacheDir, cacheLimit, filter)
+    return (config, path, True, time.time() - t0)
+
+def prewarmConfigurationArgs(args):
+    return prewarmConfiguration(*args)
+
+def prewarmCache(configs, workers, cacheDir=None, force=False, cacheLimit=None, filter="nearest", adaptive=False):
+    """
+    Builds the cache files for the configuration strings `configs`, with
+    `workers` processes in parallel.  Returns `True` if all the cache files
+    were written.
+    """
+
+    success = True
+    pool = multiprocessing.Pool(max(1, min(workers, len(configs))))
+    try:
+        for config, path, built, seconds in pool.imap_unordered(prewarmConfigurationArgs,
+                                                                 [(config, cacheDir, force, cacheLimit, filter, adaptive)
+                                                                  for config in configs]):
+            if path == None:
+                success = False
+                print("Failed: '{}'".format(config))
+            elif built:
+                print("Built '{}' for '{}', {:.2f} secs".format(path, config, seconds))
+            else:
+                print("Already built '{}' for '{}'".format(path, config))
+            sys.stdout.flush()
+    finally:
+        pool.close()
+        pool.join()
+    return success
+
+if __name__ == "__main__":
+    timeStart = datetime.datetime.now()
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument("configs", nargs="+", metavar="config",
+                        help="width,height[,cubeSize[,subWidth[,subHeight[,projection[,polarCubeSize]]]]] (projection: {})".format(projectionNames()))
+    parser.set_defaults(workers=os.cpu_count())
+    parser.add_argument("--workers", "-w", type=int, dest="workers", help="number of configurations to build in parallel")
+    parser.add_argument("--cache-dir", "-cd", dest="cacheDir", help="directory for the cache files")
+    parser.add_argument("--cache-limit", "-cl", type=float, dest="cacheLimit", help="maximum total size of the cache files, in megabytes")
+    parser.set_defaults(filter="nearest")
+    parser.add_argument("--filter", "-fi", dest="filter", choices=FILTERS, help="filter for combining the subsamples of each pixel")
+    parser.set_defaults(adaptive=False)
+    parser.add_argument("--adaptive", "-ad", dest="adaptive", action="store_true", help="build the cache files for adaptive subsamples")
+    parser.set_defaults(force=False)
+    parser.add_argument("--force", "-f", dest="force", action="store_true", help="rebuild cache files that exist already")
+    args = parser.parse_args()
+
+    try:
+        for config in args.configs:
+            parseConfiguration(config)
+    except ValueError as e:
+        print(str(e))
+        sys.exit(1)
+
+    success = prewarmCache(args.configs, args.workers, args.cacheDir, args.force, args.cacheLimit, args.filter, args.adaptive)
+
+    print("Prewarming started at {}".format(timeStart))
+    print("Prewarming ended at {}".format(datetime.datetime.now()))
+    if not success:
+        sys.exit(1)
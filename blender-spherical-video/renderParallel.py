@@ -0,0 +1,121 @@
+# Renders the frames of a spherical video with several background Blender
+# processes running sphericalVideo.py in parallel, each rendering a shard of the
+# frames (every N-th frame, for N processes).  All the processes write to the
+# same output directory, using the same layout as a single sphericalVideo.py run,
+# and share the same sampling indices cache.  Running several processes keeps
+# both the GPU (rendering) and the CPU (resampling) busy.
+
+# Run with Python (not in Blender), with the arguments for sphericalVideo.py
+# after the "--", e.g.:
+# python renderParallel.py -w 4 -- -i examples/exampleBasic.blend -o /tmp/example
+
+import argparse
+import collections
+import datetime
+import os
+import os.path
+import subprocess
+import sys
+import threading
+
+def sphericalVideoCommand(blender, sphericalVideoArgs):
+    """
+    Returns the command to run sphericalVideo.py in a background instance of
+    the Blender executable `blender`, with the arguments `sphericalVideoArgs`.
+    """
+
+    script = os.path.join(os.path.dirname(os.path.realpath(__file__)), "sphericalVideo.py")
+    return [blender, "--background", "--python", script, "--"] + sphericalVideoArgs
+
+class Progress:
+    """
+    Tracks the number of frames rendered by all the shards, as reported in the
+    output of the sphericalVideo.py processes.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.total = 0
+        self.done = 0
+
+    def addFrames(self, count):
+        with self.lock:
+            self.total += count
+
+    def frameDone(self, shardIndex, line):
+        with self.lock:
+            self.done += 1
+            print("Shard {}: {} ({} of {} frames)".format(shardIndex, line, self.done, self.total))
+            sys.stdout.flush()
+
+def runShard(command, shardIndex, progress, results):
+    """
+    Runs `command` for the shard `shardIndex`, reporting its rendered frames to
+    `progress`.  Stores the exit code and the last lines of output in `results`.
+    """
+
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                               universal_newlines=True, bufsize=1)
+    lastLines = collections.deque(maxlen=50)
+    for line in process.stdout:
+        line = line.rstrip()
+        lastLines.append(line)
+        if line.startswith("Frames to render: "):
+            progress.addFrames(int(line.split(":")[1]))
+        elif line.startswith("Saved '"):
+            progress.frameDone(shardIndex, line)
+    results[shardIndex] = (process.wait(), lastLines)
+
+def renderParallel(blender, workers, sphericalVideoArgs):
+    """
+    Renders the frames specified by `sphericalVideoArgs` with `workers` instances
+    of the Blender executable `blender` in parallel.  Returns `True` if all
+    of the instances succeeded.
+    """
+
+    if not "--nocache" in sphericalVideoArgs and not "-nc" in sphericalVideoArgs:
+        # Build the sampling indices cache once, so the workers do not all build it.
+        print("Building sampling indices cache...")
+        subprocess.check_call(sphericalVideoCommand(blender, sphericalVideoArgs + ["--cache-only"]),
+                              stdout=subprocess.DEVNULL)
+
+    progress = Progress()
+    results = [None] * workers
+    threads = []
+    for i in range(workers):
+        shardArgs = sphericalVideoArgs + ["--shard-index", str(i), "--shard-count", str(workers)]
+        thread = threading.Thread(target=runShard, args=(sphericalVideoCommand(blender, shardArgs), i, progress, results))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    success = True
+    for i, (returnCode, lastLines) in enumerate(results):
+        if returnCode != 0:
+            success = False
+            print("Shard {} failed, with exit code {}:".format(i, returnCode))
+            print("\n".join(lastLines))
+    return success
+
+if __name__ == "__main__":
+    timeStart = datetime.datetime.now()
+    argv = sys.argv[1:]
+    sphericalVideoArgs = []
+    if "--" in argv:
+        sphericalVideoArgs = argv[argv.index("--") + 1:]
+        argv = argv[:argv.index("--")]
+
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(workers=2)
+    parser.add_argument("--workers", "-w", type=int, dest="workers", help="number of Blender processes to run in parallel")
+    parser.set_defaults(blender="blender")
+    parser.add_argument("--blender", "-b", dest="blender", help="path to the Blender executable")
+    args = parser.parse_args(argv)
+
+    success = renderParallel(args.blender, args.workers, sphericalVideoArgs)
+
+    timeEnd = datetime.datetime.now()
+    print("Rendering started at {}".format(timeStart))
+    print("Rendering ended at {}".format(timeEnd))
+    if not success:
+        sys.exit(1)
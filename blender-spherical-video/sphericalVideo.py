@@ -1,354 +1,78 @@
 # A script for Blender to render the frames of an animation for a
-# 360-degree spherical view around a camera, using a standard map projection
-# (equirectangular or Mercator).
+# 360-degree spherical view around a camera, using one of the projections in
+# utilsProjections.py (e.g., equirectangular, Mercator, equi-angular cubemap or
+# dome master).
 
 import argparse
 import bpy
 import datetime
+import json
 import math
-import mathutils
+import numpy as np
 import os
 import os.path
 import sys
 import time
 
 sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsEncoding import ENCODER_PRESETS, findFFmpeg, movieFileName, ffmpegCommand, MovieStream
 from utilsFormats import fileFormatToExt, unknownFormatErrorMessage
+from utilsPacking import packedChannelIndices
+from utilsPipeline import ResamplingPipeline
+from utilsProjections import getProjection, projectionNames, StackedProjection
+from utilsSampling import PI_OVER_2, FILTERS, mapToLatLonMercator, mapToLatLonEquirectangular, \
+                          Sizes, createSamplingIndices, getProjectionTag, flatSamplingIndices, flatSamplingWeights, \
+                          resampleCubePixels, sizesSuffix, faceBounds
 
 BLENDER_LEGACY_VERSION = bpy.app.version < (2, 80, 0)
 
-# The maximum north latitude (and minimum south latitude) to be used for
-# the Mercator projection (which is undefined at the poles).
-MAX_LAT_MERCATOR = math.radians(85)
-
-# The Y value that corresponds to MAX_LAT_MERCATOR.
-# Computed as: math.log(math.tan(math.pi / 4 + MAX_LAT / 2))
-# From: https://en.wikipedia.org/wiki/Mercator_projection
-Y_FOR_MAX_LAT_MERCATOR = 3.131301331471645
-
-# For floating-point comparisons.
-EPS = 1e-10
-
-# For efficiency.
-PI_OVER_2 = math.pi / 2
-
-def mapToLatLonMercator(x, y, width, height):
-    """
-    Convert from a location, `x`, `y`, in a final map image (of total size:
-    `width`, `height`) to a tuple, `(latidude, longitude)`, using the
-    Mercator projection.
-    Latitude goes from -`MAX_LAT` at `y` == 0 to `MAX_LAT` at `y` == `height`.
-    Longitude goes from -`math.pi` at `x` == 0 to `math.pi` at `x` == `width`.
-    """
-
-    # Formulas from: https://en.wikipedia.org/wiki/Mercator_projection
-    # In those formulas, lambda is longitude.
-    # Use radius of 1.
-    lon = (2 * (x / width) - 1) * math.pi
-    # “The ordinate y of the Mercator projection becomes infinite at the poles
-    # and the map must be truncated at some latitude less than ninety degrees.”
-    # Longitude of 85 degrees corresponds to y of 3.1.
-    # MAX_LAT is a more exact calculation of this y.
-    y1 = (2 * (y / height) - 1) * Y_FOR_MAX_LAT_MERCATOR
-    lat =  2 * math.atan(math.exp(y1)) - PI_OVER_2
-    return (lat, lon)
-
-def mapToLatLonEquirectangular(x, y, width, height):
-    """
-    Convert from a location, `x`, `y`, in a final map image (of total size:
-    `width`, `height`) to a tuple, `(latidude, longitude)`, using the
-    equirectangular projection.
-    Latitude goes from -`math.py/2` at `y` == 0 to `math.pi/2` at `y` == `height`.
-    Longitude goes from -`math.pi` at `x` == 0 to `math.pi` at `x` == `width`.
-    """
-
-    # Formulas from: https://en.wikipedia.org/wiki/Equirectangular_projection
-    # In those formulas, lambda is longitude.
-    # Use radius of 1.
-    lon = (2 * (x / width) - 1) * math.pi
-    lat = (2 * (y / height) - 1) * PI_OVER_2
-    return (lat, lon)
-
-def latLonToVector(lat, lon):
-    """
-    Convert a latitude, `lat`, and longitude, `lon` to a 3D vector of type
-    `mathutils.Vector` pointing from the center of the sphere to the point
-    with that latitude and longitude.  Assumes that the "up" axis is the positive
-    Z axis, as is the default for Blender.
-    """
-
-    # Use radius of 1.
-    lat1 = PI_OVER_2 - lat
-    s = math.sin(lat1)
-    x = s * math.cos(lon)
-    y = -s * math.sin(lon)
-    z = math.cos(lat1)
-    return mathutils.Vector((x, y, z))
-
-def cubeIntersection(ray, prevInter=0):
-    """
-    Returns the intersection of `ray` with a 3D unit cube (going from -1 to 1 in
-    each dimension).  The `ray` is a 3D unit vector of type `mathutils.Vector`,
-    assumed to be eminating from the origin.  The result is a tuple, (`i`, `p`):
-    `i` is the index of the face intersected (0 for the face at X == 1, 1 for
-    X == -1, 2 for Y == 1, 3 for Y == -1, 4 for Z == 1, 5 for Z == -1), and
-    `p` is the 2D intersection point on the face, of type `mathutils.Vector`,
-    with each coordinate in [-1, 1].  For efficiency, `prevInter` should be
-    the index of the face intersected for the preceding pixel; in many cases,
-    that face will be interesected again for the current pixel, so testing it
-    first allows the function to terminate more quickly.
-    """
-
-    faces = [0, 1, 2, 3, 4, 5]
-    faces[0] = prevInter
-    faces[prevInter] = 0
-    for i in faces:
-        axis = int(i / 2)
-        dot = ray[axis]
-        if i % 2 == 1:
-            dot = -dot
-
-        # If dot is negative, then ray is pointing away from this face,
-        # and only the flipped ray would interset the face.
-        # If dot is essentially 0 (less than EPS) then the ray is parallel
-        # to the face and would never intersect it.
-        if dot < EPS:
-            continue
-
-        pt = []
-        for j in [k for k in range(3) if k != axis]:
-            inter = ray[j] / dot
-            if abs(inter) <= 1:
-                pt.append(inter)
-            else:
-                break
-        if len(pt) == 2:
-            return (i, mathutils.Vector(pt))
-
-    # Should never happen.
-    return None
-
-class Sizes:
-    """
-    A convenient collection of the sizes used in the conversion from six images
-    on the face of a cube to the final spherical image.
-    `width` and `height` are the dimension, in pixels, of the final image.
-    `cube` is width and height of each cube image.
-    `subWidth` and `subHeight` give the number of subsamples used to compute
-    each pixel in the final image.
-    """
-    def __init__(self, width, height, cubeSize, subWidth, subHeight):
-        self.width = width
-        self.height = height
-        self.cube = cubeSize
-        self.subWidth = subWidth
-        self.subHeight = subHeight
-
-def createSamplingIndices(sizes, mapToLatLon=mapToLatLonEquirectangular, cache=True):
-    """
-    Returns the indices used to resample the rendered cube images into the final
-    spherical image.  The indices consist of a list with one element per final
-    image pixel.  That element is itself a list of tuples, one for each of the
-    subsamples used to compute the pixel.  Each tuple has the form `(i, x, y)`,
-    as returned by `cubeIntersection`: `i` is the index of a face image, and
-    `x` and `y` are a point on that image from which to sample. The `mapToLatLon`
-    function is used to compute latitudes and longitudes, and is an argument so
-    different projections (e.g., equirectangular, Mercator) can be supported.
-    Note that the indices depend only on the various image dimensions in `sizes`
-    and do not depend on the actual cube images.  Thus, the indices can be
-    computed once at the beginning of the rendering of an animation, and reused
-    at each frame.  In fact, the indices are cached and reused across animations,
-    unless the `cache` argument is `False`.
-    """
-    projectionTag = getProjectionTag(mapToLatLon)
-    if cache:
-        cachedResult = readSamplingIndicesFromCache(sizes, projectionTag)
-        if cachedResult != None:
-            print("Using cached sampling indices")
-            return cachedResult
-    else:
-        print("Ignoring the samping indices cache")
-
-    result = []
-    xSubDx = 1 / (sizes.subWidth + 1)
-    ySubDy = 1 / (sizes.subHeight + 1)
-
-    # Initialize inter as if there was as previous call to cubeIntersection()
-    # that intersected face 0.  That way, all faces will be considered.
-    inter = [0]
-
-    # The X computed by cubeIntersection could be either left or right in the
-    # cube face image to be sampled.  This factor gives it the correct orientation
-    # for the face that was intersected.
-    orientation = [-1, 1, 1, -1, -1, 1]
-
-    # Local variables for functions improve peformance, according to timing tests.
-    # See https://wiki.python.org/moin/PythonSpeed/PerformanceTips
-    append = list.append
-    # But using local variables for the instance attributes of "sizes" did not
-    # give much improvement.
-
-    nSub = sizes.subWidth * sizes.subHeight
-    for y in range(sizes.height):
-        for x in range(sizes.width):
-            append(result, [])
-            ySub = y + ySubDy
-            for _ in range(sizes.subHeight):
-                xSub = x + xSubDx
-                for _ in range(sizes.subWidth):
-                    latLon = mapToLatLon(xSub, ySub, sizes.width, sizes.height)
-                    ray = latLonToVector(latLon[0], latLon[1])
-                    inter = cubeIntersection(ray, inter[0])
-
-                    face = inter[0]
-                    xInter = inter[1][0] * orientation[face]
-                    yInter = inter[1][1]
-
-                    xFace = int(sizes.cube * ((xInter + 1) / 2))
-                    yFace = int(sizes.cube * ((yInter + 1) / 2))
-                    append(result[-1], (face, xFace, yFace))
-                    xSub += xSubDx
-                ySub += ySubDy
-
-    if cache:
-        writeSamplingIndicesToCache(sizes, projectionTag, result)
-
-    return result
-
-def toBinary(samplingIndices):
-    """
-    Converts the structure returned by `createSamplingIndices` into a binary
-    form, appropriate for storing in a cache file.
-    """
-
-    # Local variables for functions improve peformance, according to timing tests.
-    # See https://wiki.python.org/moin/PythonSpeed/PerformanceTips
-    toBytes = int.to_bytes
-
-    ba = bytearray()
-    for pixel in samplingIndices:
-        for sample in pixel:
-            ba += toBytes(sample[0], 1, "big")
-            ba += toBytes(sample[1], 2, "big")
-            ba += toBytes(sample[2], 2, "big")
-    return ba
-
-def fromBinary(sizes, ba):
-    """
-    Converts `ba`, the binary form returned by `toBinary`, back into a structure
-    like that returned by `createSamplingIndices`.
-    """
-
-    samplingIndices = []
-    IntsPerSample = 3
-    samplesPerPixel = sizes.subWidth * sizes.subHeight
-    intsPerPixel = IntsPerSample * samplesPerPixel
-    nInts = sizes.width * sizes.height * intsPerPixel
-    iBa = 0
-
-    # Local variables for functions improve peformance, according to timing tests.
-    # See https://wiki.python.org/moin/PythonSpeed/PerformanceTips
-    fromBytes = int.from_bytes
-    append = list.append
-
-    for i in range(0, nInts, IntsPerSample):
-        if i % intsPerPixel == 0:
-            append(samplingIndices, [])
-
-        # Unwinding the loop over the integers in one sample's tuple gives a
-        # significant improvement in performance, according to timing tests.
-        face = fromBytes(ba[iBa:iBa+1], "big")
-        xFace = fromBytes(ba[iBa+1:iBa+3], "big")
-        yFace = fromBytes(ba[iBa+3:iBa+5], "big")
-        iBa += 5
-        sample = (face, xFace, yFace)
-
-        append(samplingIndices[-1], sample)
-    return samplingIndices
-
-def cacheFilePath(sizes, projectionTag):
-    """
-    Returns the path to a cache file for the sampling indices built with the
-    image dimensions in `sizes` and the projection type indicated by
-    `projectionTag`.  Creates the directory for cache files if it does
-    not exist already.
-    """
-
-    path = os.path.dirname(os.path.realpath(__file__))
-    path = os.path.join(path, "samplingIndexCache")
-    if not os.path.exists(path):
-        os.mkdir(path)
-    file = "samplingIndices_w{}_h{}_cu{}_sw{}_sh{}_{}".\
-        format(sizes.width, sizes.height, sizes.cube, sizes.subWidth, sizes.subHeight, projectionTag)
-    return os.path.join(path, file)
-
-def writeSamplingIndicesToCache(sizes, projectionTag, samplingIndices):
-    """
-    Converts `samplingIndices` to binary and writes it to a cache file.  The
-    image dimensions from `sizes` and the projection type indicated by
-    `projectionTag` are used in the name of the cache file.
-    """
-
-    try:
-        path = cacheFilePath(sizes, projectionTag)
-        ba = toBinary(samplingIndices)
-        with open(path, "wb") as f:
-            f.write(ba)
-    except Exception as e:
-        print("Warning: cannot write sampling indices cache: '{}'".format(str(e)))
-
-
-def readSamplingIndicesFromCache(sizes, projectionTag):
-    """
-    Returns the sampling indices read from a cache file indentified by the image
-    dimensions from `sizes` and the projection type indicated by `projectionTag`.
-    The cache file must also have a modification time later than this source file.
-    If no matching cache exists, returns `None`.
-    """
-
-    try:
-        path = cacheFilePath(sizes, projectionTag)
-        if os.path.exists(path):
-            with open(path, "rb") as f:
-                creationTime = os.path.getmtime(path)
-                codeModificationTime = os.path.getmtime(__file__)
-                if creationTime > codeModificationTime:
-                    print("Reading sampling indices cache '{}'...".format(path))
-                    t0 = time.time()
-                    ba = bytearray(f.read())
-                    t1 = time.time()
-                    print("Done, {:.2f} secs".format(t1 - t0))
-                    print("Applying cache...")
-                    t0 = time.time()
-                    result = fromBinary(sizes, ba)
-                    t1 = time.time()
-                    print("Done, {:.2f} secs".format(t1 - t0))
-                    return result
-    except Exception as e:
-        print("Warning: cannot read sampling indices cache: '{}'".format(str(e)))
-    return None
-
-def getProjectionTag(mapToLatLon):
-    """
-    Returns a string indicating the type of projection used in `mapToLatLon`.
-    This string is used to tag a cache file.
-    """
-
-    if mapToLatLon == mapToLatLonEquirectangular:
-        return "eqrc"
-    elif mapToLatLon == mapToLatLonMercator:
-        return "merc"
-    else:
-        return "unkn"
-
-def getCubePixels(cubeImages):
-    """
-    Returns a list containing the raw pixels from the `bpy.types.Image` images
-    in the list `cubeImages`.  Factoring this functionality out into its own
-    function is useful for performance profiling.
-    """
-
-    return [face.pixels[:] for face in cubeImages]
+# For each side of the cube, the name of subdirectory of the output directory
+# where the rendered frames are stored, and the Euler angles to orient the
+# camera when rendering that side of the cube.
+CUBE_VIEWS = [
+    { "subdir" : "xPos", "rot" : (0,         0,         0) },
+    { "subdir" : "xNeg", "rot" : (math.pi,   0,         math.pi) },
+    { "subdir" : "yPos", "rot" : (0,         PI_OVER_2, 0) },
+    { "subdir" : "yNeg", "rot" : (0,        -PI_OVER_2, 0) },
+    { "subdir" : "zPos", "rot" : (0,        -PI_OVER_2, PI_OVER_2) },
+    { "subdir" : "zNeg", "rot" : (0,         PI_OVER_2, PI_OVER_2) }
+]
+
+# For stereo rendering, the eyes, in the order of their cube pixels: the suffix
+# of the names of their cube cameras (and so of the subdirectories for their saved
+# cube images), and the side of the camera, along its local X axis, to which
+# each is offset by half the interpupillary distance.
+STEREO_EYES = [
+    { "suffix" : "Left",  "side" : -1 },
+    { "suffix" : "Right", "side" : 1 }
+]
+
+# The interpupillary distance for stereo rendering, in Blender units (meters, by default).
+DEFAULT_IPD = 0.064
+
+def getCubePixels(cubeImages, cubePixels=None):
+    """
+    Returns a NumPy float32 array containing the raw pixels from the
+    `bpy.types.Image` images in the list `cubeImages`, concatenated, with one
+    row of four channels per pixel, followed by a blank (transparent) pixel for
+    the subsamples outside a projection's valid region (see `BLANK_FACE` in
+    utilsSampling.py).  The images may have different sizes (e.g., for
+    `Sizes.polarCube`).  If `cubePixels` is specified, it is an array of the
+    correct size that is filled and returned, so it can be reused across frames.
+    Factoring this functionality out into its own function is useful for
+    performance profiling.
+    """
+
+    ends = np.cumsum([len(face.pixels) // 4 for face in cubeImages])
+    if cubePixels is None:
+        cubePixels = np.zeros((ends[-1] + 1, 4), dtype=np.float32)
+    for face, pixels in zip(cubeImages, np.split(cubePixels[:ends[-1]], ends[:-1])):
+        pixels = pixels.reshape(-1)
+        if hasattr(face.pixels, "foreach_get"):
+            face.pixels.foreach_get(pixels)
+        else:
+            pixels[:] = face.pixels[:]
+    return cubePixels
 
 def makeEmpty(name, scene):
     """
@@ -376,56 +100,472 @@ def makeCamera(name, scene):
         scene.collection.objects.link(camera)
     return camera
 
-def makeImage(name, sizes, pixels):
+def makeCubeCameras(cam, scene, suffix="", offset=0):
     """
-    Returns a new `bpy.types.Image` with the specified `name` and `pixels`,
-    and having dimensions `sizes.width` and `sizes.height`.  Factoring this
-    functionality out into its own function is useful for performance profiling.
+    Returns a list of new cameras, one for each of the `CUBE_VIEWS`, named for
+    the view's subdirectory followed by `suffix`, with a common parent that is a
+    child of `cam` and is offset by `offset` along the local X axis of `cam`
+    (e.g., for one of the `STEREO_EYES`).
+    """
+
+    cubeCams = []
+    # This node is the parent of all the cube-face cameras, in case there is a
+    # need for reorienting all of them in unison.
+    cubeCamsParent = makeEmpty("CubeCameras" + suffix, scene)
+    cubeCamsParent.parent = cam
+    cubeCamsParent.location = (offset, 0, 0)
+    for view in CUBE_VIEWS:
+        cubeCam = makeCamera(view["subdir"] + suffix, scene)
+        cubeCam.parent = cubeCamsParent
+        cubeCam.rotation_euler = view["rot"]
+        cubeCams.append(cubeCam)
+    return cubeCams
+
+def eyeSuffixes(stereo):
+    """
+    Returns the list of suffixes of the cube camera names for each eye, a single
+    empty suffix unless `stereo` is `True`.
+    """
+
+    return [eye["suffix"] for eye in STEREO_EYES] if stereo else [""]
+
+def stereoSizes(sizes):
+    """
+    Returns the `Sizes` of a top-bottom stereo image with an image of `sizes`
+    for each eye, for `makeImage` and `saveSphericalImage`.
     """
 
-    result = bpy.data.images.new(name, width=sizes.width, height=sizes.height)
-    result.pixels = pixels
+    return Sizes(sizes.width, 2 * sizes.height, sizes.cube, sizes.subWidth, sizes.subHeight, sizes.polarCube, sizes.adaptive)
+
+def eyeCubePixels(cubePixels, sizes, nEyes):
+    """
+    Returns a list of the parts of `cubePixels` for each cube image, for
+    `nEyes` eyes, each with the six cube images and the blank pixel.
+    """
+
+    result = []
+    for eyePixels in np.split(cubePixels, nEyes):
+        result += np.split(eyePixels, sizes.faceOffsets()[1:-1])[:len(CUBE_VIEWS)]
+    return result
+
+def makeImage(name, sizes, pixels, image=None, floatBuffer=False):
+    """
+    Returns a new `bpy.types.Image` with the specified `name` and `pixels`,
+    and having dimensions `sizes.width` and `sizes.height`.  If `image` is
+    specified, it is an image of those dimensions from an earlier call, which
+    is reused instead of making a new one.  If `floatBuffer` is `True`, the new
+    image stores linear floating-point pixels, like a render result.  Factoring
+    this functionality out into its own function is useful for performance profiling.
+    """
+
+    result = image
+    if result == None:
+        result = bpy.data.images.new(name, width=sizes.width, height=sizes.height, float_buffer=floatBuffer)
+    if hasattr(result.pixels, "foreach_set"):
+        result.pixels.foreach_set(pixels)
+    else:
+        result.pixels = pixels
     return result
 
-def createImageFromSamplingIndices(samplingIndices, sizes, cubeImages):
+def createImageFromSamplingIndices(samplingIndices, sizes, cubeImages, cubePixels=None, image=None):
     """
     Returns the final spherical image by resampling the `cubeImages` according
     to the `samplingIndices`.  The width and height of the final image are
-    specified by `sizes`.
-    """
-
-    ChannelsPerPixel = 4
-    cubePixels = getCubePixels(cubeImages)
-    cubeSize = sizes.cube
-    resultPixels = [0, 0, 0, 1] * sizes.width * sizes.height
-    iResult = 0
-    for pixelIndex in samplingIndices:
-        pixel = [0, 0, 0, 1]
-        for subIndex in pixelIndex:
-            facePixels = cubePixels[subIndex[0]]
-            xFace = subIndex[1]
-            yFace = subIndex[2]
-            iSub = (yFace * cubeSize + xFace) * ChannelsPerPixel
-            for l in range(ChannelsPerPixel):
-                pixel[l] += facePixels[iSub + l]
-        pixel = [x / len(pixelIndex) for x in pixel]
-        for l in range(ChannelsPerPixel):
-            resultPixels[iResult + l] = pixel[l]
-        iResult += ChannelsPerPixel
-    return makeImage("createImageFromSamplingIndices", sizes, resultPixels)
-
-def render(cameraName, outputBasePath, sizes, start=1, end=250, step=1, mercator=False, format="PNG", ext=".png", cache=True):
+    specified by `sizes`.  To avoid allocating new buffers and images at each
+    frame of an animation, `cubePixels` can be an array to hold the cube
+    images' pixels (as in `getCubePixels`), and `image` can be the result from
+    the previous frame (as in `makeImage`).
+    """
+
+    cubePixels = getCubePixels(cubeImages, cubePixels)
+    return createImageFromCubePixels(samplingIndices, sizes, cubePixels, image)
+
+def createImageFromCubePixels(samplingIndices, sizes, cubePixels, image=None, floatBuffer=False):
+    """
+    Like `createImageFromSamplingIndices`, but resamples the cube images' pixels
+    already in the array `cubePixels`.  The `floatBuffer` argument is as in
+    `makeImage`.
+    """
+
+    flatIndices = flatSamplingIndices(samplingIndices, sizes)
+    resultPixels = resampleCubePixels(cubePixels, flatIndices, weights=flatSamplingWeights(samplingIndices, sizes))
+    return makeImage("createImageFromSamplingIndices", sizes, resultPixels, image, floatBuffer)
+
+def setRenderBorder(scene, bounds, faceSize):
+    """
+    Sets up the rendering of a cube image of size `faceSize` to render only the
+    region `bounds`, a rectangle from `faceBounds`, with a margin of one pixel,
+    or the whole image if `bounds` is `None`.  The render result keeps its full
+    size, with the pixels outside the region left blank, so the layout of the
+    pixels is the same as for the whole image.
+    """
+
+    if bounds == None or bounds == (0, 0, faceSize - 1, faceSize - 1):
+        scene.render.use_border = False
+        return
+    xMin, yMin, xMax, yMax = bounds
+    scene.render.use_border = True
+    scene.render.use_crop_to_border = False
+    # Image rows start at the bottom, as do the border's Y coordinates.
+    scene.render.border_min_x = max(0, xMin - 1) / faceSize
+    scene.render.border_max_x = min(faceSize, xMax + 2) / faceSize
+    scene.render.border_min_y = max(0, yMin - 1) / faceSize
+    scene.render.border_max_y = min(faceSize, yMax + 2) / faceSize
+
+def setupViewerNode(scene):
+    """
+    Adds a Viewer node (or reuses the one added by an earlier call) to the
+    compositing nodes of `scene`, showing the same image as the Composite node
+    (or the render layers, if there is no Composite node).  After each render, the pixels of the rendered image are then in the
+    "Viewer Node" image, so they can be used without saving and loading a file.
+    """
+
+    scene.use_nodes = True
+    scene.render.use_compositing = True
+    tree = scene.node_tree
+
+    source = None
+    for node in tree.nodes:
+        if node.type == "COMPOSITE" and node.inputs["Image"].is_linked:
+            source = node.inputs["Image"].links[0].from_socket
+    if source == None:
+        renderLayers = [node for node in tree.nodes if node.type == "R_LAYERS"]
+        if not renderLayers:
+            renderLayers = [tree.nodes.new(type="CompositorNodeRLayers")]
+        source = renderLayers[0].outputs["Image"]
+
+    # Reuse the Viewer node from an earlier call (e.g., for another camera).
+    viewer = tree.nodes.get("sphericalVideoViewer")
+    if viewer == None:
+        viewer = tree.nodes.new(type="CompositorNodeViewer")
+        viewer.name = "sphericalVideoViewer"
+    viewer.use_alpha = True
+    tree.links.new(source, viewer.inputs["Image"])
+    tree.nodes.active = viewer
+    return viewer
+
+def loadCubeFaces(facePaths, cubePixels=None):
+    """
+    Loads the cube images saved at `facePaths` into `cubePixels`, as in
+    `getCubePixels`, and then removes the loaded images so they do not accumulate.
+    For stereo, `facePaths` has the six cube images of each of the `STEREO_EYES`,
+    loaded into consecutive equal parts of `cubePixels`, as in `getCubePixels` for
+    each eye.  Returns a tuple, (`cubePixels`, `linear`), where `linear` is `True`
+    if the images have linear floating-point pixels (e.g., OpenEXR) rather than
+    pixels with the color management of a saved render already applied.
+    """
+
+    nEyes = len(facePaths) // len(CUBE_VIEWS)
+    eyePixels = np.split(cubePixels, nEyes) if cubePixels is not None else [None] * nEyes
+    for eye in range(nEyes):
+        cubeImages = [bpy.data.images.load(path) for path in facePaths[eye * len(CUBE_VIEWS):(eye + 1) * len(CUBE_VIEWS)]]
+        try:
+            eyePixels[eye] = getCubePixels(cubeImages, eyePixels[eye])
+            linear = cubeImages[0].is_float
+        finally:
+            for image in cubeImages:
+                bpy.data.images.remove(image)
+    if cubePixels is None:
+        cubePixels = np.concatenate(eyePixels)
+    return (cubePixels, linear)
+
+def saveSphericalImage(outputPath, pixels, sizes, scene, image=None, linear=True):
+    """
+    Saves the final spherical image with the resampled `pixels` to `outputPath`.
+    If `linear` is `True`, the `pixels` are linear, from a render result, and
+    saving applies the scene's color management, as when saving a render.
+    Otherwise, the `pixels` are from cube images saved with that color management
+    already applied.  The `image` is reused as in `makeImage`, and is returned.
+    """
+
+    if image != None and image.is_float != linear:
+        bpy.data.images.remove(image)
+        image = None
+    image = makeImage("createImageFromSamplingIndices", sizes, pixels, image, floatBuffer=linear)
+    if linear:
+        image.save_render(outputPath, scene=scene)
+    else:
+        image.filepath_raw = outputPath
+        image.file_format = scene.render.image_settings.file_format
+        image.save()
+
+    if __name__ == "__main__":
+        print("Saved '{}'".format(outputPath))
+        print("")
+
+    return image
+
+def hasStandardColorManagement(scene):
+    """
+    Returns `True` if the color management of `scene` is the plain sRGB encoding
+    of the "Standard" view transform (with no look, exposure, gamma or curves),
+    which is what `frameBytes` applies to linear pixels.  Then a `MovieStream`
+    matches the images saved with `saveSphericalImage`.
+    """
+
+    view = scene.view_settings
+    return scene.display_settings.display_device == "sRGB" and view.view_transform == "Standard" and \
+           view.look in ["None", ""] and view.exposure == 0 and view.gamma == 1 and not view.use_curve_mapping
+
+class Manifest:
+    """
+    The record of the frames completed by rendering into the directory
+    `outputBasePath`, to allow an interrupted rendering to be resumed.  The record
+    is the file "manifest.jsonl" in that directory, with one line appended as
+    each frame's cube images (if saved) and each final spherical image are
+    completed.  Each line records the frame number, the output files and their
+    sizes, and a `fingerprint` of the settings that affect the output (image
+    sizes, projection, format), so only frames completed with the same settings
+    are reused.  Appending single lines keeps the file consistent when several
+    processes render shards into the same directory.
+    """
+    def __init__(self, outputBasePath, fingerprint):
+        self.outputBasePath = outputBasePath
+        self.fingerprint = fingerprint
+        self.path = os.path.join(outputBasePath, "manifest.jsonl")
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                lines = f.read()
+            for line in lines.splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A partial line from a rendering that was interrupted.
+                    continue
+                if entry.get("fingerprint") == fingerprint:
+                    self.entries[(entry["frame"], entry["kind"])] = entry["files"]
+            if lines and not lines.endswith("\n"):
+                # Keep a partial line from merging with the next line appended.
+                with open(self.path, "a") as f:
+                    f.write("\n")
+
+    def record(self, frame, kind, paths):
+        """
+        Records that the files at `paths` were completed for `frame`, with
+        `kind` being "faces" or "spherical".
+        """
+
+        files = {}
+        for path in paths:
+            files[os.path.relpath(path, self.outputBasePath)] = os.path.getsize(path)
+        self.entries[(frame, kind)] = files
+        line = json.dumps({ "frame": frame, "kind": kind, "fingerprint": self.fingerprint, "files": files })
+        with open(self.path, "a") as f:
+            f.write(line + "\n")
+
+    def isComplete(self, frame, kind):
+        """
+        Returns `True` if the files of `kind` were recorded for `frame`, and they
+        still exist with the recorded sizes.
+        """
+
+        files = self.entries.get((frame, kind))
+        if files == None:
+            return False
+        for file, size in files.items():
+            path = os.path.join(self.outputBasePath, file)
+            if not os.path.exists(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+def outputFingerprint(sizes, mapToLatLon, format, filter="nearest", ipd=None):
+    """
+    Returns a string identifying the settings that affect the final spherical
+    images, for use with `Manifest`.  For stereo images, `ipd` is the
+    interpupillary distance.
+    """
+
+    fingerprint = "w{}_h{}_cu{}_sw{}_sh{}{}_{}_{}".\
+        format(sizes.width, sizes.height, sizes.cube, sizes.subWidth, sizes.subHeight, sizesSuffix(sizes),
+               getProjectionTag(mapToLatLon), format)
+    if filter != "nearest":
+        fingerprint += "_" + filter
+    if ipd != None:
+        fingerprint += "_ipd{}".format(ipd)
+    return fingerprint
+
+def findSavedCubeFaces(outputBasePath, stereo=False):
+    """
+    Returns a tuple, (`ext`, `frames`), describing the cube images saved in the
+    subdirectories of `outputBasePath` (e.g., with `keepFaces` in `render`):
+    `ext` is their file extension, and `frames` is a sorted list of the numbers
+    of the frames for which all six cube images exist (for each of the
+    `STEREO_EYES`, if `stereo` is `True`).  Returns `(None, [])` if there are no
+    saved cube images.
+    """
+
+    for ext in fileFormatToExt.values():
+        frames = None
+        for subdir in [view["subdir"] + suffix for suffix in eyeSuffixes(stereo) for view in CUBE_VIEWS]:
+            path = os.path.join(outputBasePath, subdir)
+            files = os.listdir(path) if os.path.isdir(path) else []
+            found = set([int(os.path.splitext(f)[0]) for f in files
+                         if os.path.splitext(f)[1] == ext and os.path.splitext(f)[0].isdigit()])
+            frames = found if frames == None else frames & found
+        if frames:
+            return (ext, sorted(frames))
+    return (None, [])
+
+def savedCubeFacePaths(outputBasePath, frame, ext, stereo=False):
+    """
+    Returns the paths of the six cube images saved for `frame` in the
+    subdirectories of `outputBasePath`, with the file extension `ext` (for each
+    of the `STEREO_EYES`, in order, if `stereo` is `True`).
+    """
+
+    frameStr = str(frame).zfill(4) + ext
+    return [os.path.join(outputBasePath, view["subdir"] + suffix, frameStr)
+            for suffix in eyeSuffixes(stereo) for view in CUBE_VIEWS]
+
+def savedCubeFaceSize(outputBasePath, frame, ext, face=0, stereo=False):
+    """
+    Returns the width (and height) of the cube image saved for `frame` and
+    `face` (an index into `CUBE_VIEWS`), as in `savedCubeFacePaths`.
+    """
+
+    image = bpy.data.images.load(savedCubeFacePaths(outputBasePath, frame, ext, stereo)[face])
+    size = image.size[0]
+    bpy.data.images.remove(image)
+    return size
+
+def resamplingArrays(samplingIndices, sizes, stereo=False):
+    """
+    Returns a tuple, (`flatIndices`, `weights`, `nCubePixels`, `outputSizes`,
+    `eyes`), of the arrays for `resampleCubePixels` with `samplingIndices` for an
+    image of `sizes`, the number of cube pixels (rows of the `getCubePixels`
+    array), the sizes of the final image, and the number of eyes.  If `stereo` is
+    `True`, the final image is top-bottom stereo, resampled from the cube pixels
+    of each of the `STEREO_EYES` with the same `flatIndices` (passing `eyes` to
+    `resampleCubePixels`), so the indices are not duplicated for the second eye.
+    """
+
+    flatIndices = flatSamplingIndices(samplingIndices, sizes)
+    weights = flatSamplingWeights(samplingIndices, sizes)
+    nCubePixels = int(sizes.faceOffsets()[-1])
+    if not stereo:
+        return (flatIndices, weights, nCubePixels, sizes, 1)
+    return (flatIndices, weights, len(STEREO_EYES) * nCubePixels, stereoSizes(sizes), len(STEREO_EYES))
+
+def eyeProjection(projection, stereo=False):
+    """
+    Returns the `Projection` for each eye's image, for `projection` (anything
+    accepted by `getProjection`): for stereo, a top-bottom layout (a
+    `StackedProjection`) is replaced by the projection of its halves.
+    """
+
+    projection = getProjection(projection)
+    if stereo and isinstance(projection, StackedProjection):
+        return projection.inner
+    return projection
+
+def resampleSavedCubeFaces(outputBasePath, sizes, frames, faceExt, projection="equirectangular", format="PNG", ext=".png", cache=True,
+                           pipelineDepth=0, cacheDir=None, cacheLimit=None, filter="nearest", stereo=False, ipd=DEFAULT_IPD):
+    """
+    Builds the final spherical images for the specified `frames` by resampling
+    the cube images saved in the subdirectories of `outputBasePath`, with file
+    extension `faceExt`, without rendering.  Thus, the final images can be rebuilt
+    with a different projection or different sizes (except `sizes.cube`, which must
+    match the saved cube images).  The other arguments are as in `render`.
+    """
+
+    scene = bpy.context.scene
+    scene.render.image_settings.file_format = format
+
+    mappingFunc = eyeProjection(projection, stereo)
+    samplingIndices = createSamplingIndices(sizes, mappingFunc, cache, cacheDir, cacheLimit, filter=filter)
+    flatIndices, weights, nCubePixels, outputSizes, eyes = resamplingArrays(samplingIndices, sizes, stereo)
+
+    outputSphericalPath = os.path.join(outputBasePath, "spherical/")
+    os.makedirs(outputSphericalPath, exist_ok=True)
+    manifest = Manifest(outputBasePath, outputFingerprint(sizes, mappingFunc, format, filter, ipd if stereo else None))
+
+    if __name__ == "__main__":
+        print("Frames to render: {}".format(len(frames)))
+
+    cubePixels = np.zeros((nCubePixels, 4), dtype=np.float32)
+    image = None
+
+    # With a pipeline, the resampling of each frame overlaps the loading and
+    # saving of other frames.
+    pipeline = None
+    if pipelineDepth > 0:
+        python = bpy.app.binary_path_python if hasattr(bpy.app, "binary_path_python") else sys.executable
+        pipeline = ResamplingPipeline(python, flatIndices, nCubePixels, pipelineDepth, weights, eyes)
+
+    # The pipeline's process and buffers are removed even after an error.
+    try:
+        for frame in frames:
+            outputPath = os.path.join(outputSphericalPath, str(frame).zfill(4) + ext)
+            facePaths = savedCubeFacePaths(outputBasePath, frame, faceExt, stereo)
+
+            if pipeline != None:
+                slot = pipeline.acquire()
+                while slot == None:
+                    (doneFrame, donePath, linear), pixels = pipeline.finish()
+                    image = saveSphericalImage(donePath, pixels, outputSizes, scene, image, linear)
+                    manifest.record(doneFrame, "spherical", [donePath])
+                    slot = pipeline.acquire()
+                cubePixels, linear = loadCubeFaces(facePaths, pipeline.cubePixels[slot])
+                pipeline.submit(slot, (frame, outputPath, linear))
+                continue
+
+            cubePixels, linear = loadCubeFaces(facePaths, cubePixels)
+            pixels = resampleCubePixels(cubePixels, flatIndices, weights=weights, eyes=eyes)
+            image = saveSphericalImage(outputPath, pixels, outputSizes, scene, image, linear)
+            manifest.record(frame, "spherical", [outputPath])
+
+        if pipeline != None:
+            while pipeline.pending:
+                (doneFrame, donePath, linear), pixels = pipeline.finish()
+                image = saveSphericalImage(donePath, pixels, outputSizes, scene, image, linear)
+                manifest.record(doneFrame, "spherical", [donePath])
+    finally:
+        if pipeline != None:
+            pipeline.close()
+
+def render(cameraName, outputBasePath, sizes, start=1, end=250, step=1, projection="equirectangular", format="PNG", ext=".png", cache=True,
+           keepFaces=False, shardIndex=0, shardCount=1, pipelineDepth=0, resume=False, cacheDir=None,
+           cacheLimit=None, filter="nearest", cropFaces=True, stereo=False, ipd=DEFAULT_IPD, movie=None, saveFrames=True):
     """
     Renders an animation of the spherical image around the camera named
     `cameraName`.  The spherical image is built by resampling images on the
     faces of a cube around the camera.  The final spherical image frames are
     stored in the "spherical" subdirectory of the base directory specified by
-    `outputBasePath`.  The intermedial cube image frames are stored in other
-    subdirectories of `outputBasePath`.  The dimensions of the intermediate and
-    final images are specified by `sizes`.  The frames included in the animation
-    are specified by `start`, `end` and `step`.  The file format of the output
-    images is `format`, which must be one of Blender's supported formats, and
-    `ext` is the corresponding file extension.
+    `outputBasePath`.  The cube images are resampled directly from the render
+    result, and are stored in other subdirectories of `outputBasePath` only if
+    `keepFaces` is `True`.  The dimensions of the intermediate and final images
+    are specified by `sizes`, and the polar cube images are rendered at the size
+    `sizes.polarCube`.  The `projection` is anything accepted by `getProjection`
+    (e.g., the name or number of one of the `PROJECTIONS`).  The frames included
+    in the animation are specified by `start`, `end` and `step`.  The file
+    format of the output images is `format`, which must be one of Blender's
+    supported formats, and `ext` is the corresponding file extension.  To split
+    the rendering among several processes, `shardCount` can be greater than one,
+    in which case only every `shardCount`-th frame is rendered, starting with
+    frame number `shardIndex` (counting from zero) of the frames specified by
+    `start`, `end` and `step`.  If `pipelineDepth` is greater than zero, each
+    frame is resampled in a separate process while the next frame renders, with
+    at most `pipelineDepth` frames (but at least two) in progress at once.  The
+    completed frames are recorded in a `Manifest` in `outputBasePath`, and if
+    `resume` is `True`, frames recorded there as completed with the same
+    settings are not rendered again, and frames whose cube images were saved
+    (with `keepFaces`) are resampled from those images.  The sampling indices
+    cache files are in `cacheDir`, with a total size of at most `cacheLimit`
+    megabytes, as in `createSamplingIndices`, and `filter` (one of `FILTERS`)
+    determines how the subsamples are combined.  If `cropFaces` is `True` and
+    `keepFaces` is `False`, the cube faces whose pixels are never sampled
+    (according to `faceBounds`) are not rendered, and only the sampled region of
+    the other faces is rendered (with `setRenderBorder`).  If `stereo` is
+    `True`, the cube images are rendered for each of the `STEREO_EYES`, from
+    cameras `ipd` apart, and the final images are top-bottom stereo, with each
+    eye's image of `sizes` (so twice `sizes.height` in total), the left eye's on
+    top; the sampling indices for one eye are used for both.  If `movie` is not
+    `None`, it is a `MovieStream` into which the final images are streamed, in
+    order, and the final images are saved (and recorded in the `Manifest`) only
+    if `saveFrames` is `True`.  When `render` is called repeatedly in one
+    process with the same `sizes` and projection (e.g., for several cameras),
+    the sampling indices are created only once.
     """
 
     cam = bpy.data.objects[cameraName]
@@ -436,75 +576,135 @@ def render(cameraName, outputBasePath, sizes, start=1, end=250, step=1, mercator
     scene.render.resolution_percentage = 100
     scene.render.image_settings.file_format = format
 
-    # For each side of the cube, the name of subdirectory of `outputBasePath`
-    # where the rendered frames are stored, and the Euler angles to orient the
-    # camera when rendering that side of the cube.
-    views = [
-        { "subdir" : "xPos", "rot" : (0,         0,         0) },
-        { "subdir" : "xNeg", "rot" : (math.pi,   0,         math.pi) },
-        { "subdir" : "yPos", "rot" : (0,         PI_OVER_2, 0) },
-        { "subdir" : "yNeg", "rot" : (0,        -PI_OVER_2, 0) },
-        { "subdir" : "zPos", "rot" : (0,        -PI_OVER_2, PI_OVER_2) },
-        { "subdir" : "zNeg", "rot" : (0,         PI_OVER_2, PI_OVER_2) }
-    ]
-
     cubeCams = []
-    # This node is the parent of all the cube-face cameras, in case there is a
-    # need for reorienting all of them in unison.
-    cubeCamsParent = makeEmpty("CubeCameras", scene)
-    cubeCamsParent.parent = cam
-    for view in views:
-        cam = makeCamera(view["subdir"], scene)
-        cam.parent = cubeCamsParent
-        cam.rotation_euler = view["rot"]
-        cubeCams.append(cam)
+    if stereo:
+        for eye in STEREO_EYES:
+            cubeCams += makeCubeCameras(cam, scene, eye["suffix"], eye["side"] * ipd / 2)
+    else:
+        cubeCams = makeCubeCameras(cam, scene)
+    nEyes = len(cubeCams) // len(CUBE_VIEWS)
 
     if __name__ == "__main__":
         t0 = time.time()
         print("Building sampling indices...")
 
-    mappingFunc = mapToLatLonMercator if mercator else mapToLatLonEquirectangular
-    samplingIndices = createSamplingIndices(sizes, mappingFunc, cache)
+    mappingFunc = eyeProjection(projection, stereo)
+    samplingIndices = createSamplingIndices(sizes, mappingFunc, cache, cacheDir, cacheLimit, filter=filter)
+    flatIndices, weights, nCubePixels, outputSizes, eyes = resamplingArrays(samplingIndices, sizes, stereo)
 
     if __name__ == "__main__":
         t1 = time.time()
         print("Done, {:.2f} secs".format(t1 - t0))
 
-    if not os.path.exists(outputBasePath):
-        os.mkdir(outputBasePath)
-    outputSphericalPath = os.path.join(outputBasePath, "spherical/")
-    if not os.path.exists(outputSphericalPath):
-        os.mkdir(outputSphericalPath)
-
-    frame = start
-    while frame <= end:
-        scene.frame_set(frame)
-        frameStr = str(frame).zfill(4) + ext
-        cubeImages = []
-
-        for cubeCam in cubeCams:
-            scene.camera = cubeCam
-            scene.render.filepath = os.path.join(outputBasePath, cubeCam.name, frameStr)
-            bpy.ops.render.render(write_still=True)
-            cubeImages.append(bpy.data.images.load(scene.render.filepath))
-
+    # Saved cube images are rendered whole, so they can be resampled later with
+    # other settings.
+    bounds = [None] * 6
+    if cropFaces and not keepFaces:
+        bounds = faceBounds(samplingIndices, sizes)
         if __name__ == "__main__":
-            t0 = time.time()
-            print("Resampling spherical image...")
-
-        image = createImageFromSamplingIndices(samplingIndices, sizes, cubeImages)
-
-        image.filepath_raw = os.path.join(outputSphericalPath, frameStr)
-        image.file_format = format
-        image.save()
+            area = sum([(b[2] - b[0] + 1) * (b[3] - b[1] + 1) for b in bounds if b != None])
+            print("Rendering {} of 6 cube faces, {:.0%} of their pixels".\
+                  format(len([b for b in bounds if b != None]), area / sizes.faceOffsets()[-2]))
+    # A face with `bounds` of `None` is skipped only when cropping.
+    skipFaces = cropFaces and not keepFaces
 
+    # Other processes rendering other shards may be creating these directories, too.
+    outputSphericalPath = os.path.join(outputBasePath, "spherical/")
+    os.makedirs(outputSphericalPath, exist_ok=True)
+
+    setupViewerNode(scene)
+
+    manifest = Manifest(outputBasePath, outputFingerprint(sizes, mappingFunc, format, filter, ipd if stereo else None))
+
+    def finishFrame(frame, outputPath, pixels, image, linear=True):
+        if movie != None:
+            movie.write(pixels, linear)
+        if saveFrames:
+            image = saveSphericalImage(outputPath, pixels, outputSizes, scene, image, linear)
+            manifest.record(frame, "spherical", [outputPath])
+        return image
+
+    # Buffers reused at each frame, with the pixels of each cube face (for each eye).
+    cubePixels = np.zeros((nCubePixels, 4), dtype=np.float32)
+    image = None
+    faceFileImage = None
+
+    pipeline = None
+    if pipelineDepth > 0:
+        python = bpy.app.binary_path_python if hasattr(bpy.app, "binary_path_python") else sys.executable
+        pipeline = ResamplingPipeline(python, flatIndices, nCubePixels, pipelineDepth, weights, eyes)
+
+    frames = list(range(start, end + 1, step))[shardIndex::shardCount]
+    if resume:
+        framesAll = frames
+        frames = [frame for frame in frames if not manifest.isComplete(frame, "spherical")]
         if __name__ == "__main__":
-            t1 = time.time()
-            print("Done, {:.2f} secs".format(t1 - t0))
-            print("Saved '{}'".format(image.filepath_raw))
-            print("")
+            print("Frames already completed: {}".format(len(framesAll) - len(frames)))
+    if __name__ == "__main__":
+        print("Frames to render: {}".format(len(frames)))
 
-        frame += step
+    try:
+        for frame in frames:
+            frameStr = str(frame).zfill(4) + ext
+            outputPath = os.path.join(outputSphericalPath, frameStr)
+            facePaths = [os.path.join(outputBasePath, cubeCam.name, frameStr) for cubeCam in cubeCams]
+
+            if resume and manifest.isComplete(frame, "faces"):
+                if __name__ == "__main__":
+                    print("Resampling saved cube images for frame {}...".format(frame))
+                facePixels, linear = loadCubeFaces(facePaths)
+                pixels = resampleCubePixels(facePixels, flatIndices, weights=weights, eyes=eyes)
+                faceFileImage = finishFrame(frame, outputPath, pixels, faceFileImage, linear)
+                continue
+
+            scene.frame_set(frame)
+
+            if pipeline != None:
+                # Save the frames resampled by the pipeline until a slot is free
+                # for this frame.
+                slot = pipeline.acquire()
+                while slot == None:
+                    (doneFrame, donePath), pixels = pipeline.finish()
+                    image = finishFrame(doneFrame, donePath, pixels, image)
+                    slot = pipeline.acquire()
+                cubePixels = pipeline.cubePixels[slot]
+
+            for cubeCam, pixels, facePath, faceSize, faceBound in zip(cubeCams, eyeCubePixels(cubePixels, sizes, nEyes), facePaths,
+                                                                      list(sizes.faceSizes()[:len(CUBE_VIEWS)]) * nEyes, bounds * nEyes):
+                if skipFaces and faceBound == None:
+                    continue
+                scene.camera = cubeCam
+                scene.render.resolution_x = int(faceSize)
+                scene.render.resolution_y = int(faceSize)
+                setRenderBorder(scene, faceBound, int(faceSize))
+                if keepFaces:
+                    scene.render.filepath = facePath
+                bpy.ops.render.render(write_still=keepFaces)
+                getCubePixels([bpy.data.images["Viewer Node"]], pixels)
+            if keepFaces:
+                manifest.record(frame, "faces", facePaths)
+
+            if pipeline != None:
+                pipeline.submit(slot, (frame, outputPath))
+                continue
+
+            if __name__ == "__main__":
+                t0 = time.time()
+                print("Resampling spherical image...")
+
+            image = finishFrame(frame, outputPath, resampleCubePixels(cubePixels, flatIndices, weights=weights, eyes=eyes), image)
+
+            if __name__ == "__main__":
+                t1 = time.time()
+                print("Done, {:.2f} secs".format(t1 - t0))
+
+        if pipeline != None:
+            while pipeline.pending:
+                (doneFrame, donePath), pixels = pipeline.finish()
+                image = finishFrame(doneFrame, donePath, pixels, image)
+    finally:
+        if pipeline != None:
+            pipeline.close()
 
 if __name__ == "__main__":
     timeStart = datetime.datetime.now()
@@ -525,19 +725,55 @@ if __name__ == "__main__":
     parser.set_defaults(width=1280)
     parser.add_argument("--width", "-ow", type=int, dest="width", help="width of output spherical image")
     parser.set_defaults(height=720)
-    parser.add_argument("--height", "-oh", type=int, dest="height", help="height of output spherical image")
+    parser.add_argument("--height", "-oh", type=int, dest="height", help="height of output spherical image (of each eye's image, with --stereo)")
     parser.add_argument("--cubeSize", "-cu", type=int, dest="cubeSize", help="width (height) of cube faces")
+    parser.add_argument("--polarCubeSize", "-pcu", type=int, dest="polarCubeSize", help="width (height) of the polar (zPos, zNeg) cube faces")
     parser.set_defaults(subWidth=3)
     parser.add_argument("--subWidth", "-sw", type=int, dest="subWidth", help="number of subsamples for width")
     parser.set_defaults(subHeight=3)
     parser.add_argument("--subHeight", "-sh", type=int, dest="subHeight", help="number of subsamples for height")
+    parser.set_defaults(adaptive=False)
+    parser.add_argument("--adaptive", "-ad", dest="adaptive", action="store_true", help="use fewer subsamples in rows with smaller pixels on the sphere")
     parser.add_argument("--frame-start", "-s", type=int, dest="start", help="first frame to render")
     parser.add_argument("--frame-end", "-e", type=int, dest="end", help="last frame to render")
     parser.add_argument("--frame-jump", "-j", type=int, dest="step", help="number of frames to step forward")
-    parser.set_defaults(projectionType=0)
-    parser.add_argument("--proj", "-pr", type=int, dest="projectionType", help="projection type (0: equirectangular, 1: Mercator)")
+    parser.set_defaults(projectionType="0")
+    parser.add_argument("--proj", "-pr", dest="projectionType", help="projection type, by number or name ({})".format(projectionNames()))
+    parser.set_defaults(stereo=False)
+    parser.add_argument("--stereo", "-st", dest="stereo", action="store_true", help="render top-bottom stereo images, with the left eye on top")
+    parser.set_defaults(ipd=DEFAULT_IPD)
+    parser.add_argument("--ipd", "-ipd", type=float, dest="ipd", help="interpupillary distance for --stereo, in Blender units")
     parser.set_defaults(cache=True)
     parser.add_argument("--nocache", "-nc", dest="cache", action="store_false", help="do NOT use caching")
+    parser.add_argument("--cache-dir", "-cd", dest="cacheDir", help="directory for the sampling indices cache files")
+    parser.add_argument("--cache-limit", "-cl", type=float, dest="cacheLimit", help="maximum total size of the cache files, in megabytes")
+    parser.set_defaults(filter="nearest")
+    parser.add_argument("--filter", "-fi", dest="filter", choices=FILTERS, help="filter for combining the subsamples of each pixel")
+    parser.set_defaults(keepFaces=False)
+    parser.add_argument("--keep-faces", "-kf", dest="keepFaces", action="store_true", help="also save the cube face images")
+    parser.set_defaults(cropFaces=True)
+    parser.add_argument("--nocrop", "-ncr", dest="cropFaces", action="store_false", help="do NOT skip the unsampled cube faces and regions when rendering")
+    parser.set_defaults(shardIndex=0)
+    parser.add_argument("--shard-index", "-si", type=int, dest="shardIndex", help="index of the shard of frames to render")
+    parser.set_defaults(shardCount=1)
+    parser.add_argument("--shard-count", "-sc", type=int, dest="shardCount", help="number of shards of frames")
+    parser.set_defaults(cacheOnly=False)
+    parser.add_argument("--cache-only", "-co", dest="cacheOnly", action="store_true", help="only build the sampling indices cache")
+    parser.set_defaults(pipelineDepth=0)
+    parser.add_argument("--pipeline", "-pl", type=int, dest="pipelineDepth", help="number of frames to resample in a separate process while rendering (0: none, otherwise at least 2)")
+    parser.set_defaults(resume=False)
+    parser.add_argument("--resume", "-re", dest="resume", action="store_true", help="skip frames already completed, as recorded in the output directory")
+    parser.set_defaults(resampleOnly=False)
+    parser.add_argument("--resample-only", "-ro", dest="resampleOnly", action="store_true", help="only resample the cube images saved in the output directory")
+    parser.add_argument("--movie", "-mv", dest="movie", choices=[name for name, preset in ENCODER_PRESETS.items() if preset.ffmpegArgs != None],
+                        help="stream the final images into a movie with this encoder preset, instead of saving them")
+    parser.add_argument("--fps", "-fps", type=int, dest="fps", help="frames per second of the --movie (default: the scene's)")
+    parser.add_argument("--bitrate", "-br", type=int, dest="bitrate", help="bitrate of the --movie in kilobits per second (default: a constant quality)")
+    parser.set_defaults(ffmpeg=findFFmpeg())
+    parser.add_argument("--ffmpeg", "-ff", dest="ffmpeg", help="path to the FFmpeg executable for --movie")
+    parser.add_argument("--pack", "-pk", dest="packedOrder", help="pack each three final images into one --movie frame, in this order (e.g., 'RGB')")
+    parser.set_defaults(saveFrames=False)
+    parser.add_argument("--save-frames", "-sf", dest="saveFrames", action="store_true", help="also save the final images with --movie")
     args = parser.parse_args(argv)
 
     outputFormat = args.outputFormat.upper()
@@ -547,14 +783,61 @@ if __name__ == "__main__":
     outputExt = fileFormatToExt[outputFormat]
     print("Using output format: '{}'".format(outputFormat))
 
-    bpy.ops.wm.open_mainfile(filepath=args.inputBlenderFile)
+    if args.movie != None:
+        if args.ffmpeg == None:
+            print("No FFmpeg executable for --movie; put one on the PATH, or use --ffmpeg")
+            sys.exit(1)
+        if args.resampleOnly or args.resume or args.shardCount > 1:
+            print("The --movie option cannot be used with --resample-only, --resume or --shard-count")
+            sys.exit(1)
+        if args.packedOrder != None:
+            try:
+                packedChannelIndices(args.packedOrder)
+            except ValueError as e:
+                print(str(e))
+                sys.exit(1)
+
+    if args.resampleOnly:
+        faceExt, faceFrames = findSavedCubeFaces(args.outputBasePath, args.stereo)
+        if not faceFrames:
+            print("No saved cube images in '{}'".format(args.outputBasePath))
+            quit()
 
     cubeSize = max(int(args.width * 0.75), int(args.height * 0.75))
     if args.cubeSize != None:
         cubeSize = args.cubeSize
-    mercator = (args.projectionType == 1)
+    elif args.resampleOnly:
+        cubeSize = savedCubeFaceSize(args.outputBasePath, faceFrames[0], faceExt, 0, args.stereo)
+    polarCubeSize = args.polarCubeSize
+    if polarCubeSize == None and args.resampleOnly:
+        polarCubeSize = savedCubeFaceSize(args.outputBasePath, faceFrames[0], faceExt, 4, args.stereo)
+    try:
+        projection = getProjection(args.projectionType)
+    except ValueError as e:
+        print(str(e))
+        quit()
+
+    sizes = Sizes(args.width, args.height, cubeSize, args.subWidth, args.subHeight, polarCubeSize, args.adaptive)
 
-    sizes = Sizes(args.width, args.height, cubeSize, args.subWidth, args.subHeight)
+    if args.cacheOnly:
+        createSamplingIndices(sizes, eyeProjection(projection, args.stereo), cacheDir=args.cacheDir, cacheLimit=args.cacheLimit, filter=args.filter)
+        quit()
+
+    if args.resampleOnly:
+        # No .blend file is needed, and the frames are those with saved cube images.
+        start = args.start if args.start != None else faceFrames[0]
+        end = args.end if args.end != None else faceFrames[-1]
+        step = args.step if args.step != None else 1
+        faceFrames = set(faceFrames)
+        frames = [frame for frame in range(start, end + 1, step) if frame in faceFrames]
+        frames = frames[args.shardIndex::args.shardCount]
+        resampleSavedCubeFaces(args.outputBasePath, sizes, frames, faceExt, projection, outputFormat, outputExt, args.cache,
+                               args.pipelineDepth, args.cacheDir, args.cacheLimit, args.filter, args.stereo, args.ipd)
+        print("Resampling started at {}".format(timeStart))
+        print("Resampling ended at {}".format(datetime.datetime.now()))
+        quit()
+
+    bpy.ops.wm.open_mainfile(filepath=args.inputBlenderFile)
 
     start = bpy.context.scene.frame_start
     if args.start != None:
@@ -566,7 +849,39 @@ if __name__ == "__main__":
     if args.step != None:
         step = args.step
 
-    render(args.cameraName, args.outputBasePath, sizes, start, end, step, mercator, outputFormat, outputExt, args.cache)
+    movie = None
+    if args.movie != None:
+        if not hasStandardColorManagement(bpy.context.scene):
+            # The pixels streamed to FFmpeg are only sRGB-encoded, so other view
+            # transforms (e.g., Filmic or AgX) would not match the saved images.
+            print("The --movie option needs the scene's color management to be the 'Standard' view transform on an 'sRGB' display, " \
+                  "with no look, exposure, gamma or curves; it is '{}'".format(bpy.context.scene.view_settings.view_transform))
+            sys.exit(1)
+        preset = ENCODER_PRESETS[args.movie]
+        movieSizes = stereoSizes(sizes) if args.stereo else sizes
+        fps = args.fps if args.fps != None else bpy.context.scene.render.fps
+        frameCount = len(range(start, end + 1, step))
+        if args.packedOrder != None:
+            frameCount = (frameCount + 2) // 3
+        os.makedirs(args.outputBasePath, exist_ok=True)
+        moviePath = os.path.join(args.outputBasePath, movieFileName(frameCount, preset.ext))
+        print("Streaming the final images into the movie '{}'".format(moviePath))
+        command = ffmpegCommand(args.ffmpeg, preset, movieSizes.width, movieSizes.height, fps, moviePath, args.bitrate)
+        movie = MovieStream(command, movieSizes.width, movieSizes.height, args.packedOrder.upper() if args.packedOrder != None else None)
+
+    try:
+        render(args.cameraName, args.outputBasePath, sizes, start, end, step, projection, outputFormat, outputExt, args.cache,
+               args.keepFaces, args.shardIndex, args.shardCount, args.pipelineDepth, args.resume, args.cacheDir,
+               args.cacheLimit, args.filter, args.cropFaces, args.stereo, args.ipd, movie, movie == None or args.saveFrames)
+    except BaseException:
+        # Do not leave FFmpeg running, waiting for more frames.
+        if movie != None:
+            movie.abort()
+        raise
+
+    if movie != None:
+        movie.close()
+        print("Saved movie '{}'".format(moviePath))
 
     timeEnd = datetime.datetime.now()
     print("Rendering started at {}".format(timeStart))
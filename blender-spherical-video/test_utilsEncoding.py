@@ -0,0 +1,93 @@
+# Tests for utilsEncoding.py
+# These tests do not need Blender, and can run in plain Python with NumPy:
+# python test_utilsEncoding.py
+
+import numpy as np
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from utilsEncoding import ENCODER_PRESETS, movieFileName, ffmpegCommand, linearToSrgb, frameBytes, MovieStream
+from utilsPacking import srgbToLinear
+
+class TestUtilsEncoding(unittest.TestCase):
+    def test_movieFileName(self):
+        self.assertEqual(movieFileName(96, ".avi"), "0001-0096.avi")
+        self.assertEqual(movieFileName(10, ".mp4", start=5), "0005-0014.mp4")
+
+    def test_ffmpegCommand(self):
+        preset = ENCODER_PRESETS["h264"]
+        command = ffmpegCommand("ffmpeg", preset, 4096, 2048, 30, "/tmp/out.mp4")
+        self.assertEqual(command[0], "ffmpeg")
+        self.assertEqual(command[-1], "/tmp/out.mp4")
+        self.assertIn("4096x2048", command)
+        self.assertEqual(command[command.index("-r") + 1], "30")
+        self.assertIn("-crf", command)
+        self.assertNotIn("-vf", command)
+
+        command = ffmpegCommand("ffmpeg", preset, 4096, 2048, 30, "/tmp/out.mp4", bitrate=40000, outputWidth=1920, outputHeight=960)
+        self.assertEqual(command[command.index("-b:v") + 1], "40000k")
+        self.assertNotIn("-crf", command)
+        self.assertEqual(command[command.index("-vf") + 1], "scale=1920:960")
+
+        self.assertEqual(ENCODER_PRESETS["avi"].ffmpegArgs, None)
+        for preset in ENCODER_PRESETS.values():
+            self.assertTrue(preset.ext.startswith("."))
+
+    def test_frameBytes(self):
+        values = np.array([0, 0.001, 0.18, 0.5, 1], dtype=np.float32)
+        self.assertTrue(np.allclose(srgbToLinear(linearToSrgb(values)), values, atol=1e-6))
+
+        # Two rows, bottom row first, as in Blender.
+        pixels = np.array([[1, 0, 0, 1], [0, 1, 0, 0.5],
+                           [0, 0, 1, 1], [0.5, 0.5, 0.5, 1]], dtype=np.float32).flatten()
+        result = frameBytes(pixels, 2, 2)
+        self.assertEqual(result.dtype, np.uint8)
+        self.assertEqual(result.shape, (2, 2, 3))
+        self.assertEqual(result[0].tolist(), [[0, 0, 255], [128, 128, 128]])
+        self.assertEqual(result[1].tolist(), [[255, 0, 0], [0, 128, 0]])
+
+        result = frameBytes(pixels, 2, 2, linear=True)
+        self.assertEqual(result[0, 1].tolist(), [188, 188, 188])
+        self.assertEqual(result[1, 1].tolist(), [0, 255, 0])
+
+    def test_movieStream(self):
+        # A stand-in for FFmpeg that just saves the raw frames it reads.
+        tmp = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmp, "raw")
+            command = [sys.executable, "-c", "import sys; open(sys.argv[1], 'wb').write(sys.stdin.buffer.read())", path]
+            frames = [np.tile(np.array([v, v, v, 1], dtype=np.float32), 6) for v in [0.2, 0.4, 0.6, 0.8]]
+
+            stream = MovieStream(command, 3, 2)
+            for frame in frames:
+                stream.write(frame, linear=False)
+            stream.close()
+            raw = np.fromfile(path, dtype=np.uint8).reshape(-1, 2, 3, 3)
+            self.assertEqual(raw.shape[0], 4)
+            self.assertTrue(np.all(raw[1] == 102))
+
+            stream = MovieStream(command, 3, 2, packedOrder="BGR")
+            for frame in frames:
+                stream.write(frame)
+            stream.close()
+            self.assertEqual(stream.count, 2)
+            raw = np.fromfile(path, dtype=np.uint8).reshape(-1, 2, 3, 3)
+            self.assertEqual(raw.shape[0], 2)
+            expected = frameBytes(np.tile(np.array([0.6, 0.4, 0.2, 1], dtype=np.float32), 6), 3, 2, linear=True)
+            self.assertTrue(np.array_equal(raw[0], expected))
+            # The last frame is duplicated to fill the final group.
+            self.assertTrue(np.all(raw[1] == frameBytes(np.array([0.8, 0.8, 0.8, 1]), 1, 1, linear=True)))
+
+            stream = MovieStream([sys.executable, "-c", "import time; time.sleep(60)"], 3, 2)
+            stream.abort()
+            self.assertIsNotNone(stream.pipe.process.poll())
+        finally:
+            shutil.rmtree(tmp)
+
+if __name__ == "__main__":
+    unittest.main()
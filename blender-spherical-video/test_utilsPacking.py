@@ -0,0 +1,61 @@
+# Tests for utilsPacking.py
+# These tests do not need Blender, and can run in plain Python with NumPy:
+# python test_utilsPacking.py
+
+import numpy as np
+import os
+import sys
+import unittest
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from utilsPacking import RGB_TO_BW_WEIGHTS, packedChannelIndices, srgbToLinear, \
+                         frameLuminance, packFramePixels
+
+def framePixels(rgba, nPixels=4):
+    return np.tile(np.array(rgba, dtype=np.float32), nPixels)
+
+class TestUtilsPacking(unittest.TestCase):
+    def test_packedChannelIndices(self):
+        self.assertEqual(packedChannelIndices("RGB"), [0, 1, 2])
+        self.assertEqual(packedChannelIndices("bgr"), [2, 1, 0])
+        self.assertEqual(packedChannelIndices("RBA"), [0, 2, 3])
+        for packedOrder in ["RG", "RGBA", "RRB", "RGX"]:
+            with self.assertRaises(ValueError):
+                packedChannelIndices(packedOrder)
+
+    def test_frameLuminance(self):
+        self.assertAlmostEqual(float(np.sum(RGB_TO_BW_WEIGHTS)), 1, places=6)
+        for i in range(3):
+            rgba = [0, 0, 0, 1]
+            rgba[i] = 1
+            self.assertTrue(np.allclose(frameLuminance(framePixels(rgba)), RGB_TO_BW_WEIGHTS[i]))
+
+        self.assertAlmostEqual(float(srgbToLinear(0.5)), 0.21404, places=5)
+        self.assertAlmostEqual(float(srgbToLinear(0.02)), 0.02 / 12.92, places=7)
+
+        # An 8-bit (sRGB, straight alpha) gray is decoded and premultiplied.
+        luminance = frameLuminance(framePixels([0.5, 0.5, 0.5, 0.5]), linear=False)
+        self.assertTrue(np.allclose(luminance, 0.21404 * 0.5, atol=1e-5))
+        luminance = frameLuminance(framePixels([0.5, 0.5, 0.5, 0.5]), linear=True)
+        self.assertTrue(np.allclose(luminance, 0.5))
+
+    def test_packFramePixels(self):
+        frames = [framePixels([0.1, 0.1, 0.1, 1]), framePixels([0.2, 0.2, 0.2, 1]), framePixels([0.3, 0.3, 0.3, 1])]
+
+        packed = packFramePixels(frames).reshape(-1, 4)
+        self.assertTrue(np.allclose(packed, [0.1, 0.2, 0.3, 1]))
+
+        packed = packFramePixels(frames, packedOrder="BGR").reshape(-1, 4)
+        self.assertTrue(np.allclose(packed, [0.3, 0.2, 0.1, 1]))
+
+        out = np.full(16, 9, dtype=np.float32)
+        packed = packFramePixels(frames, packedOrder="GBA", out=out)
+        self.assertIs(packed, out)
+        self.assertTrue(np.allclose(packed.reshape(-1, 4), [0, 0.1, 0.2, 0.3]))
+
+        packed = packFramePixels(frames, linear=[True, False, True]).reshape(-1, 4)
+        self.assertTrue(np.allclose(packed, [0.1, srgbToLinear(0.2), 0.3, 1]))
+
+if __name__ == "__main__":
+    unittest.main()
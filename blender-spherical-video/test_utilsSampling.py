@@ -0,0 +1,487 @@
+# Tests for utilsSampling.py and utilsProjections.py
+# These tests do not need Blender, and can run in plain Python with NumPy:
+# python test_utilsSampling.py
+
+import math
+from math import pi
+from math import sqrt
+import numpy as np
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+
+from utilsSampling import mapToLatLonMercator, MAX_LAT_MERCATOR, \
+                          mapToLatLonEquirectangular, \
+                          latLonToVector, cubeIntersection, \
+                          Sizes, SamplingIndices, \
+                          createSamplingIndices, \
+                          toBinary, fromBinary, \
+                          writeSamplingIndicesToCache, readSamplingIndicesFromCache, \
+                          cacheFilePath, evictCacheFiles, clearSamplingIndicesMemo, \
+                          computeSamplingIndices, computeSamplingIndicesDirect, \
+                          flatSamplingIndices, flatSamplingWeights, resampleCubePixels, \
+                          adaptiveSubsamples, faceBounds, BLANK_FACE
+from utilsProjections import PROJECTIONS, getProjection, getProjectionTag
+
+def vector(v):
+    return np.array(v, dtype=np.float32)
+
+class VectorsAlmostEqual:
+    def assertVectorsAlmostEqual(self, v1, v2, places=7):
+        eps = math.pow(10, -places)
+        diff = np.linalg.norm(v1 - v2)
+        if diff > eps:
+            raise AssertionError("Vectors differ: {} != {} by {}, more than {}".format(v1, v2, eps, diff))
+
+class TestUtilsSampling(unittest.TestCase, VectorsAlmostEqual):
+
+    def test_mapToLatLonMercator(self):
+        w = 20
+        h = 10
+
+        self.assertEqual(mapToLatLonMercator(x=w/2, y=h/2, width=w, height=h), (0, 0))
+
+        self.assertEqual(mapToLatLonMercator(x=0, y=h/2, width=w, height=h), (0, -pi))
+        self.assertEqual(mapToLatLonMercator(x=w, y=h/2, width=w, height=h), (0,  pi))
+
+        self.assertEqual(mapToLatLonMercator(x=w/2, y=0, width=w, height=h), (-MAX_LAT_MERCATOR, 0))
+        self.assertEqual(mapToLatLonMercator(x=w/2, y=h, width=w, height=h), ( MAX_LAT_MERCATOR, 0))
+
+    def test_mapToLatLonEquirectangular(self):
+        w = 20
+        h = 10
+
+        self.assertEqual(mapToLatLonEquirectangular(x=w/2, y=h/2, width=w, height=h), (0, 0))
+
+        self.assertEqual(mapToLatLonEquirectangular(x=0, y=h/2, width=w, height=h), (0, -pi))
+        self.assertEqual(mapToLatLonEquirectangular(x=w, y=h/2, width=w, height=h), (0,  pi))
+
+        self.assertEqual(mapToLatLonEquirectangular(x=w/2, y=0, width=w, height=h), (-pi / 2, 0))
+        self.assertEqual(mapToLatLonEquirectangular(x=w/2, y=h, width=w, height=h), ( pi / 2, 0))
+
+    def test_latLonToVector(self):
+        self.assertVectorsAlmostEqual(latLonToVector(0, 0), vector((1, 0, 0)))
+
+        self.assertVectorsAlmostEqual(latLonToVector( pi/4, 0), vector((sqrt(2)/2, 0,  sqrt(2)/2)))
+        self.assertVectorsAlmostEqual(latLonToVector(-pi/4, 0), vector((sqrt(2)/2, 0, -sqrt(2)/2)))
+
+        self.assertVectorsAlmostEqual(latLonToVector(0,  pi/4), vector((sqrt(2)/2, -sqrt(2)/2, 0)))
+        self.assertVectorsAlmostEqual(latLonToVector(0, -pi/4), vector((sqrt(2)/2,  sqrt(2)/2, 0)))
+
+    def test_cubeIntersection(self):
+        tests = [
+            { "face" : 0, "pt" : vector(( 1.0,  0.1,  0.2)) },
+            { "face" : 0, "pt" : vector(( 1.0, -0.2,  0.3)) },
+            { "face" : 0, "pt" : vector(( 1.0, -0.3, -0.4)) },
+            { "face" : 0, "pt" : vector(( 1.0,  0.4, -0.5)) },
+            { "face" : 1, "pt" : vector((-1.0,  0.1,  0.2)) },
+            { "face" : 1, "pt" : vector((-1.0, -0.2,  0.3)) },
+            { "face" : 1, "pt" : vector((-1.0, -0.3, -0.4)) },
+            { "face" : 1, "pt" : vector((-1.0,  0.4, -0.5)) },
+            { "face" : 2, "pt" : vector(( 0.1,  1.0,  0.2)) },
+            { "face" : 2, "pt" : vector((-0.2,  1.0,  0.3)) },
+            { "face" : 2, "pt" : vector((-0.3,  1.0, -0.4)) },
+            { "face" : 2, "pt" : vector(( 0.4,  1.0, -0.5)) },
+            { "face" : 3, "pt" : vector(( 0.1, -1.0,  0.2)) },
+            { "face" : 3, "pt" : vector((-0.2, -1.0,  0.3)) },
+            { "face" : 3, "pt" : vector((-0.3, -1.0, -0.4)) },
+            { "face" : 3, "pt" : vector(( 0.4, -1.0, -0.5)) },
+            { "face" : 4, "pt" : vector(( 0.1,  0.2,  1.0)) },
+            { "face" : 4, "pt" : vector((-0.2,  0.3,  1.0)) },
+            { "face" : 4, "pt" : vector((-0.3, -0.4,  1.0)) },
+            { "face" : 4, "pt" : vector(( 0.4, -0.5,  1.0)) },
+            { "face" : 5, "pt" : vector(( 0.1,  0.2, -1.0)) },
+            { "face" : 5, "pt" : vector((-0.2,  0.3, -1.0)) },
+            { "face" : 5, "pt" : vector((-0.3, -0.4, -1.0)) },
+            { "face" : 5, "pt" : vector(( 0.4, -0.5, -1.0)) }
+        ]
+
+        for test in tests:
+            # A ray from the origin to a point on a cube face is just that point normalized.
+            ray = test["pt"] / np.linalg.norm(test["pt"])
+            # The expected intersection point is that point converted to 2D by dropping
+            # the coordinate of the face, that is, the coordinate for which the face normal is 1.
+            faceNormalCoord = int(test["face"] / 2)
+            expectedPt2D = vector([test["pt"][i] for i in range(3) if i != faceNormalCoord])
+
+            result = cubeIntersection(ray)
+            self.assertEqual(result[0], test["face"])
+            self.assertVectorsAlmostEqual(result[1], expectedPt2D)
+
+    def createSamplingIndicesOneByOne(self, sizes, mapToLatLon):
+        # The sampling indices computed one subsample at a time, with the functions
+        # that the vectorized `createSamplingIndices` must match exactly.
+        orientation = [-1, 1, 1, -1, -1, 1]
+        result = []
+        inter = [0]
+        for y in range(sizes.height):
+            for x in range(sizes.width):
+                result.append([])
+                ySub = y + 1 / (sizes.subHeight + 1)
+                for _ in range(sizes.subHeight):
+                    xSub = x + 1 / (sizes.subWidth + 1)
+                    for _ in range(sizes.subWidth):
+                        latLon = mapToLatLon(xSub, ySub, sizes.width, sizes.height)
+                        inter = cubeIntersection(latLonToVector(latLon[0], latLon[1]), inter[0])
+                        xFace = int(sizes.cube * ((float(inter[1][0]) * orientation[inter[0]] + 1) / 2))
+                        yFace = int(sizes.cube * ((float(inter[1][1]) + 1) / 2))
+                        result[-1].append((inter[0], xFace, yFace))
+                        xSub += 1 / (sizes.subWidth + 1)
+                    ySub += 1 / (sizes.subHeight + 1)
+        return result
+
+    def test_createSamplingIndices(self):
+        for mapToLatLon in [mapToLatLonEquirectangular, mapToLatLonMercator]:
+            for sizes in [Sizes(width=40, height=20, cubeSize=30, subWidth=3, subHeight=3),
+                          Sizes(width=33, height=17, cubeSize=25, subWidth=2, subHeight=1)]:
+                expected = self.createSamplingIndicesOneByOne(sizes, mapToLatLon)
+                samplingIndices = createSamplingIndices(sizes, mapToLatLon, cache=False)
+                self.assertEqual(self.samplingIndicesToLists(samplingIndices), expected)
+
+    def test_computeSamplingIndicesSymmetric(self):
+        # Sizes with even and odd widths and heights, and (for 8 by 4) subsamples
+        # on face edges, which are not derived exactly by symmetry.
+        for mapToLatLon in [mapToLatLonEquirectangular, mapToLatLonMercator]:
+            for sizes in [Sizes(width=8, height=4, cubeSize=8, subWidth=2, subHeight=2),
+                          Sizes(width=40, height=20, cubeSize=30, subWidth=3, subHeight=3),
+                          Sizes(width=33, height=17, cubeSize=25, subWidth=2, subHeight=1),
+                          Sizes(width=66, height=34, cubeSize=100, subWidth=3, subHeight=2),
+                          Sizes(width=101, height=77, cubeSize=63, subWidth=1, subHeight=3),
+                          Sizes(width=320, height=180, cubeSize=240, subWidth=3, subHeight=3)]:
+                expected = computeSamplingIndicesDirect(sizes, mapToLatLon)
+                result = computeSamplingIndices(sizes, mapToLatLon)
+                for array, expectedArray in zip(result, expected):
+                    self.assertTrue(np.array_equal(array, expectedArray))
+
+    def test_byteArraySymmetric(self):
+        for sizes, ratio in [(Sizes(width=8, height=4, cubeSize=8, subWidth=2, subHeight=2), 8),
+                             (Sizes(width=320, height=180, cubeSize=240, subWidth=3, subHeight=3), 8),
+                             (Sizes(width=33, height=17, cubeSize=25, subWidth=2, subHeight=1), 4)]:
+            samplingIndices1 = SamplingIndices(*computeSamplingIndices(sizes, mapToLatLonEquirectangular))
+            ba = toBinary(sizes, "eqrc", samplingIndices1)
+            samplingIndices2 = fromBinary(sizes, ba, "eqrc")
+            self.assertEqual(self.samplingIndicesToLists(samplingIndices2), self.samplingIndicesToLists(samplingIndices1))
+            # Only the fundamental region (and exceptions) is stored.
+            self.assertLess(len(ba), 1.1 * samplingIndices1.face.size * 5 / ratio + 1024)
+
+    def samplingIndicesToLists(self, samplingIndices):
+        return [list(zip(*pixel)) for pixel in zip(samplingIndices.face.tolist(),
+                                                   samplingIndices.x.tolist(),
+                                                   samplingIndices.y.tolist())]
+
+    def test_byteArray(self):
+        sizes = Sizes(width=3, height=2, cubeSize=10, subWidth=3, subHeight=3)
+        samplingIndices1 = [
+            [(0,0,0), (0,0,1), (0,0,2), (0,1,0), (0,1,1), (0,1,2), (0,2,0), (0,2,1), (0,2,2)],
+            [(1,0,0), (1,0,1), (1,0,2), (1,1,0), (1,1,1), (1,1,2), (1,2,0), (1,2,1), (1,2,2)],
+            [(2,0,0), (2,0,1), (2,0,2), (2,1,0), (2,1,1), (2,1,2), (2,2,0), (2,2,1), (2,2,2)],
+            [(3,0,0), (3,0,1), (3,0,2), (3,1,0), (3,1,1), (3,1,2), (3,2,0), (3,2,1), (3,2,2)],
+            [(4,0,0), (4,0,1), (4,0,2), (4,1,0), (4,1,1), (4,1,2), (4,2,0), (4,2,1), (4,2,2)],
+            [(5,0,0), (5,0,1), (5,0,2), (5,1,0), (5,1,1), (5,1,2), (5,2,0), (5,2,1), (5,2,2)]
+        ]
+        samples = np.array(samplingIndices1)
+        ba = toBinary(sizes, "eqrc", SamplingIndices(samples[:, :, 0], samples[:, :, 1], samples[:, :, 2]))
+        samplingIndices2 = fromBinary(sizes, ba, "eqrc")
+        self.assertEqual(self.samplingIndicesToLists(samplingIndices2), samplingIndices1)
+
+        with self.assertRaises(ValueError):
+            fromBinary(sizes, ba, "merc")
+        with self.assertRaises(ValueError):
+            fromBinary(Sizes(width=3, height=2, cubeSize=20, subWidth=3, subHeight=3), ba)
+        with self.assertRaises(ValueError):
+            fromBinary(sizes, ba[:-1])
+
+        # The headerless binary form of earlier versions.
+        with self.assertRaises(ValueError):
+            fromBinary(sizes, bytes(5 * 6 * 9))
+
+    def test_cacheDir(self):
+        sizes = Sizes(width=8, height=4, cubeSize=6, subWidth=2, subHeight=2)
+        cacheDir = tempfile.mkdtemp()
+        try:
+            self.assertEqual(readSamplingIndicesFromCache(sizes, "eqrc", cacheDir), None)
+            samplingIndices1 = createSamplingIndices(sizes, cache=False)
+            path = writeSamplingIndicesToCache(sizes, "eqrc", samplingIndices1, cacheDir)
+            self.assertEqual(os.path.dirname(path), cacheDir)
+            # No temporary files are left behind.
+            self.assertEqual(os.listdir(cacheDir), [os.path.basename(path)])
+
+            samplingIndices2 = readSamplingIndicesFromCache(sizes, "eqrc", cacheDir)
+            self.assertEqual(self.samplingIndicesToLists(samplingIndices2), self.samplingIndicesToLists(samplingIndices1))
+            samplingIndices3 = createSamplingIndices(sizes, cacheDir=cacheDir, memo=False)
+            self.assertEqual(self.samplingIndicesToLists(samplingIndices3), self.samplingIndicesToLists(samplingIndices1))
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_memo(self):
+        sizes1 = Sizes(width=8, height=4, cubeSize=6, subWidth=2, subHeight=2)
+        sizes2 = Sizes(width=8, height=4, cubeSize=6, subWidth=2, subHeight=2)
+        self.assertEqual(sizes1, sizes2)
+        self.assertEqual(hash(sizes1), hash(sizes2))
+        self.assertNotEqual(sizes1, Sizes(width=8, height=4, cubeSize=7, subWidth=2, subHeight=2))
+        with self.assertRaises(AttributeError):
+            sizes1.cube = 7
+
+        clearSamplingIndicesMemo()
+        samplingIndices1 = createSamplingIndices(sizes1, cache=False)
+        self.assertIs(createSamplingIndices(sizes2, cache=False), samplingIndices1)
+        self.assertIsNot(createSamplingIndices(sizes2, mapToLatLonMercator, cache=False), samplingIndices1)
+        self.assertIsNot(createSamplingIndices(sizes2, cache=False, memo=False), samplingIndices1)
+        clearSamplingIndicesMemo()
+        self.assertIsNot(createSamplingIndices(sizes2, cache=False), samplingIndices1)
+
+    def test_pickleSizes(self):
+        for sizes in [Sizes(width=8, height=4, cubeSize=6, subWidth=2, subHeight=2),
+                      Sizes(width=16, height=8, cubeSize=12, subWidth=3, subHeight=3, polarCubeSize=6, adaptive=True)]:
+            copy = pickle.loads(pickle.dumps(sizes))
+            self.assertEqual(copy, sizes)
+            self.assertEqual(hash(copy), hash(sizes))
+            self.assertEqual(copy.polarCube, sizes.polarCube)
+            self.assertEqual(copy.adaptive, sizes.adaptive)
+
+    def test_cacheEviction(self):
+        sizes1 = Sizes(width=8, height=4, cubeSize=6, subWidth=2, subHeight=2)
+        sizes2 = Sizes(width=8, height=4, cubeSize=7, subWidth=2, subHeight=2)
+        sizes3 = Sizes(width=8, height=4, cubeSize=8, subWidth=2, subHeight=2)
+        cacheDir = tempfile.mkdtemp()
+        try:
+            # The keys differ for different parameters.
+            self.assertNotEqual(cacheFilePath(sizes1, "eqrc", cacheDir), cacheFilePath(sizes1, "merc", cacheDir))
+            self.assertNotEqual(cacheFilePath(sizes1, "eqrc", cacheDir), cacheFilePath(sizes2, "eqrc", cacheDir))
+
+            path1 = writeSamplingIndicesToCache(sizes1, "eqrc", createSamplingIndices(sizes1, cache=False), cacheDir)
+            path2 = writeSamplingIndicesToCache(sizes2, "eqrc", createSamplingIndices(sizes2, cache=False), cacheDir)
+            os.utime(path1, (1000, 1000))
+            os.utime(path2, (2000, 2000))
+            # Reading makes the first file the most recently used.
+            readSamplingIndicesFromCache(sizes1, "eqrc", cacheDir)
+
+            # A limit big enough for two files only.
+            samplingIndices3 = createSamplingIndices(sizes3, cache=False)
+            cacheLimit = (os.path.getsize(path1) + len(toBinary(sizes3, "eqrc", samplingIndices3))) / (1024 * 1024)
+            path3 = writeSamplingIndicesToCache(sizes3, "eqrc", samplingIndices3, cacheDir, cacheLimit)
+            self.assertEqual(sorted(os.listdir(cacheDir)), sorted([os.path.basename(path1), os.path.basename(path3)]))
+
+            # The file just written is kept even if it exceeds the limit by itself.
+            self.assertEqual(evictCacheFiles(cacheDir, 0, path3), [path1])
+            self.assertEqual(os.listdir(cacheDir), [os.path.basename(path3)])
+        finally:
+            shutil.rmtree(cacheDir)
+
+    def test_filters(self):
+        sizes = Sizes(width=12, height=6, cubeSize=9, subWidth=2, subHeight=2)
+        nCubePixels = 6 * sizes.cube * sizes.cube
+        cubePixels = np.ones((nCubePixels, 4), dtype=np.float32)
+        cubePixels[:, 0] = np.arange(nCubePixels) % 7
+        cubePixels[:, 3] = 0.5
+        for filter in ["bilinear", "area"]:
+            samplingIndices = createSamplingIndices(sizes, cache=False, filter=filter)
+            self.assertEqual(samplingIndices.face.shape, (sizes.width * sizes.height, 16))
+            self.assertTrue(np.all(samplingIndices.x < sizes.cube) and np.all(samplingIndices.y < sizes.cube))
+            self.assertTrue(np.allclose(samplingIndices.weights.sum(axis=1), 1))
+
+            # Channels that are constant stay constant.
+            weights = flatSamplingWeights(samplingIndices, sizes)
+            pixels = resampleCubePixels(cubePixels, flatSamplingIndices(samplingIndices, sizes), weights=weights)
+            self.assertTrue(np.allclose(pixels.reshape(-1, 4)[:, 1:], [1, 1, 0.5]))
+
+            ba = toBinary(sizes, "eqrc", samplingIndices, filter)
+            samplingIndices2 = fromBinary(sizes, ba, "eqrc", filter)
+            self.assertEqual(self.samplingIndicesToLists(samplingIndices2), self.samplingIndicesToLists(samplingIndices))
+            self.assertTrue(np.array_equal(samplingIndices2.weights, samplingIndices.weights))
+            with self.assertRaises(ValueError):
+                fromBinary(sizes, ba, "eqrc")
+
+        # With at least as many taps as points, the "area" filter averages the
+        # same points as the "nearest" filter with that many subsamples.
+        area = createSamplingIndices(sizes, cache=False, filter="area")
+        sizes4 = Sizes(width=12, height=6, cubeSize=9, subWidth=4, subHeight=4)
+        nearest = createSamplingIndices(sizes4, cache=False)
+        pixelsArea = resampleCubePixels(cubePixels, flatSamplingIndices(area, sizes), weights=flatSamplingWeights(area, sizes))
+        pixelsNearest = resampleCubePixels(cubePixels, flatSamplingIndices(nearest, sizes4))
+        self.assertTrue(np.allclose(pixelsArea.reshape(-1, 4)[:, 0], pixelsNearest.reshape(-1, 4)[:, 0], atol=1e-5))
+
+        with self.assertRaises(ValueError):
+            createSamplingIndices(sizes, cache=False, filter="cubic")
+
+    def test_resampleAlpha(self):
+        # Opaque cube images give opaque final images, without or with weights,
+        # as alpha above 1 would be saved in floating-point images.
+        sizes = Sizes(width=12, height=6, cubeSize=9, subWidth=3, subHeight=3)
+        cubePixels = np.ones((int(sizes.faceOffsets()[-1]), 4), dtype=np.float32)
+        cubePixels[-1] = 0
+        for filter in ["nearest", "bilinear"]:
+            samplingIndices = createSamplingIndices(sizes, cache=False, filter=filter)
+            weights = flatSamplingWeights(samplingIndices, sizes)
+            self.assertEqual(weights is None, filter == "nearest")
+            pixels = resampleCubePixels(cubePixels, flatSamplingIndices(samplingIndices, sizes), weights=weights)
+            self.assertTrue(np.allclose(pixels.reshape(-1, 4)[:, 3], 1, rtol=0, atol=1e-6))
+
+    def test_polarCubeSize(self):
+        sizes = Sizes(width=16, height=8, cubeSize=12, subWidth=2, subHeight=2)
+        polarSizes = Sizes(width=16, height=8, cubeSize=12, subWidth=2, subHeight=2, polarCubeSize=6)
+        self.assertEqual(polarSizes.faceOffsets().tolist(), [0, 144, 288, 432, 576, 612, 648, 649])
+        for mapToLatLon in [mapToLatLonEquirectangular, mapToLatLonMercator]:
+            samplingIndices = createSamplingIndices(sizes, mapToLatLon, cache=False)
+            polarIndices = createSamplingIndices(polarSizes, mapToLatLon, cache=False)
+            self.assertTrue(np.array_equal(polarIndices.face, samplingIndices.face))
+            # The polar faces' coordinates are scaled, and the others are unchanged.
+            polar = samplingIndices.face >= 4
+            for coord, polarCoord in [(samplingIndices.x, polarIndices.x), (samplingIndices.y, polarIndices.y)]:
+                self.assertTrue(np.array_equal(polarCoord[polar], coord[polar] // 2))
+                self.assertTrue(np.array_equal(polarCoord[~polar], coord[~polar]))
+            self.assertTrue(flatSamplingIndices(polarIndices, polarSizes).max() < 648)
+
+    def test_adaptive(self):
+        sizes = Sizes(width=16, height=8, cubeSize=12, subWidth=3, subHeight=3, adaptive=True)
+        subWidths, subHeights = adaptiveSubsamples(sizes, mapToLatLonEquirectangular)
+        self.assertEqual(subWidths.tolist(), [2, 3, 3, 3, 3, 3, 3, 2])
+        self.assertEqual(subHeights.tolist(), [3] * 8)
+        subWidths, subHeights = adaptiveSubsamples(sizes, mapToLatLonMercator)
+        # Mercator pixels are also shorter away from the equator.
+        self.assertEqual(subHeights.tolist(), [1, 1, 2, 3, 3, 2, 1, 1])
+
+        cubePixels = np.ones((6 * 12 * 12, 4), dtype=np.float32)
+        cubePixels[:, 0] = np.arange(6 * 12 * 12) % 5
+        for filter in ["nearest", "area"]:
+            samplingIndices = createSamplingIndices(sizes, cache=False, filter=filter)
+            self.assertEqual(samplingIndices.rowCounts.tolist(), [count * (4 if filter == "area" else 1)
+                                                                  for count in [6, 9, 9, 9, 9, 9, 9, 6]])
+            self.assertEqual(samplingIndices.face.size, 16 * sum(samplingIndices.rowCounts))
+
+            ba = toBinary(sizes, "eqrc", samplingIndices, filter)
+            samplingIndices2 = fromBinary(sizes, ba, "eqrc", filter)
+            for array, array2 in [(samplingIndices.face, samplingIndices2.face), (samplingIndices.x, samplingIndices2.x),
+                                  (samplingIndices.y, samplingIndices2.y), (samplingIndices.rowCounts, samplingIndices2.rowCounts)]:
+                self.assertEqual(array2.tolist(), array.tolist())
+
+            # The rows with all the subsamples match the indices without adaptation.
+            pixels = resampleCubePixels(cubePixels, flatSamplingIndices(samplingIndices, sizes),
+                                        weights=flatSamplingWeights(samplingIndices, sizes)).reshape(8, 16, 4)
+            fullSizes = Sizes(width=16, height=8, cubeSize=12, subWidth=3, subHeight=3)
+            full = createSamplingIndices(fullSizes, cache=False, filter=filter)
+            fullPixels = resampleCubePixels(cubePixels, flatSamplingIndices(full, fullSizes),
+                                            weights=flatSamplingWeights(full, fullSizes)).reshape(8, 16, 4)
+            self.assertTrue(np.allclose(pixels[1:7], fullPixels[1:7]))
+            self.assertTrue(np.allclose(pixels[:, :, 1], 1))
+
+    def test_faceBounds(self):
+        for sizes in [Sizes(width=16, height=8, cubeSize=12, subWidth=2, subHeight=2),
+                      Sizes(width=16, height=8, cubeSize=12, subWidth=3, subHeight=3, polarCubeSize=6, adaptive=True)]:
+            samplingIndices = createSamplingIndices(sizes, mapToLatLonMercator, cache=False)
+            bounds = faceBounds(samplingIndices, sizes)
+            self.assertIs(faceBounds(samplingIndices, sizes), bounds)
+            for face in range(6):
+                inFace = samplingIndices.face == face
+                x = np.minimum(samplingIndices.x[inFace], sizes.faceSizes()[face] - 1)
+                y = samplingIndices.y[inFace]
+                self.assertEqual(bounds[face], (x.min(), y.min(), x.max(), y.max()))
+
+        # With one subsample for each of two pixels, only two faces are sampled.
+        sizes = Sizes(width=2, height=1, cubeSize=12, subWidth=1, subHeight=1)
+        bounds = faceBounds(createSamplingIndices(sizes, cache=False), sizes)
+        self.assertEqual([face for face in range(6) if bounds[face] != None], [2, 3])
+
+    def test_projections(self):
+        tags = [projection.tag for projection in PROJECTIONS]
+        self.assertEqual(tags, ["eqrc", "merc", "eacm", "dome", "fish", "ster", "tbeq", "tbea"])
+        self.assertEqual(getProjection("EAC"), getProjection(2))
+        self.assertEqual(getProjection("1").mapToLatLon, mapToLatLonMercator)
+        self.assertEqual(getProjectionTag(mapToLatLonEquirectangular), "eqrc")
+        self.assertRaises(ValueError, getProjection, "unknown")
+
+        # Other functions get a stable tag of their own.
+        def mapToLatLonOther(x, y, width, height):
+            return mapToLatLonEquirectangular(x, y, width, height)
+        tag = getProjectionTag(mapToLatLonOther)
+        self.assertEqual(len(tag), 4)
+        self.assertFalse(tag in tags)
+        self.assertEqual(getProjectionTag(mapToLatLonOther), tag)
+
+        y, x = np.mgrid[0:8, 0:12] + 0.5
+        for projection in PROJECTIONS:
+            rayX, rayY, rayZ, valid = projection.rays(x, y, 12, 8)
+            self.assertTrue(np.allclose((rayX * rayX + rayY * rayY + rayZ * rayZ)[valid], 1))
+
+        # Pixel centers toward the middle of the front and up faces of the EAC layout.
+        eac = getProjection("eac")
+        rays = eac.rays(np.array([150.0, 250.0]), np.array([75.0, 25.0]), 300, 100)
+        self.assertVectorsAlmostEqual(np.array([r[0] for r in rays[:3]]), np.array([1, 0, 0]))
+        self.assertVectorsAlmostEqual(np.array([r[1] for r in rays[:3]]), np.array([0, 0, 1]))
+
+        # The dome master is valid in the inscribed circle, with the zenith at the center.
+        dome = getProjection("dome")
+        valid = dome.validMask(8, 8)
+        self.assertFalse(valid[0, 0] or valid[7, 7])
+        self.assertTrue(valid[0, 3] and valid[4, 4])
+        rays = dome.rays(np.array([50.0, 50.0]), np.array([50.0, 0.0]), 100, 100)
+        self.assertVectorsAlmostEqual(np.array([r[0] for r in rays[:3]]), np.array([0, 0, 1]))
+        self.assertVectorsAlmostEqual(np.array([r[1] for r in rays[:3]]), np.array([1, 0, 0]))
+
+        # Both halves of a top-bottom layout have the same view.
+        topBottom = getProjection("top-bottom")
+        bottom = topBottom.rays(x, y, 12, 16)
+        top = topBottom.rays(x, y + 8, 12, 16)
+        for ray, ray2 in zip(top, bottom):
+            self.assertTrue(np.allclose(ray, ray2))
+
+    def test_projectionSampling(self):
+        sizes = Sizes(width=16, height=16, cubeSize=12, subWidth=2, subHeight=2)
+        nCubePixels = int(sizes.faceOffsets()[-1])
+        self.assertEqual(nCubePixels, 6 * 12 * 12 + 1)
+        cubePixels = np.ones((nCubePixels, 4), dtype=np.float32)
+        cubePixels[-1] = 0
+        for filter in ["nearest", "bilinear", "area"]:
+            samplingIndices = createSamplingIndices(sizes, "dome", cache=False, filter=filter)
+            self.assertTrue(np.any(samplingIndices.face == BLANK_FACE))
+            pixels = resampleCubePixels(cubePixels, flatSamplingIndices(samplingIndices, sizes),
+                                        weights=flatSamplingWeights(samplingIndices, sizes)).reshape(16, 16, 4)
+            alpha = pixels[:, :, 3]
+            self.assertAlmostEqual(alpha[0, 0], 0)
+            self.assertAlmostEqual(alpha[8, 8], 1)
+            self.assertAlmostEqual(alpha.mean(), pi / 4, 1)
+
+            # The dome sees only the upper hemisphere.
+            self.assertEqual(faceBounds(samplingIndices, sizes)[5], None)
+
+            ba = toBinary(sizes, "dome", samplingIndices, filter)
+            samplingIndices2 = fromBinary(sizes, ba, "dome", filter)
+            self.assertEqual(samplingIndices2.face.tolist(), samplingIndices.face.tolist())
+
+        # The whole EAC image is valid, and its front cell samples the front face.
+        sizes = Sizes(width=18, height=12, cubeSize=12, subWidth=1, subHeight=1)
+        samplingIndices = createSamplingIndices(sizes, "eac", cache=False)
+        face = samplingIndices.face.reshape(12, 18)
+        self.assertFalse(np.any(face == BLANK_FACE))
+        self.assertTrue(np.all(face[6:, 6:12] == 0))
+
+        # Adaptive sizes use fewer subsamples where the pixels are smaller, which
+        # for the stereographic projection is away from the center.
+        sizes = Sizes(width=16, height=16, cubeSize=12, subWidth=3, subHeight=3, adaptive=True)
+        subWidths, subHeights = adaptiveSubsamples(sizes, "stereographic")
+        self.assertEqual((subWidths[0], subWidths[8]), (1, 3))
+        self.assertEqual(subHeights.tolist(), subWidths.tolist())
+
+    def test_resampleStereo(self):
+        for sizes, filter in [(Sizes(width=16, height=8, cubeSize=12, subWidth=2, subHeight=2), "nearest"),
+                              (Sizes(width=16, height=8, cubeSize=12, subWidth=3, subHeight=3, adaptive=True), "bilinear")]:
+            samplingIndices = createSamplingIndices(sizes, cache=False, filter=filter)
+            flatIndices = flatSamplingIndices(samplingIndices, sizes)
+            weights = flatSamplingWeights(samplingIndices, sizes)
+            nCubePixels = int(sizes.faceOffsets()[-1])
+            left = np.random.RandomState(1).rand(nCubePixels, 4).astype(np.float32)
+            right = np.random.RandomState(2).rand(nCubePixels, 4).astype(np.float32)
+
+            pixels = resampleCubePixels(np.concatenate([left, right]), flatIndices, weights=weights, eyes=2).reshape(16, 16, 4)
+
+            # The bottom half is the right eye, and the top half is the left eye.
+            self.assertTrue(np.allclose(pixels[:8], resampleCubePixels(right, flatIndices, weights=weights).reshape(8, 16, 4)))
+            self.assertTrue(np.allclose(pixels[8:], resampleCubePixels(left, flatIndices, weights=weights).reshape(8, 16, 4)))
+
+if __name__ == "__main__":
+    unittest.main()
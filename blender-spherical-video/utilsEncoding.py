@@ -0,0 +1,211 @@
+# Utilities for encoding frames into movies, either with Blender's movie output
+# (as set up by assembleFrames.py) or by streaming raw frames into an external
+# FFmpeg process through a pipe.  This module does not use Blender's `bpy` module,
+# so it can be tested in plain Python.
+
+import numpy as np
+import os
+import shutil
+import subprocess
+import sys
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsPacking import packFramePixels
+
+class EncoderPreset:
+    """
+    A container and codec for movies.  For Blender's movie output, the movie is
+    written with the scene's `file_format` set to `blenderFileFormat`, and for
+    "FFMPEG", the FFmpeg settings' `format` and `codec` set to `blenderContainer`
+    and `blenderCodec`.  For an external FFmpeg process, the arguments are
+    `ffmpegArgs`, plus `qualityArgs` when no bitrate is specified.  The movie
+    file's extension is `ext`.
+    """
+    def __init__(self, name, ext, blenderFileFormat, blenderContainer=None, blenderCodec=None, ffmpegArgs=None, qualityArgs=[]):
+        self.name = name
+        self.ext = ext
+        self.blenderFileFormat = blenderFileFormat
+        self.blenderContainer = blenderContainer
+        self.blenderCodec = blenderCodec
+        self.ffmpegArgs = ffmpegArgs
+        self.qualityArgs = qualityArgs
+
+# The presets, by name.  The "avi" preset is the original (large) Motion JPEG AVI,
+# which only Blender's movie output writes.  The "h265" preset with Blender's
+# movie output needs Blender 4.2 or later.
+ENCODER_PRESETS = {
+    "avi": EncoderPreset("avi", ".avi", "AVI_JPEG"),
+    "h264": EncoderPreset("h264", ".mp4", "FFMPEG", "MPEG4", "H264",
+                          ["-c:v", "libx264", "-preset", "medium", "-pix_fmt", "yuv420p"], ["-crf", "18"]),
+    "h265": EncoderPreset("h265", ".mp4", "FFMPEG", "MPEG4", "H265",
+                          ["-c:v", "libx265", "-preset", "medium", "-pix_fmt", "yuv420p", "-tag:v", "hvc1"], ["-crf", "20"]),
+    "prores": EncoderPreset("prores", ".mov", "FFMPEG", "QUICKTIME", "PRORES",
+                            ["-c:v", "prores_ks", "-profile:v", "3", "-pix_fmt", "yuv422p10le"])
+}
+
+def findFFmpeg():
+    """
+    Returns the path to the FFmpeg executable, from the `SPHERICAL_VIDEO_FFMPEG`
+    environment variable or the `PATH`, or `None` if there is none.
+    """
+
+    ffmpeg = os.environ.get("SPHERICAL_VIDEO_FFMPEG")
+    if ffmpeg:
+        return ffmpeg
+    return shutil.which("ffmpeg")
+
+def movieFileName(frameCount, ext, start=1):
+    """
+    Returns the name of the movie file for `frameCount` frames, named for the
+    frame range as by Blender's movie output (e.g., "0001-0096.mp4").
+    """
+
+    return "{}-{}{}".format(str(start).zfill(4), str(start + frameCount - 1).zfill(4), ext)
+
+def ffmpegCommand(ffmpeg, preset, width, height, fps, outputPath, bitrate=None, outputWidth=None, outputHeight=None):
+    """
+    Returns the command to run the FFmpeg executable `ffmpeg` to encode the raw
+    8-bit RGB frames of size `width` by `height` read from its standard input, as
+    from `frameBytes`, at `fps` frames per second, into the movie at `outputPath`
+    with the `preset` (an `EncoderPreset`) and the `bitrate` in kilobits per
+    second, if not `None`.  If `outputWidth` or `outputHeight` differs from the
+    frame size, the frames are scaled.
+    """
+
+    command = [ffmpeg, "-y", "-loglevel", "error", "-f", "rawvideo", "-pix_fmt", "rgb24",
+               "-s", "{}x{}".format(width, height), "-r", str(fps), "-i", "-"]
+    outputWidth = outputWidth or width
+    outputHeight = outputHeight or height
+    if (outputWidth, outputHeight) != (width, height):
+        command += ["-vf", "scale={}:{}".format(outputWidth, outputHeight)]
+    command += preset.ffmpegArgs
+    if bitrate:
+        command += ["-b:v", "{}k".format(bitrate)]
+    else:
+        command += preset.qualityArgs
+    return command + [outputPath]
+
+def linearToSrgb(values):
+    """
+    Returns the NumPy float32 array of the sRGB-encoded values for the linear
+    `values`, with the piecewise sRGB transfer function.
+    """
+
+    values = np.maximum(np.asarray(values, dtype=np.float32), 0)
+    return np.where(values <= 0.0031308, values * np.float32(12.92),
+                    np.float32(1.055) * values ** np.float32(1 / 2.4) - np.float32(0.055)).astype(np.float32)
+
+def frameBytes(pixels, width, height, linear=False):
+    """
+    Returns the `height` by `width` by 3 NumPy uint8 array of the RGB values of
+    the flat RGBA `pixels` (as from a `bpy.types.Image`, with the bottom row first),
+    with the top row first, for writing to an FFmpeg pipe.  If `linear` is `True`,
+    the pixels are linear and premultiplied by alpha, as for floating-point images,
+    and are encoded as sRGB, as by Blender's "Standard" view transform (other view
+    transforms, like Filmic or AgX, are not applied).  Otherwise, they are
+    sRGB-encoded with straight alpha, as for 8-bit images.  The result is
+    composited over black.
+    """
+
+    rgba = np.asarray(pixels, dtype=np.float32).reshape(height, width, 4)[::-1]
+    if linear:
+        rgb = linearToSrgb(rgba[:, :, :3])
+    else:
+        rgb = rgba[:, :, :3] * rgba[:, :, 3:4]
+    return (np.clip(rgb, 0, 1) * 255 + 0.5).astype(np.uint8)
+
+class FFmpegPipe:
+    """
+    An external FFmpeg process running `command` (as from `ffmpegCommand`), to
+    which the frames are streamed with `write`.
+    """
+    def __init__(self, command):
+        self.command = command
+        self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+
+    def write(self, frame, count=1):
+        """
+        Writes the `frame` (as from `frameBytes`) `count` times.
+        """
+
+        data = memoryview(np.ascontiguousarray(frame)).cast("B")
+        for i in range(count):
+            self.process.stdin.write(data)
+
+    def close(self):
+        """
+        Finishes the movie, raising `RuntimeError` if FFmpeg failed.
+        """
+
+        self.process.stdin.close()
+        code = self.process.wait()
+        if code != 0:
+            raise RuntimeError("FFmpeg failed, with exit code {}: {}".format(code, " ".join(self.command)))
+
+    def abort(self):
+        """
+        Stops FFmpeg without finishing the movie, as after an error.
+        """
+
+        self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+
+class MovieStream:
+    """
+    Streams final frames of size `width` by `height` directly into a movie, by an
+    `FFmpegPipe` running `command` (as from `ffmpegCommand`, for frames of that
+    size), without saving the frames as images.  If `packedOrder` is not `None`,
+    each three consecutive frames are packed into one movie frame, as by
+    packFrames.py, with the channels in `packedOrder`.
+    """
+    def __init__(self, command, width, height, packedOrder=None):
+        self.pipe = FFmpegPipe(command)
+        self.width = width
+        self.height = height
+        self.packedOrder = packedOrder
+        self.framePixels = []
+        self.linear = []
+        self.count = 0
+
+    def write(self, pixels, linear=True):
+        """
+        Adds the frame with the flat RGBA `pixels`, with `linear` as in `frameBytes`.
+        """
+
+        if self.packedOrder == None:
+            self.pipe.write(frameBytes(pixels, self.width, self.height, linear))
+            self.count += 1
+            return
+
+        # The pixels are copied, as the caller may reuse its buffer for the next frame.
+        i = len(self.linear)
+        if len(self.framePixels) <= i:
+            self.framePixels.append(np.empty(self.width * self.height * 4, dtype=np.float32))
+        np.copyto(self.framePixels[i], np.asarray(pixels, dtype=np.float32).reshape(-1))
+        self.linear.append(linear)
+        if len(self.linear) == 3:
+            packed = packFramePixels(self.framePixels, self.linear, self.packedOrder)
+            self.pipe.write(frameBytes(packed, self.width, self.height, linear=True))
+            self.count += 1
+            self.linear = []
+
+    def close(self):
+        """
+        Finishes the movie, first packing a final partial group of frames with the
+        last frame duplicated, as in packFrames.py.
+        """
+
+        while self.linear:
+            self.write(self.framePixels[len(self.linear) - 1], self.linear[-1])
+        self.pipe.close()
+
+    def abort(self):
+        """
+        Stops the movie unfinished, as after an error.
+        """
+
+        self.pipe.abort()
@@ -0,0 +1,80 @@
+# The engine for packing three frames into the color channels of one frame, as
+# in packFrames.py: each frame is converted to grayscale, with the same weights as
+# Blender's compositor "RGB to BW" node, and put into the channel given by the
+# packing order.  This module uses only NumPy, not Blender's `bpy` module, so it
+# can be tested in plain Python.
+
+import numpy as np
+
+# The luminance weights of the red, green and blue channels used by the compositor's
+# "RGB to BW" node, which are those of Blender's color management configuration
+# for its (Rec. 709) scene linear color space.
+RGB_TO_BW_WEIGHTS = np.array([0.2126, 0.7152, 0.0722], dtype=np.float32)
+
+# The channels that can appear in a packing order, as for the inputs of the
+# compositor's "Combine RGBA" node.
+PACKED_CHANNELS = "RGBA"
+
+def packedChannelIndices(packedOrder):
+    """
+    Returns a list of the indices of the channels (0 for red, 1 for green, 2 for
+    blue, 3 for alpha) into which the three frames are packed, for the string
+    `packedOrder` (e.g., "RGB" means frame 0 in red, 1 in green, 2 in blue).
+    Raises `ValueError` if `packedOrder` is not three different channels.
+    """
+
+    order = packedOrder.upper()
+    if len(order) != 3 or len(set(order)) != 3 or any([c not in PACKED_CHANNELS for c in order]):
+        raise ValueError("Packing order '{}' must be three different channels of '{}'".format(packedOrder, PACKED_CHANNELS))
+    return [PACKED_CHANNELS.index(c) for c in order]
+
+def srgbToLinear(values):
+    """
+    Returns the NumPy float32 array of the linear values for the sRGB-encoded
+    `values`, with the piecewise sRGB transfer function.
+    """
+
+    values = np.asarray(values, dtype=np.float32)
+    return np.where(values <= 0.04045, values / np.float32(12.92),
+                    ((values + np.float32(0.055)) / np.float32(1.055)) ** np.float32(2.4)).astype(np.float32)
+
+def frameLuminance(pixels, linear=True, out=None):
+    """
+    Returns a NumPy float32 array of the luminance of each pixel of the flat
+    RGBA `pixels` (as from a `bpy.types.Image`), with `RGB_TO_BW_WEIGHTS`.  If
+    `linear` is `True`, the pixels are linear and premultiplied by alpha, as for
+    floating-point images (e.g., OpenEXR).  Otherwise, they are sRGB-encoded with
+    straight alpha, as for 8-bit images, and are converted to linear and
+    premultiplied, as when the compositor loads them.  If `out` is specified, it
+    is a float32 array of the correct size to hold the result.
+    """
+
+    rgba = np.asarray(pixels, dtype=np.float32).reshape(-1, 4)
+    rgb = rgba[:, :3]
+    if not linear:
+        rgb = srgbToLinear(rgb) * rgba[:, 3:4]
+    return np.dot(rgb, RGB_TO_BW_WEIGHTS, out=out)
+
+def packFramePixels(framePixels, linear=True, packedOrder="RGB", out=None):
+    """
+    Returns the pixels of the packed frame, as a flat NumPy float32 array of
+    linear RGBA values, from the list `framePixels` of the flat RGBA pixels of
+    three frames of the same size, with `linear` as in `frameLuminance` (for all
+    the frames, or a list with a value for each frame).  The
+    luminance of frame `i` is in the channel `packedOrder[i]`, and the other
+    channels are 0 for color and 1 for alpha, as for the compositor's "Combine
+    RGBA" node.  If `out` is specified, it is a flat float32 array of the correct
+    size to hold the result.
+    """
+
+    channels = packedChannelIndices(packedOrder)
+    if not isinstance(linear, (list, tuple)):
+        linear = [linear] * len(framePixels)
+    nPixels = np.size(framePixels[0]) // 4
+    if out is None:
+        out = np.empty(nPixels * 4, dtype=np.float32)
+    packed = out.reshape(-1, 4)
+    packed[:] = (0, 0, 0, 1)
+    for pixels, isLinear, channel in zip(framePixels, linear, channels):
+        packed[:, channel] = frameLuminance(pixels, isLinear)
+    return out
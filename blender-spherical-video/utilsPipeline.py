@@ -0,0 +1,143 @@
+# Utilities for resampling spherical images in a separate Python process, so the
+# resampling of one frame can overlap the rendering of the next frame.  Blender
+# holds Python's global interpreter lock while rendering, so a thread would not
+# give this overlap.  The buffers are memory-mapped files shared by the two
+# processes, and the processes exchange buffer indices through pipes.
+
+# The separate process runs this file as a script, e.g.:
+# python utilsPipeline.py path/bufferDirectory 2 1 1
+
+import collections
+import numpy as np
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+
+sys.path.append(os.path.dirname(os.path.realpath(__file__)))
+from utilsSampling import resampleCubePixels
+
+def bufferPaths(directory, depth, bands):
+    """
+    Returns lists of the paths of the flat sampling indices and the flat sampling
+    weights for each of the `bands` bands of final image pixels (one unless the
+    sampling indices are adaptive), and of the `depth` cube pixel buffers and
+    result pixel buffers, in `directory`.
+    """
+
+    flatPaths = [os.path.join(directory, "flatIndices{}.npy".format(i)) for i in range(bands)]
+    weightsPaths = [os.path.join(directory, "flatWeights{}.npy".format(i)) for i in range(bands)]
+    cubePaths = [os.path.join(directory, "cube{}.npy".format(i)) for i in range(depth)]
+    resultPaths = [os.path.join(directory, "result{}.npy".format(i)) for i in range(depth)]
+    return (flatPaths, weightsPaths, cubePaths, resultPaths)
+
+class ResamplingPipeline:
+    """
+    Resamples cube pixels into spherical image pixels in a separate process
+    running the Python executable `python`, using the flat sampling indices
+    `flatIndices`, and the flat sampling weights `weights` if they are not `None`
+    (as from `flatSamplingIndices` and `flatSamplingWeights`, so they may be lists
+    of bands), for `eyes` eyes as in `resampleCubePixels`.  There are `depth`
+    slots, each with a buffer for the pixels of `nCubePixels` cube pixels and a
+    buffer for the final image's pixels, so at most `depth` frames are in
+    progress at once.  The `depth` is at least two, since with one slot, the
+    next frame could not start until the previous frame was resampled.  To use a slot, fill the buffer
+    `cubePixels[slot]` for a slot from `acquire`, and pass the slot to `submit`.
+    Then `finish` returns the final image's pixels, in the order submitted.
+    """
+    def __init__(self, python, flatIndices, nCubePixels, depth=2, weights=None, eyes=1):
+        depth = max(depth, 2)
+        self.directory = tempfile.mkdtemp()
+        if not isinstance(flatIndices, list):
+            flatIndices = [flatIndices]
+            weights = [weights] if weights is not None else None
+        flatPaths, weightsPaths, cubePaths, resultPaths = bufferPaths(self.directory, depth, len(flatIndices))
+        for path, band in zip(flatPaths, flatIndices):
+            np.save(path, band)
+        if weights is not None:
+            for path, band in zip(weightsPaths, weights):
+                np.save(path, band)
+        nResult = sum([band.shape[1] for band in flatIndices]) * 4 * eyes
+        self.cubePixels = [np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(nCubePixels, 4))
+                           for path in cubePaths]
+        self.resultPixels = [np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(nResult,))
+                             for path in resultPaths]
+        self.free = list(range(depth))
+        self.pending = collections.deque()
+        self.process = subprocess.Popen([python, os.path.realpath(__file__), self.directory, str(depth), str(len(flatIndices)), str(eyes)],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+
+    def acquire(self):
+        """
+        Returns a free slot, or `None` if all the slots are in use, in which case
+        `finish` must be called first.
+        """
+
+        if not self.free:
+            return None
+        return self.free.pop(0)
+
+    def submit(self, slot, data):
+        """
+        Starts resampling the cube pixels in `slot`.  When finished, the
+        arbitrary `data` is returned with the results.
+        """
+
+        self.process.stdin.write("{}\n".format(slot))
+        self.process.stdin.flush()
+        self.pending.append((slot, data))
+
+    def finish(self):
+        """
+        Waits for the earliest submitted slot to be resampled, and returns a tuple,
+        (`data`, `pixels`), of the `data` from `submit` and the final image's pixels.
+        The slot is free again, so `pixels` must be used before the next `submit`.
+        """
+
+        slot, data = self.pending.popleft()
+        line = self.process.stdout.readline()
+        if line.strip() != str(slot):
+            raise RuntimeError("Resampling process failed, with exit code {}".format(self.process.poll()))
+        self.free.append(slot)
+        return (data, self.resultPixels[slot])
+
+    def close(self):
+        """
+        Stops the separate process and removes the buffers.  The process is
+        killed if frames are still pending, as after an error.
+        """
+
+        if self.pending:
+            self.process.kill()
+        try:
+            self.process.stdin.close()
+        except OSError:
+            pass
+        self.process.wait()
+        self.cubePixels = []
+        self.resultPixels = []
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def runWorker(directory, depth, bands, eyes=1):
+    """
+    The loop run by the separate process, which resamples the slot whose index
+    is read from standard input, and then writes the index to standard output.
+    """
+
+    flatPaths, weightsPaths, cubePaths, resultPaths = bufferPaths(directory, depth, bands)
+    flatIndices = [np.load(path, mmap_mode="r") for path in flatPaths]
+    weights = None
+    if os.path.exists(weightsPaths[0]):
+        weights = [np.load(path, mmap_mode="r") for path in weightsPaths]
+    cubePixels = [np.load(path, mmap_mode="r") for path in cubePaths]
+    resultPixels = [np.load(path, mmap_mode="r+") for path in resultPaths]
+    for line in sys.stdin:
+        slot = int(line)
+        resampleCubePixels(cubePixels[slot], flatIndices, resultPixels[slot], weights, eyes)
+        sys.stdout.write("{}\n".format(slot))
+        sys.stdout.flush()
+
+if __name__ == "__main__":
+    runWorker(sys.argv[1], int(sys.argv[2]), int(sys.argv[3]), int(sys.argv[4]))
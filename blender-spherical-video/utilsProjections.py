@@ -0,0 +1,323 @@
+# The projections from the final image to directions on the sphere around the
+# camera, in a registry, `PROJECTIONS`, so scripts can select them by name (or by
+# the number used for `--proj` in sphericalVideo.py).  Each projection has a stable
+# tag identifying it in the sampling indices cache files, and a vectorized
+# mapping from final image coordinates to directions, including which parts of
+# the final image are valid (e.g., inside the circle of a dome master).
+# This module uses only NumPy, not Blender's `bpy` or `mathutils` modules.
+
+import hashlib
+import math
+import numpy as np
+
+# The maximum north latitude (and minimum south latitude) to be used for
+# the Mercator projection (which is undefined at the poles).
+MAX_LAT_MERCATOR = math.radians(85)
+
+# The Y value that corresponds to MAX_LAT_MERCATOR.
+# Computed as: math.log(math.tan(math.pi / 4 + MAX_LAT / 2))
+# From: https://en.wikipedia.org/wiki/Mercator_projection
+Y_FOR_MAX_LAT_MERCATOR = 3.131301331471645
+
+# For efficiency.
+PI_OVER_2 = math.pi / 2
+
+# The projections other than `LatLonProjection` express directions as (forward,
+# right, up) components, in the frame of the center of the equirectangular
+# projection: forward is the +X axis (longitude 0), right is the -Y axis (the
+# direction of increasing longitude) and up is the +Z axis.
+FORWARD = (1, 0, 0)
+BACK = (-1, 0, 0)
+RIGHT = (0, 1, 0)
+LEFT = (0, -1, 0)
+UP = (0, 0, 1)
+DOWN = (0, 0, -1)
+
+def mapToLatLonMercator(x, y, width, height):
+    """
+    Convert from a location, `x`, `y`, in a final map image (of total size:
+    `width`, `height`) to a tuple, `(latidude, longitude)`, using the
+    Mercator projection.
+    Latitude goes from -`MAX_LAT` at `y` == 0 to `MAX_LAT` at `y` == `height`.
+    Longitude goes from -`math.pi` at `x` == 0 to `math.pi` at `x` == `width`.
+    """
+
+    # Formulas from: https://en.wikipedia.org/wiki/Mercator_projection
+    # In those formulas, lambda is longitude.
+    # Use radius of 1.
+    lon = (2 * (x / width) - 1) * math.pi
+    # “The ordinate y of the Mercator projection becomes infinite at the poles
+    # and the map must be truncated at some latitude less than ninety degrees.”
+    # Longitude of 85 degrees corresponds to y of 3.1.
+    # MAX_LAT is a more exact calculation of this y.
+    y1 = (2 * (y / height) - 1) * Y_FOR_MAX_LAT_MERCATOR
+    lat =  2 * math.atan(math.exp(y1)) - PI_OVER_2
+    return (lat, lon)
+
+def mapToLatLonEquirectangular(x, y, width, height):
+    """
+    Convert from a location, `x`, `y`, in a final map image (of total size:
+    `width`, `height`) to a tuple, `(latidude, longitude)`, using the
+    equirectangular projection.
+    Latitude goes from -`math.py/2` at `y` == 0 to `math.pi/2` at `y` == `height`.
+    Longitude goes from -`math.pi` at `x` == 0 to `math.pi` at `x` == `width`.
+    """
+
+    # Formulas from: https://en.wikipedia.org/wiki/Equirectangular_projection
+    # In those formulas, lambda is longitude.
+    # Use radius of 1.
+    lon = (2 * (x / width) - 1) * math.pi
+    lat = (2 * (y / height) - 1) * PI_OVER_2
+    return (lat, lon)
+
+def directionRays(forward, right, up):
+    """
+    Returns a tuple, (`rayX`, `rayY`, `rayZ`), of the unit vectors, in the frame
+    of `latLonToVector`, for the directions with the (forward, right, up)
+    components in the NumPy arrays `forward`, `right`, `up`.
+    """
+
+    norm = np.sqrt(forward * forward + right * right + up * up)
+    return (forward / norm, -right / norm, up / norm)
+
+class Projection:
+    """
+    A projection from the final image to directions on the sphere, for
+    `createSamplingIndices`.  `name` identifies the projection for users (e.g.,
+    in the `--proj` option), and `tag` is a stable string of four characters
+    identifying it in cache files, so it must be unique and must not change.
+    If the projection's latitude depends only on the final image's Y coordinate,
+    and its longitude only on the X coordinate, `mapToLatLon` is a function like
+    `mapToLatLonEquirectangular`, which allows faster sampling; otherwise it is
+    `None`.
+    """
+    mapToLatLon = None
+
+    def __init__(self, name, tag):
+        self.name = name
+        self.tag = tag
+
+    def rays(self, x, y, width, height):
+        """
+        Returns a tuple, (`rayX`, `rayY`, `rayZ`, `valid`), of arrays of the unit
+        vectors (in the frame of `latLonToVector`) for the points with coordinates
+        in the NumPy arrays `x`, `y` in a final image of size `width`, `height`
+        (with `y` increasing upwards, as in Blender's images), and of whether each
+        point is in the projection's valid region.  The vectors for points outside
+        the valid region are arbitrary.
+        """
+
+        raise NotImplementedError()
+
+    def validMask(self, width, height):
+        """
+        Returns a boolean NumPy array with shape (`height`, `width`) indicating
+        which pixels of a final image of that size have centers in the projection's
+        valid region.  Subsamples outside the valid region are transparent.
+        """
+
+        y, x = np.mgrid[0:height, 0:width] + 0.5
+        return self.rays(x, y, width, height)[3]
+
+    def __repr__(self):
+        return "{}({!r}, {!r})".format(type(self).__name__, self.name, self.tag)
+
+class LatLonProjection(Projection):
+    """
+    A projection defined by a function, `mapToLatLon`, like
+    `mapToLatLonEquirectangular`, covering the whole final image.
+    """
+    def __init__(self, name, tag, mapToLatLon):
+        Projection.__init__(self, name, tag)
+        self.mapToLatLon = mapToLatLon
+
+    def rays(self, x, y, width, height):
+        # The latitude depends only on Y and the longitude only on X, so call
+        # `mapToLatLon` once per distinct coordinate.
+        xUnique, xInverse = np.unique(x, return_inverse=True)
+        yUnique, yInverse = np.unique(y, return_inverse=True)
+        lon = np.array([self.mapToLatLon(v, 0, width, height)[1] for v in xUnique])[xInverse].reshape(np.shape(x))
+        lat = np.array([self.mapToLatLon(0, v, width, height)[0] for v in yUnique])[yInverse].reshape(np.shape(y))
+        lat1 = PI_OVER_2 - lat
+        s = np.sin(lat1)
+        return (s * np.cos(lon), -s * np.sin(lon), np.cos(lat1), np.ones(np.shape(x), dtype=bool))
+
+class EquiAngularCubemapProjection(Projection):
+    """
+    The equi-angular cubemap (EAC) layout, which many players and hardware
+    decoders support: the final image is a grid of three by two cells, each with
+    one face of a cube around the camera, and within each cell the angle (rather
+    than the position on the cube face, as in the rendered cube images) varies
+    linearly, which spreads the pixels more evenly over the sphere.  The top row
+    has the left, front and right faces, upright, and the bottom row has the
+    down, back and up faces, turned a quarter turn, so each row is a continuous
+    strip.
+    """
+    # For each cell, from the top left, the direction of the center of the cell,
+    # and the directions of increasing X and Y in the cell.
+    CELLS = [
+        (LEFT, FORWARD, UP),
+        (FORWARD, RIGHT, UP),
+        (RIGHT, BACK, UP),
+        (DOWN, BACK, LEFT),
+        (BACK, UP, LEFT),
+        (UP, FORWARD, LEFT)
+    ]
+
+    def rays(self, x, y, width, height):
+        cellWidth = width / 3
+        cellHeight = height / 2
+        column = np.clip(np.floor(x / cellWidth), 0, 2)
+        top = y >= cellHeight
+        cell = (np.where(top, 0, 3) + column).astype(int)
+        s = np.tan((2 * (x / cellWidth - column) - 1) * (math.pi / 4))
+        t = np.tan((2 * (y / cellHeight - top) - 1) * (math.pi / 4))
+
+        center, xDir, yDir = [np.array([c[k] for c in self.CELLS], dtype=np.float64)[cell] for k in range(3)]
+        direction = center + s[..., None] * xDir + t[..., None] * yDir
+        rayX, rayY, rayZ = directionRays(direction[..., 0], direction[..., 1], direction[..., 2])
+        return (rayX, rayY, rayZ, np.ones(np.shape(x), dtype=bool))
+
+class AzimuthalProjection(Projection):
+    """
+    A projection of the directions around `axis` onto the circle inscribed in
+    the final image (centered, with the diameter of the image's smaller
+    dimension): the direction from the center of the image is the direction
+    from `axis`, with `imageRight` and `imageUp` the directions toward the right
+    and the top of the image, and the distance from the center determines the
+    angle from `axis`, as given by `angle`.  The field of view, `fov` (in radians),
+    is the angle spanned by the inscribed circle.  The directions are (forward,
+    right, up) tuples.
+    """
+    def __init__(self, name, tag, fov, axis, imageRight, imageUp):
+        Projection.__init__(self, name, tag)
+        self.fov = fov
+        self.axis = np.array(axis, dtype=np.float64)
+        self.imageRight = np.array(imageRight, dtype=np.float64)
+        self.imageUp = np.array(imageUp, dtype=np.float64)
+
+    def angle(self, r):
+        """
+        Returns a tuple, (`theta`, `valid`), of the angles from the axis for the
+        distances `r` from the center of the image (with 1 at the edge of the
+        inscribed circle), and of whether each distance is in the valid region.
+        """
+
+        raise NotImplementedError()
+
+    def rays(self, x, y, width, height):
+        radius = min(width, height) / 2
+        px = (x - width / 2) / radius
+        py = (y - height / 2) / radius
+        r = np.hypot(px, py)
+        theta, valid = self.angle(r)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            cosPhi = np.where(r > 0, px / r, 0)
+            sinPhi = np.where(r > 0, py / r, 0)
+        sinTheta = np.sin(theta)
+        direction = np.cos(theta)[..., None] * self.axis + \
+                    (sinTheta * cosPhi)[..., None] * self.imageRight + (sinTheta * sinPhi)[..., None] * self.imageUp
+        rayX, rayY, rayZ = directionRays(direction[..., 0], direction[..., 1], direction[..., 2])
+        return (rayX, rayY, rayZ, valid)
+
+class FisheyeProjection(AzimuthalProjection):
+    """
+    The equidistant fisheye projection, as used for dome masters: the angle from
+    the axis is proportional to the distance from the center of the image, and
+    only the inscribed circle is valid.
+    """
+    def angle(self, r):
+        return (r * (self.fov / 2), r <= 1)
+
+class StereographicProjection(AzimuthalProjection):
+    """
+    The stereographic projection, which preserves angles, and with the nadir as
+    the axis gives the "little planet" look: the distance from the center of the
+    image is proportional to the tangent of half the angle from the axis.  The
+    whole image is valid, with directions beyond the field of view in its corners.
+    """
+    def angle(self, r):
+        return (2 * np.arctan(r * math.tan(self.fov / 4)), np.ones(np.shape(r), dtype=bool))
+
+class StackedProjection(Projection):
+    """
+    A top-bottom stereo layout, with the final image split into a top half and
+    a bottom half, each with the whole image of the projection `inner`.  The top
+    half is for the left eye and the bottom half for the right eye.
+    """
+    def __init__(self, name, tag, inner):
+        Projection.__init__(self, name, tag)
+        self.inner = inner
+        if inner.mapToLatLon != None:
+            self.mapToLatLon = self.mapToLatLonStacked
+
+    def mapToLatLonStacked(self, x, y, width, height):
+        """
+        A function like `mapToLatLonEquirectangular`, if `inner` has one.
+        """
+
+        half = height / 2
+        return self.inner.mapToLatLon(x, y - half if y >= half else y, width, half)
+
+    def rays(self, x, y, width, height):
+        half = height / 2
+        return self.inner.rays(x, np.where(y >= half, y - half, y), width, half)
+
+EQUIRECTANGULAR = LatLonProjection("equirectangular", "eqrc", mapToLatLonEquirectangular)
+EQUI_ANGULAR_CUBEMAP = EquiAngularCubemapProjection("eac", "eacm")
+
+# The projections, in the order of the numbers used for `--proj` in sphericalVideo.py.
+PROJECTIONS = [
+    EQUIRECTANGULAR,
+    LatLonProjection("mercator", "merc", mapToLatLonMercator),
+    EQUI_ANGULAR_CUBEMAP,
+    FisheyeProjection("dome", "dome", math.pi, UP, RIGHT, BACK),
+    FisheyeProjection("fisheye", "fish", math.pi, FORWARD, RIGHT, UP),
+    StereographicProjection("stereographic", "ster", 1.5 * math.pi, DOWN, RIGHT, FORWARD),
+    StackedProjection("top-bottom", "tbeq", EQUIRECTANGULAR),
+    StackedProjection("top-bottom-eac", "tbea", EQUI_ANGULAR_CUBEMAP)
+]
+
+def projectionNames():
+    """
+    Returns a string listing the projections' numbers and names, for help messages.
+    """
+
+    return ", ".join(["{}: {}".format(i, projection.name) for i, projection in enumerate(PROJECTIONS)])
+
+def getProjection(projection):
+    """
+    Returns the `Projection` for `projection`, which can be a `Projection`, the
+    name or the number (as an integer or a string) of a projection in `PROJECTIONS`,
+    or a function like `mapToLatLonEquirectangular`.  A function not used by a
+    projection in `PROJECTIONS` gets a `LatLonProjection` with a tag derived from
+    the function's name.  Raises `ValueError` for an unknown name or number.
+    """
+
+    if isinstance(projection, Projection):
+        return projection
+    if isinstance(projection, str):
+        if projection.isdigit():
+            projection = int(projection)
+        else:
+            for p in PROJECTIONS:
+                if p.name == projection.lower():
+                    return p
+            raise ValueError("Unknown projection '{}' (known: {})".format(projection, projectionNames()))
+    if isinstance(projection, int):
+        if projection < 0 or projection >= len(PROJECTIONS):
+            raise ValueError("Unknown projection {} (known: {})".format(projection, projectionNames()))
+        return PROJECTIONS[projection]
+    for p in PROJECTIONS:
+        if p.mapToLatLon == projection:
+            return p
+    name = "{}.{}".format(getattr(projection, "__module__", ""), getattr(projection, "__qualname__", repr(projection)))
+    return LatLonProjection(name, "f" + hashlib.sha256(name.encode("utf-8")).hexdigest()[:3], projection)
+
+def getProjectionTag(mapToLatLon):
+    """
+    Returns a string indicating the type of projection used in `mapToLatLon`
+    (anything accepted by `getProjection`).  This string is used to tag a cache file.
+    """
+
+    return getProjection(mapToLatLon).tag
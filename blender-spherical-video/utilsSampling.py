@@ -0,0 +1,1489 @@
+# The engine for resampling the images on the faces of a cube into a spherical
+# image with one of the projections in utilsProjections.py (e.g., equirectangular
+# or Mercator): the sampling indices and their cache, and the resampling itself.
+# This module uses only NumPy, not Blender's `bpy` or `mathutils` modules, so it
+# can be used in plain Python (e.g., to build the cache, for benchmarks and
+# tests, or in a separate process).
+
+import collections
+import hashlib
+import math
+import mmap
+import numpy as np
+import os
+import os.path
+import struct
+import tempfile
+import time
+
+from utilsProjections import MAX_LAT_MERCATOR, Y_FOR_MAX_LAT_MERCATOR, PI_OVER_2, \
+                             mapToLatLonMercator, mapToLatLonEquirectangular, \
+                             Projection, LatLonProjection, PROJECTIONS, getProjection, getProjectionTag
+
+# For floating-point comparisons.
+EPS = 1e-10
+
+# The face index for the subsamples outside a projection's valid region (see
+# `Projection.validMask`), which sample a blank (transparent) image of one pixel,
+# stored after the six cube images in the cube pixels.
+BLANK_FACE = 6
+
+# The X computed by `cubeIntersection` could be either left or right in the cube
+# face image to be sampled.  This factor, for each face, gives it the correct
+# orientation for the face that was intersected.
+FACE_ORIENTATION = np.array([-1, 1, 1, -1, -1, 1])
+
+# The environment variable that, if set, overrides the default directory for
+# the sampling indices cache files (next to this source file), which may not
+# be writable in some installations.
+CACHE_DIR_ENV = "SPHERICAL_VIDEO_CACHE_DIR"
+
+# The environment variable that, if set, overrides the default maximum total size
+# of the cache files, in megabytes.  When writing a cache file makes the total
+# larger, the least recently used cache files are removed.
+CACHE_LIMIT_ENV = "SPHERICAL_VIDEO_CACHE_LIMIT"
+DEFAULT_CACHE_LIMIT_MB = 2048
+
+# The filters for resampling the cube images into the final image, as used by
+# `createSamplingIndices`: "nearest" samples the cube pixel containing each
+# subsample, "bilinear" interpolates the four cube pixels nearest each subsample,
+# and "area" weights cube pixels by their coverage of the final image pixel.
+FILTERS = ["nearest", "bilinear", "area"]
+
+# The minimum number of points per pixel, in each dimension, used by the "area"
+# filter to estimate the coverage of the cube pixels.
+AREA_SUPERSAMPLES = 4
+
+# The rows of the final image whose latitudes are all at least this far from the
+# equator sample only the polar (Z) faces of the cube.
+MIN_LAT_POLAR_ONLY = math.pi / 4
+
+# The version of the algorithm that computes the sampling indices, which is part
+# of the key for cache files.  It must be incremented whenever a change to the
+# algorithm changes the sampling indices, so older cache files are not used.
+SAMPLING_ALGORITHM_VERSION = 1
+
+# The sampling indices already created in this process, keyed by `Sizes` and the
+# projection function, so repeated renderings in one process (e.g., for several
+# cameras or .blend files) create them once.  The least recently used entries are
+# discarded beyond `MEMO_MAX_ENTRIES`, since each entry can be hundreds of megabytes.
+samplingIndicesMemo = collections.OrderedDict()
+MEMO_MAX_ENTRIES = 4
+
+def latLonToVector(lat, lon):
+    """
+    Convert a latitude, `lat`, and longitude, `lon` to a 3D vector, a NumPy
+    float32 array (with the same precision as a `mathutils.Vector` in Blender),
+    pointing from the center of the sphere to the point with that latitude and
+    longitude.  Assumes that the "up" axis is the positive Z axis, as is the
+    default for Blender.
+    """
+
+    # Use radius of 1.
+    lat1 = PI_OVER_2 - lat
+    s = math.sin(lat1)
+    x = s * math.cos(lon)
+    y = -s * math.sin(lon)
+    z = math.cos(lat1)
+    return np.array((x, y, z), dtype=np.float32)
+
+def cubeIntersection(ray, prevInter=0):
+    """
+    Returns the intersection of `ray` with a 3D unit cube (going from -1 to 1 in
+    each dimension).  The `ray` is a 3D unit vector, like that returned by
+    `latLonToVector`, assumed to be eminating from the origin.  The result is a
+    tuple, (`i`, `p`): `i` is the index of the face intersected (0 for the face at
+    X == 1, 1 for X == -1, 2 for Y == 1, 3 for Y == -1, 4 for Z == 1, 5 for
+    Z == -1), and `p` is the 2D intersection point on the face, a NumPy float32
+    array, with each coordinate in [-1, 1].  For efficiency, `prevInter` should be
+    the index of the face intersected for the preceding pixel; in many cases,
+    that face will be interesected again for the current pixel, so testing it
+    first allows the function to terminate more quickly.
+    """
+
+    faces = [0, 1, 2, 3, 4, 5]
+    faces[0] = prevInter
+    faces[prevInter] = 0
+    for i in faces:
+        axis = int(i / 2)
+        dot = float(ray[axis])
+        if i % 2 == 1:
+            dot = -dot
+
+        # If dot is negative, then ray is pointing away from this face,
+        # and only the flipped ray would interset the face.
+        # If dot is essentially 0 (less than EPS) then the ray is parallel
+        # to the face and would never intersect it.
+        if dot < EPS:
+            continue
+
+        pt = []
+        for j in [k for k in range(3) if k != axis]:
+            inter = float(ray[j]) / dot
+            if abs(inter) <= 1:
+                pt.append(inter)
+            else:
+                break
+        if len(pt) == 2:
+            return (i, np.array(pt, dtype=np.float32))
+
+    # Should never happen.
+    return None
+
+class Sizes:
+    """
+    A convenient collection of the sizes used in the conversion from six images
+    on the face of a cube to the final spherical image.
+    `width` and `height` are the dimension, in pixels, of the final image.
+    `cube` is width and height of each cube image.
+    `subWidth` and `subHeight` give the number of subsamples used to compute
+    each pixel in the final image.
+    `polarCube` is the width and height of the polar (Z) cube images, which
+    is `cube` unless `polarCubeSize` is specified.
+    If `adaptive` is `True`, `subWidth` and `subHeight` are the maximum numbers
+    of subsamples, with each row of the final image using the numbers from
+    `adaptiveSubsamples`.
+    A `Sizes` is immutable and hashable, so it can be used as a dictionary key.
+    """
+    __slots__ = ("width", "height", "cube", "subWidth", "subHeight", "polarCube", "adaptive")
+
+    def __init__(self, width, height, cubeSize, subWidth, subHeight, polarCubeSize=None, adaptive=False):
+        object.__setattr__(self, "width", width)
+        object.__setattr__(self, "height", height)
+        object.__setattr__(self, "cube", cubeSize)
+        object.__setattr__(self, "subWidth", subWidth)
+        object.__setattr__(self, "subHeight", subHeight)
+        object.__setattr__(self, "polarCube", polarCubeSize if polarCubeSize != None else cubeSize)
+        object.__setattr__(self, "adaptive", bool(adaptive))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Sizes is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError("Sizes is immutable")
+
+    def key(self):
+        return (self.width, self.height, self.cube, self.subWidth, self.subHeight, self.polarCube, self.adaptive)
+
+    def faceSizes(self):
+        """
+        Returns an array of the width (and height) of each cube image, indexed by
+        the face index from `cubeIntersection`, followed by 1 for the blank image
+        (`BLANK_FACE`).
+        """
+
+        return np.array([self.cube] * 4 + [self.polarCube] * 2 + [1])
+
+    def faceOffsets(self):
+        """
+        Returns an array of the index of the first pixel of each cube image, and of
+        the blank pixel, in the concatenation of the cube images (as from
+        `getCubePixels`), followed by the total number of pixels, including the
+        blank pixel.
+        """
+
+        return np.concatenate([[0], np.cumsum(self.faceSizes() ** 2)])
+
+    def withSubsamples(self, subWidth, subHeight):
+        """
+        Returns a `Sizes` like this one, but not adaptive, with `subWidth` and
+        `subHeight` subsamples for every row.
+        """
+
+        return Sizes(self.width, self.height, self.cube, subWidth, subHeight, self.polarCube)
+
+    def __eq__(self, other):
+        return isinstance(other, Sizes) and self.key() == other.key()
+
+    def __hash__(self):
+        return hash(self.key())
+
+    def __reduce__(self):
+        # Pickling, as for worker processes, needs the constructor, as
+        # `__setattr__` prevents the default restoring of the attributes.
+        return (Sizes, self.key())
+
+    def __repr__(self):
+        return "Sizes(width={}, height={}, cubeSize={}, subWidth={}, subHeight={}, polarCubeSize={}, adaptive={})".\
+            format(*self.key())
+
+class SamplingIndices:
+    """
+    The indices used to resample the rendered cube images into the final
+    spherical image, as returned by `createSamplingIndices`.  `face`, `x` and `y`
+    are NumPy arrays with one row per final image pixel and one column per
+    subsample used to compute that pixel.  For each subsample, `face` is the index
+    of a face image (as returned by `cubeIntersection`), and `x` and `y` are a
+    point on that image from which to sample.  Storing the indices this way takes
+    five bytes per subsample.  For the "bilinear" and "area" filters, each column
+    is instead a tap, a cube image pixel contributing to the final image pixel,
+    and `weights` is an array of the same shape with each tap's weight, with the
+    weights for each final image pixel summing to one.  For the "nearest" filter,
+    `weights` is `None`, and the subsamples have equal weights.  For adaptive
+    `Sizes`, the number of columns varies by row of the final image, so `rowCounts`
+    is an array with the number of columns for each row, and the other arrays are
+    flat, with each final image pixel's columns following those of the pixel before.
+    """
+    def __init__(self, face, x, y, weights=None, rowCounts=None):
+        self.face = face
+        self.x = x
+        self.y = y
+        self.weights = weights
+        self.rowCounts = rowCounts
+        # Computed when first needed, by `flatSamplingIndices` and `faceBounds`.
+        self.flat = None
+        self.bounds = None
+
+# The binary form of the sampling indices starts with a header, with these
+# fields: a magic string, a format version, the image dimensions from `Sizes`,
+# the projection tag, the data type of the face X and Y coordinates, the number
+# of exceptions (described below), the filter (its first four characters), the
+# number of subsamples or taps per final image pixel (0 if adaptive), the size of
+# the polar cube images, and whether the sizes are adaptive.  The header is
+# followed by the arrays of face indices, face X coordinates and face Y
+# coordinates (and for filters with weights, the weights), each starting at a
+# multiple of `BINARY_ALIGNMENT`.  For adaptive sizes, these arrays are flat, and
+# preceded by the array of the number of subsamples or taps for each row (see
+# `SamplingIndices`).  For the "nearest" filter and a projection with mirror
+# symmetries (see `projectionMirrors`), these arrays cover only the
+# `fundamentalRegion`, in the layout from `toSubsampleGrid`, and they are
+# followed by arrays of the positions and the face indices, X and Y coordinates
+# of the exceptions, the subsamples whose indices differ from those derived by
+# `expandMirrors`.
+BINARY_MAGIC = b"SPHVIDX\0"
+BINARY_VERSION = 5
+BINARY_HEADER_FORMAT = "<8sIIIIII4s4sQ4sIII"
+BINARY_ALIGNMENT = 64
+
+def subsampleCoordinates(size, subSize):
+    """
+    Returns a NumPy array of shape (`size`, `subSize`) containing, for each of
+    the `size` pixels along one dimension of the final image, the coordinates of
+    its `subSize` subsamples along that dimension.  The coordinates are computed
+    by repeatedly adding the subsample spacing, so the results are identical
+    to a loop that steps from one subsample to the next.
+    """
+
+    dSub = 1 / (subSize + 1)
+    result = np.empty((size, subSize))
+    sub = np.arange(size, dtype=np.float64) + dSub
+    for k in range(subSize):
+        result[:, k] = sub
+        sub = sub + dSub
+    return result
+
+def cubeIntersectionHits(rayX, rayY, rayZ):
+    """
+    Returns a tuple, (`hits`, `pts`), for the rays with components in the NumPy
+    arrays `rayX`, `rayY`, `rayZ`: `hits` is a boolean array with a row for each
+    of the six faces, indicating which rays intersect that face (as in
+    `cubeIntersection`), and `pts` is a list with the 2D intersection points
+    (as a pair of arrays of coordinates) of the rays with each face's plane.
+    """
+
+    ray = (rayX, rayY, rayZ)
+    hits = []
+    pts = []
+    with np.errstate(divide="ignore", invalid="ignore"):
+        for i in range(6):
+            axis = int(i / 2)
+            dot = ray[axis]
+            if i % 2 == 1:
+                dot = -dot
+            inter = [ray[j] / dot for j in range(3) if j != axis]
+            hit = (dot >= EPS) & (np.abs(inter[0]) <= 1) & (np.abs(inter[1]) <= 1)
+            hits.append(hit)
+            pts.append(inter)
+    return (np.stack(hits), pts)
+
+def cubeIntersections(rayX, rayY, rayZ, prevInter=0):
+    """
+    A vectorized version of `cubeIntersection`, for many rays at once.  The
+    components of the rays are in the NumPy arrays `rayX`, `rayY`, `rayZ`, which
+    should have the same (single) precision as the result of `latLonToVector`.  Returns a
+    tuple, (`i`, `px`, `py`), of arrays: `i` is the index of the face intersected
+    by each ray, and `px`, `py` are the coordinates of the 2D intersection point
+    on that face.  The rays are assumed to be in the order that `cubeIntersection`
+    would be called for them, and `prevInter` is the index of the face intersected
+    by the ray preceding the first one, so when a ray hits an edge shared by two
+    faces, the face chosen is the same as would be chosen by `cubeIntersection`.
+    """
+
+    hits, pts = cubeIntersectionHits(rayX, rayY, rayZ)
+
+    # In most cases, exactly one face is hit and it is the first face with a hit.
+    face = np.argmax(hits, axis=0)
+
+    # When a ray hits more than one face (i.e., an edge or corner), the face
+    # returned by `cubeIntersection` depends on the face hit by the preceding ray,
+    # so resolve these rare cases in order.
+    for j in np.flatnonzero(np.count_nonzero(hits, axis=0) > 1):
+        prev = face[j - 1] if j > 0 else prevInter
+        face[j] = resolveEdgeIntersection(hits[:, j], prev)
+
+    px = np.choose(face, [pt[0] for pt in pts])
+    py = np.choose(face, [pt[1] for pt in pts])
+    return (face, px, py)
+
+def resolveEdgeIntersection(hit, prevInter):
+    """
+    Returns the face chosen by `cubeIntersection` for a ray that hits each face
+    `i` for which `hit[i]` is true, given the face `prevInter` hit by the
+    preceding ray.
+    """
+
+    faces = [0, 1, 2, 3, 4, 5]
+    faces[0] = prevInter
+    faces[prevInter] = 0
+    return next(i for i in faces if hit[i])
+
+def createSamplingIndices(sizes, mapToLatLon=mapToLatLonEquirectangular, cache=True, cacheDir=None, cacheLimit=None,
+                          memo=True, filter="nearest"):
+    """
+    Returns the indices used to resample the rendered cube images into the final
+    spherical image, as a `SamplingIndices`.  For each final image pixel, the
+    indices give each of the subsamples used to compute the pixel: the index
+    of a face image, as returned by `cubeIntersection`, and a point on that image
+    from which to sample. The `mapToLatLon` argument is the projection, anything
+    accepted by `getProjection` (e.g., a `Projection` from `PROJECTIONS`, its name,
+    or a function like `mapToLatLonEquirectangular` that computes latitudes and
+    longitudes), so different projections can be supported.  Subsamples outside
+    the projection's valid region sample the blank pixel (see `BLANK_FACE`).
+    Note that the indices depend only on the various image dimensions in `sizes`
+    and do not depend on the actual cube images.  Thus, the indices can be
+    computed once at the beginning of the rendering of an animation, and reused
+    at each frame.  In fact, the indices are cached and reused across animations,
+    unless the `cache` argument is `False`.  The cache files are in `cacheDir`,
+    or the directory from `cacheDirectory` if `cacheDir` is `None`, and their
+    total size is limited to `cacheLimit` megabytes, as in `evictCacheFiles`.
+    Within one process, the same result is returned again for the same `sizes`
+    and `mapToLatLon`, without reading the cache, unless `memo` is `False`.
+    The `filter` is one of `FILTERS`, and for the "bilinear" and "area" filters,
+    the result has weights, as described in `SamplingIndices`.
+    """
+    if not filter in FILTERS:
+        raise ValueError("Unknown filter '{}'".format(filter))
+    memoKey = (sizes, mapToLatLon, filter)
+    if memo and memoKey in samplingIndicesMemo:
+        samplingIndicesMemo.move_to_end(memoKey)
+        return samplingIndicesMemo[memoKey]
+
+    result = createSamplingIndicesUnmemoized(sizes, mapToLatLon, cache, cacheDir, cacheLimit, filter)
+
+    if memo:
+        samplingIndicesMemo[memoKey] = result
+        while len(samplingIndicesMemo) > MEMO_MAX_ENTRIES:
+            samplingIndicesMemo.popitem(last=False)
+
+    return result
+
+def clearSamplingIndicesMemo():
+    """
+    Discards the sampling indices kept by `createSamplingIndices` in this process.
+    """
+
+    samplingIndicesMemo.clear()
+
+def createSamplingIndicesUnmemoized(sizes, mapToLatLon, cache, cacheDir, cacheLimit, filter="nearest"):
+    """
+    Returns the sampling indices as in `createSamplingIndices`, from the cache
+    or by computing them, but not from the memo kept in this process.
+    """
+
+    projectionTag = getProjectionTag(mapToLatLon)
+    if cache:
+        cachedResult = readSamplingIndicesFromCache(sizes, projectionTag, cacheDir, filter)
+        if cachedResult != None:
+            print("Using cached sampling indices")
+            return cachedResult
+    else:
+        print("Ignoring the samping indices cache")
+
+    result = SamplingIndices(*computeFilteredSamplingIndices(sizes, mapToLatLon, filter))
+
+    if cache:
+        writeSamplingIndicesToCache(sizes, projectionTag, result, cacheDir, cacheLimit, filter)
+
+    return result
+
+def computeFilteredSamplingIndices(sizes, mapToLatLon, filter="nearest"):
+    """
+    Computes the sampling indices for `filter`, one of `FILTERS`, returning the
+    tuple of arrays for `SamplingIndices`.  For adaptive `sizes`, the indices
+    for each band of rows from `subsampleBands` are computed separately, and
+    concatenated into the flat arrays described in `SamplingIndices`.
+    """
+
+    if filter == "bilinear":
+        compute = computeBilinearSamplingIndices
+    elif filter == "area":
+        compute = computeAreaSamplingIndices
+    else:
+        compute = computeSamplingIndices
+
+    if not sizes.adaptive:
+        return compute(sizes, mapToLatLon)
+
+    rowCounts = np.empty(sizes.height, dtype=np.uint32)
+    bands = []
+    for row0, row1, subWidth, subHeight in subsampleBands(sizes, mapToLatLon):
+        arrays = compute(sizes.withSubsamples(subWidth, subHeight), mapToLatLon, (row0, row1))
+        rowCounts[row0:row1] = arrays[0].shape[1]
+        bands.append([array.ravel() for array in arrays])
+    result = [np.concatenate(arrays) for arrays in zip(*bands)]
+    if len(result) == 3:
+        result.append(None)
+    return tuple(result) + (rowCounts,)
+
+def adaptiveSubsamples(sizes, mapToLatLon):
+    """
+    Returns a tuple, (`subWidths`, `subHeights`), of arrays with the numbers of
+    subsamples in each dimension for each row of the final image, for adaptive
+    `sizes`.  The numbers are proportional to the size on the sphere of the row's
+    pixels, from the local Jacobian of `mapToLatLon`: the angle spanned by a
+    pixel horizontally, at the row's latitude nearest the equator, and vertically.
+    The rows with the largest pixels (e.g., at the equator) get `sizes.subWidth`
+    and `sizes.subHeight` subsamples, and every row gets at least one.  The rows
+    that sample only the polar faces (see `MIN_LAT_POLAR_ONLY`) are scaled by the
+    relative size of those faces, `sizes.polarCube / sizes.cube`.  For projections
+    other than a `LatLonProjection`, the angles are from `pixelAngles`, the largest
+    in each row, without the scaling for the polar faces.
+    """
+
+    projection = getProjection(mapToLatLon)
+    if not isinstance(projection, LatLonProjection):
+        across, down = pixelAngles(sizes, projection)
+        across = across.max(axis=1)
+        down = down.max(axis=1)
+        polarScale = 1
+    else:
+        across, down, polarScale = latLonPixelAngles(sizes, projection.mapToLatLon)
+
+    # The small allowance keeps rounding errors from adding a subsample.
+    subWidths = np.ceil(sizes.subWidth * polarScale * across / max(across.max(), EPS) - 1e-6)
+    subHeights = np.ceil(sizes.subHeight * polarScale * down / max(down.max(), EPS) - 1e-6)
+    subWidths = np.clip(subWidths, 1, sizes.subWidth).astype(int)
+    subHeights = np.clip(subHeights, 1, sizes.subHeight).astype(int)
+    return (subWidths, subHeights)
+
+def latLonPixelAngles(sizes, mapToLatLon):
+    """
+    Returns a tuple, (`across`, `down`, `polarScale`), of arrays with the angles
+    spanned horizontally and vertically by the pixels of each row of the final
+    image, for `adaptiveSubsamples` with a projection with a `mapToLatLon`
+    function, and with the scale for the rows that sample only the polar faces.
+    """
+
+    width = sizes.width
+    height = sizes.height
+    lonStep = abs(mapToLatLon(1, 0, width, height)[1] - mapToLatLon(0, 0, width, height)[1])
+    latEdges = np.array([mapToLatLon(0, y, width, height)[0] for y in range(height + 1)])
+    above = np.abs(latEdges[:-1])
+    below = np.abs(latEdges[1:])
+    crossesEquator = latEdges[:-1] * latEdges[1:] <= 0
+    latNearEquator = np.where(crossesEquator, 0, np.minimum(above, below))
+
+    across = lonStep * np.cos(latNearEquator)
+    down = np.abs(np.diff(latEdges))
+    polarScale = np.where(latNearEquator >= MIN_LAT_POLAR_ONLY, sizes.polarCube / sizes.cube, 1)
+    return (across, down, polarScale)
+
+def pixelAngles(sizes, projection):
+    """
+    Returns a tuple, (`across`, `down`), of arrays with shape (`sizes.height`,
+    `sizes.width`) of the angles spanned horizontally and vertically by each final
+    image pixel with `projection`, estimated from the rays at a quarter and three
+    quarters of the way across the pixel (so a pixel at the border between two
+    parts of a layout is measured within its own part).  The angles are 0 for
+    pixels whose center is outside the projection's valid region.
+    """
+
+    width = sizes.width
+    height = sizes.height
+    y, x = np.mgrid[0:height, 0:width] + 0.5
+
+    def rays(x, y):
+        rayX, rayY, rayZ, valid = projection.rays(x, y, width, height)
+        return (np.stack([rayX, rayY, rayZ], axis=-1), valid)
+
+    valid = projection.rays(x, y, width, height)[3]
+    angles = []
+    for dx, dy in [(0.25, 0), (0, 0.25)]:
+        (ray0, valid0), (ray1, valid1) = rays(x - dx, y - dy), rays(x + dx, y + dy)
+        chord = np.linalg.norm(ray1 - ray0, axis=-1)
+        angle = 4 * np.arcsin(np.minimum(chord / 2, 1))
+        angles.append(np.where(valid & valid0 & valid1, angle, 0))
+    return tuple(angles)
+
+def subsampleBands(sizes, mapToLatLon):
+    """
+    Returns a list of the bands of consecutive rows of the final image with the
+    same numbers of subsamples from `adaptiveSubsamples`, each a tuple, (`row0`,
+    `row1`, `subWidth`, `subHeight`), for the rows from `row0` up to (but not
+    including) `row1`.
+    """
+
+    subWidths, subHeights = adaptiveSubsamples(sizes, mapToLatLon)
+    changes = np.flatnonzero((np.diff(subWidths) != 0) | (np.diff(subHeights) != 0)) + 1
+    starts = [0] + changes.tolist()
+    ends = changes.tolist() + [sizes.height]
+    return [(row0, row1, int(subWidths[row0]), int(subHeights[row0])) for row0, row1 in zip(starts, ends)]
+
+def samplingBands(samplingIndices, sizes):
+    """
+    Returns a list of the bands of consecutive rows of the final image with the
+    same number of columns in the adaptive `samplingIndices`, each a tuple,
+    (`start`, `end`, `pixel0`, `pixel1`), for the flat arrays from index `start`
+    up to `end`, which have the columns of the final image pixels from `pixel0`
+    up to `pixel1`.
+    """
+
+    rowCounts = samplingIndices.rowCounts.astype(np.int64)
+    changes = np.flatnonzero(np.diff(rowCounts) != 0) + 1
+    rowStarts = [0] + changes.tolist()
+    rowEnds = changes.tolist() + [sizes.height]
+    starts = np.concatenate([[0], np.cumsum(rowCounts * sizes.width)])
+    return [(int(starts[row0]), int(starts[row1]), row0 * sizes.width, row1 * sizes.width)
+            for row0, row1 in zip(rowStarts, rowEnds)]
+
+def samplingTrigonometry(sizes, mapToLatLon):
+    """
+    Returns a tuple, (`cosLon`, `sinLon`, `sinLat1`, `cosLat1`), of the
+    trigonometric functions used by `latLonToVector` for each subsample, as
+    arrays with shape (`sizes.width`, `sizes.subWidth`) for the longitude terms
+    and (`sizes.height`, `sizes.subHeight`) for the latitude terms.  Assumes, as
+    is true for the functions of the projections that have them (see `Projection`),
+    that the latitude from `mapToLatLon` depends only on the Y coordinate and the
+    longitude only on the X coordinate.  The `mapToLatLon` can also be anything
+    accepted by `getProjection`, for a projection with such a function.
+    """
+
+    mapToLatLon = getProjection(mapToLatLon).mapToLatLon
+    width = sizes.width
+    height = sizes.height
+    xSub = subsampleCoordinates(width, sizes.subWidth)
+    ySub = subsampleCoordinates(height, sizes.subHeight)
+
+    # The trigonometry is done with the `math` functions, as in `latLonToVector`,
+    # but only once per subsample column and row.
+    lon = [mapToLatLon(x, ySub[0, 0], width, height)[1] for x in xSub.flat]
+    cosLon = np.array([math.cos(l) for l in lon]).reshape(xSub.shape)
+    sinLon = np.array([math.sin(l) for l in lon]).reshape(xSub.shape)
+    lat1 = [PI_OVER_2 - mapToLatLon(xSub[0, 0], y, width, height)[0] for y in ySub.flat]
+    sinLat1 = np.array([math.sin(l) for l in lat1]).reshape(ySub.shape)
+    cosLat1 = np.array([math.cos(l) for l in lat1]).reshape(ySub.shape)
+    return (cosLon, sinLon, sinLat1, cosLat1)
+
+def subsampleRays(cosLon, sinLon, sinLat1, cosLat1):
+    """
+    Returns a tuple, (`rayX`, `rayY`, `rayZ`), of the rays from `latLonToVector`
+    for the subsamples with the trigonometric terms from `samplingTrigonometry`,
+    which are broadcast together.  The rays are rounded to single precision,
+    like `latLonToVector`, but returned in double precision.
+    """
+
+    rayX = (sinLat1 * cosLon).astype(np.float32).astype(np.float64)
+    rayY = (-sinLat1 * sinLon).astype(np.float32).astype(np.float64)
+    rayZ = np.broadcast_to(cosLat1, rayX.shape).astype(np.float32).astype(np.float64)
+    return (rayX, rayY, rayZ)
+
+def projectedRays(sizes, projection, x, y):
+    """
+    Returns a tuple, (`rayX`, `rayY`, `rayZ`, `valid`), of flat arrays of the rays
+    for the subsamples with the final image coordinates `x` and `y` (which are
+    broadcast together) from `projection.rays`, rounded to single precision like
+    `subsampleRays`, and of whether each subsample is in the projection's valid
+    region.  The rays outside the valid region are replaced with the +X axis, so
+    they still intersect the cube.
+    """
+
+    x, y = np.broadcast_arrays(x, y)
+    rayX, rayY, rayZ, valid = projection.rays(x.ravel(), y.ravel(), sizes.width, sizes.height)
+    valid = np.asarray(valid, dtype=bool)
+    rays = []
+    for ray, replacement in [(rayX, 1), (rayY, 0), (rayZ, 0)]:
+        rays.append(np.where(valid, ray, replacement).astype(np.float32).astype(np.float64))
+    return tuple(rays) + (valid,)
+
+def faceCoordinates(sizes, face, px, py):
+    """
+    Returns a tuple, (`xInter`, `yInter`), of the intersection points `px`, `py`
+    on the faces `face` from `cubeIntersections`, rounded to single precision
+    like `cubeIntersection`, with X oriented for sampling the face images.
+    """
+
+    xInter = px.astype(np.float32).astype(np.float64) * FACE_ORIENTATION[face]
+    yInter = py.astype(np.float32).astype(np.float64)
+    return (xInter, yInter)
+
+def faceImageCoordinate(sizes, inter, face):
+    """
+    Returns the pixel coordinate (before truncation) in the images of the faces
+    `face` for the coordinate `inter`, from `faceCoordinates`.
+    """
+
+    return sizes.faceSizes()[face] * ((inter + 1) / 2)
+
+def computeSamplingIndices(sizes, mapToLatLon, rows=None):
+    """
+    Computes the sampling indices described in `createSamplingIndices`.  Returns
+    a tuple, (`face`, `xFace`, `yFace`), of arrays with shape (`sizes.width *
+    sizes.height`, `sizes.subWidth * sizes.subHeight`).  Uses the symmetries of
+    the projection, if any, as described in `computeSamplingIndicesSymmetric`,
+    and otherwise `computeSamplingIndicesDirect`.  If `rows` is not `None`, it is a
+    tuple, (`row0`, `row1`), and only the indices for the final image rows from
+    `row0` up to (but not including) `row1` are computed, directly.
+    """
+
+    mirrors = projectionMirrors(sizes, getProjectionTag(mapToLatLon))
+    if mirrors and rows == None:
+        return computeSamplingIndicesSymmetric(sizes, mapToLatLon, mirrors)
+    return computeSamplingIndicesDirect(sizes, mapToLatLon, rows)
+
+def computeSamplingIndicesDirect(sizes, mapToLatLon, rows=None):
+    """
+    Computes the sampling indices described in `createSamplingIndices`, using
+    NumPy array operations over the whole final image rather than a loop over
+    each subsample of each pixel.  Returns a tuple, (`face`, `xFace`, `yFace`),
+    of arrays with shape (`sizes.width * sizes.height`, `sizes.subWidth *
+    sizes.subHeight`).  For projections with a `mapToLatLon` function, the
+    results are identical to those from applying `mapToLatLon`, `latLonToVector`
+    and `cubeIntersection` to each subsample.  Subsamples outside the valid region
+    of the projection (see `Projection.rays`) have the face index `BLANK_FACE`.
+    The `rows` argument is as in `computeSamplingIndices`.
+    """
+
+    return computeSamplingPoints(sizes, mapToLatLon, np.uint16, rows)
+
+def computeSamplingPoints(sizes, mapToLatLon, dtype=np.float32, rows=None):
+    """
+    Computes the points on the cube images for all the subsamples, as in
+    `computeSamplingIndicesDirect`, but with coordinates of type `dtype`: an
+    integer type truncates the coordinates to pixels, as for the sampling indices,
+    while a floating-point type keeps the position within the pixel, as needed
+    for filtering.  Returns a tuple, (`face`, `xFace`, `yFace`), of arrays with
+    shape (`sizes.width * sizes.height`, `sizes.subWidth * sizes.subHeight`), or
+    fewer rows if `rows` is not `None`, as in `computeSamplingIndices`.
+    """
+
+    width = sizes.width
+    row0, row1 = rows if rows != None else (0, sizes.height)
+    projection = getProjection(mapToLatLon)
+    if projection.mapToLatLon != None:
+        cosLon, sinLon, sinLat1, cosLat1 = samplingTrigonometry(sizes, projection.mapToLatLon)
+    else:
+        xSub = subsampleCoordinates(width, sizes.subWidth)
+        ySub = subsampleCoordinates(sizes.height, sizes.subHeight)
+
+    nSub = sizes.subWidth * sizes.subHeight
+    face = np.empty((row1 - row0, width * nSub), dtype=np.uint8)
+    xFace = np.empty((row1 - row0, width * nSub), dtype=dtype)
+    yFace = np.empty((row1 - row0, width * nSub), dtype=dtype)
+
+    # Process blocks of rows, to limit the size of the intermediate arrays.
+    # The axes of each block are: row, column, subsample row, subsample column.
+    rowsPerBlock = max(1, 2**20 // (width * nSub))
+    inter = 0
+    for y0 in range(row0, row1, rowsPerBlock):
+        y1 = min(y0 + rowsPerBlock, row1)
+        if projection.mapToLatLon != None:
+            rayX, rayY, rayZ = subsampleRays(cosLon[None, :, None, :], sinLon[None, :, None, :],
+                                             sinLat1[y0:y1, None, :, None], cosLat1[y0:y1, None, :, None])
+            valid = None
+        else:
+            rayX, rayY, rayZ, valid = projectedRays(sizes, projection, xSub[None, :, None, :], ySub[y0:y1, None, :, None])
+
+        i, px, py = cubeIntersections(rayX.ravel(), rayY.ravel(), rayZ.ravel(), inter)
+        inter = i[-1]
+
+        xInter, yInter = faceCoordinates(sizes, i, px, py)
+        xPoint = faceImageCoordinate(sizes, xInter, i)
+        yPoint = faceImageCoordinate(sizes, yInter, i)
+        if valid is not None:
+            i = np.where(valid, i, BLANK_FACE)
+            xPoint[~valid] = 0
+            yPoint[~valid] = 0
+        block = slice(y0 - row0, y1 - row0)
+        face[block] = i.reshape(y1 - y0, -1)
+        xFace[block] = xPoint.astype(dtype).reshape(y1 - y0, -1)
+        yFace[block] = yPoint.astype(dtype).reshape(y1 - y0, -1)
+
+    shape = (width * (row1 - row0), nSub)
+    return (face.reshape(shape), xFace.reshape(shape), yFace.reshape(shape))
+
+def computeBilinearSamplingIndices(sizes, mapToLatLon, rows=None):
+    """
+    Computes the sampling indices for the "bilinear" filter: for each subsample,
+    the four cube image pixels whose centers surround the subsample's point,
+    weighted by bilinear interpolation.  At the borders of a face, the pixels are
+    clamped to that face.  Returns a tuple, (`face`, `xFace`, `yFace`, `weights`),
+    of arrays with shape (`sizes.width * sizes.height`, `4 * sizes.subWidth *
+    sizes.subHeight`), or fewer rows for `rows`, as in `computeSamplingIndices`.
+    """
+
+    face, xPoint, yPoint = computeSamplingPoints(sizes, mapToLatLon, np.float32, rows)
+    nPixels, nSub = face.shape
+    last = sizes.faceSizes()[face] - 1
+
+    # Pixel centers are at half-integer coordinates.
+    taps = []
+    for point in [xPoint, yPoint]:
+        point = point - np.float32(0.5)
+        low = np.floor(point)
+        frac = point - low
+        low = low.astype(np.int32)
+        taps.append([(np.clip(low, 0, last).astype(np.uint16), 1 - frac),
+                     (np.clip(low + 1, 0, last).astype(np.uint16), frac)])
+
+    tapFace = np.empty((nPixels, nSub, 4), dtype=np.uint8)
+    tapX = np.empty((nPixels, nSub, 4), dtype=np.uint16)
+    tapY = np.empty((nPixels, nSub, 4), dtype=np.uint16)
+    weights = np.empty((nPixels, nSub, 4), dtype=np.float32)
+    k = 0
+    for y, yWeight in taps[1]:
+        for x, xWeight in taps[0]:
+            tapFace[:, :, k] = face
+            tapX[:, :, k] = x
+            tapY[:, :, k] = y
+            weights[:, :, k] = xWeight * yWeight / nSub
+            k += 1
+
+    shape = (nPixels, nSub * 4)
+    return (tapFace.reshape(shape), tapX.reshape(shape), tapY.reshape(shape), weights.reshape(shape))
+
+def computeAreaSamplingIndices(sizes, mapToLatLon, rows=None):
+    """
+    Computes the sampling indices for the "area" filter: for each final image
+    pixel, the cube image pixels it covers, weighted by the fraction covered.
+    The coverage is estimated from a grid of points in the final image pixel, at
+    least `AREA_SUPERSAMPLES` and twice the subsamples in each dimension, and
+    only the `4 * sizes.subWidth * sizes.subHeight` cube pixels with the largest
+    coverage are kept, so the cost of resampling is the same as for the "bilinear"
+    filter.  Returns a tuple, (`face`, `xFace`, `yFace`, `weights`), of arrays
+    with shape (`sizes.width * sizes.height`, `4 * sizes.subWidth * sizes.subHeight`),
+    or fewer rows for `rows`, as in `computeSamplingIndices`.
+    """
+
+    nTaps = 4 * sizes.subWidth * sizes.subHeight
+    superSizes = sizes.withSubsamples(max(AREA_SUPERSAMPLES, 2 * sizes.subWidth),
+                                      max(AREA_SUPERSAMPLES, 2 * sizes.subHeight))
+    superFace, superX, superY = computeSamplingIndices(superSizes, mapToLatLon, rows)
+    nPixels, nPoints = superFace.shape
+    faceSizes = sizes.faceSizes()
+    faceOffsets = sizes.faceOffsets()
+
+    face = np.empty((nPixels, nTaps), dtype=np.uint8)
+    xFace = np.empty((nPixels, nTaps), dtype=np.uint16)
+    yFace = np.empty((nPixels, nTaps), dtype=np.uint16)
+    weights = np.empty((nPixels, nTaps), dtype=np.float32)
+
+    # Process blocks of pixels, to limit the size of the intermediate arrays.
+    pixelsPerBlock = max(1, 2**20 // nPoints)
+    for p0 in range(0, nPixels, pixelsPerBlock):
+        p1 = min(p0 + pixelsPerBlock, nPixels)
+        block = slice(p0, p1)
+        blockFace = superFace[block]
+        flat = faceOffsets[blockFace] + superY[block].astype(np.int64) * faceSizes[blockFace] + superX[block]
+        np.minimum(flat, faceOffsets[BLANK_FACE] - 1, out=flat, where=blockFace < BLANK_FACE)
+        flat.sort(axis=1)
+
+        # The number of points in each cube pixel, at the first of its points.
+        isFirst = np.ones(flat.shape, dtype=bool)
+        isFirst[:, 1:] = flat[:, 1:] != flat[:, :-1]
+        firsts = np.flatnonzero(isFirst)
+        counts = np.zeros(flat.size, dtype=np.int32)
+        counts[firsts] = np.diff(np.append(firsts, flat.size))
+        counts = counts.reshape(flat.shape)
+
+        rows = np.arange(p1 - p0)[:, None]
+        kept = np.argsort(-counts, axis=1, kind="stable")[:, :nTaps]
+        keptFlat = flat[rows, kept]
+        keptCounts = counts[rows, kept].astype(np.float32)
+
+        keptFace = np.searchsorted(faceOffsets, keptFlat, side="right") - 1
+        keptSize = faceSizes[keptFace]
+        face[block] = keptFace
+        yFace[block] = (keptFlat - faceOffsets[keptFace]) // keptSize
+        xFace[block] = (keptFlat - faceOffsets[keptFace]) % keptSize
+        weights[block] = keptCounts / keptCounts.sum(axis=1, keepdims=True)
+
+    return (face, xFace, yFace, weights)
+
+def projectionMirrors(sizes, projectionTag):
+    """
+    Returns the list of mirror symmetries of the sampling indices for the
+    projection indicated by `projectionTag`, for use by `expandMirrors`.  Each
+    mirror is a tuple, (`imageAxis`, `span`, `rayAxis`): the rows (`imageAxis`
+    0) or columns (`imageAxis` 1) with index `i` and `span - 1 - i`, for `i` less
+    than `span`, have subsamples in mirror-image positions, whose rays differ
+    only in the sign of the component `rayAxis` (0, 1, 2 for X, Y, Z).  For the
+    equirectangular and Mercator projections, the top and bottom halves mirror
+    each other (negating Z), and the left and right halves mirror each other
+    (negating Y).  If the width is even, the two quarters of each half mirror each
+    other (negating X), since longitude `lon` maps to `-pi - lon` in the left half.
+    The mirrors are ordered from the innermost, which is applied first.
+    """
+
+    if not projectionTag in ["eqrc", "merc"]:
+        return []
+    mirrors = []
+    if sizes.width % 2 == 0:
+        mirrors.append((1, sizes.width // 2, 0))
+    mirrors.append((1, sizes.width, 1))
+    mirrors.append((0, sizes.height, 2))
+    return mirrors
+
+def fundamentalRegion(sizes, mirrors):
+    """
+    Returns a tuple, (`rows`, `columns`), of the numbers of rows and columns at
+    the start of the final image from which the `mirrors` (from
+    `projectionMirrors`) derive the rest of the image.
+    """
+
+    rows = sizes.height
+    columns = sizes.width
+    for imageAxis, span, _ in mirrors:
+        if imageAxis == 0:
+            rows = min(rows, (span + 1) // 2)
+        else:
+            columns = min(columns, (span + 1) // 2)
+    return (rows, columns)
+
+def mirrorTables(rayAxis):
+    """
+    Returns a tuple, (`faceMap`, `flipX`, `flipY`), of arrays indexed by face, for
+    the rays mirrored by negating the component `rayAxis`: the face intersected
+    by the mirrored ray, and whether the face X and Y coordinates of the
+    intersection are mirrored.
+    """
+
+    faceMap = np.arange(6, dtype=np.uint8)
+    flipX = np.zeros(6, dtype=bool)
+    flipY = np.zeros(6, dtype=bool)
+    for i in range(6):
+        axis = int(i / 2)
+        if axis == rayAxis:
+            # The ray hits the opposite face, at the same point, but the opposite
+            # face may have the opposite orientation.
+            faceMap[i] = i ^ 1
+            flipX[i] = FACE_ORIENTATION[i] != FACE_ORIENTATION[i ^ 1]
+        elif [j for j in range(3) if j != axis][0] == rayAxis:
+            flipX[i] = True
+        else:
+            flipY[i] = True
+    return (faceMap, flipX, flipY)
+
+def toSubsampleGrid(sizes, array):
+    """
+    Returns the sampling indices `array`, with one row per final image pixel and
+    one column per subsample, rearranged as a grid of all the subsamples, with
+    shape (`sizes.height * sizes.subHeight`, `sizes.width * sizes.subWidth`).
+    In this grid, the mirror image of a row or column of subsamples is the row
+    or column at the mirror-image index, which makes `expandMirrors` simple.
+    """
+
+    grid = array.reshape(sizes.height, sizes.width, sizes.subHeight, sizes.subWidth).transpose(0, 2, 1, 3)
+    return np.ascontiguousarray(grid).reshape(sizes.height * sizes.subHeight, sizes.width * sizes.subWidth)
+
+def fromSubsampleGrid(sizes, grid):
+    """
+    The inverse of `toSubsampleGrid`.
+    """
+
+    array = grid.reshape(sizes.height, sizes.subHeight, sizes.width, sizes.subWidth).transpose(0, 2, 1, 3)
+    return np.ascontiguousarray(array).reshape(sizes.width * sizes.height, sizes.subWidth * sizes.subHeight)
+
+def expandMirrors(sizes, face, xFace, yFace, mirrors, flags=None):
+    """
+    Fills in place the arrays `face`, `xFace`, `yFace`, in the layout from
+    `toSubsampleGrid`, from the values in the `fundamentalRegion`, using the
+    `mirrors` from `projectionMirrors`.  The mirrored coordinate of `xFace` or
+    `yFace` is the face size minus one minus the original, which is exact unless the
+    original is on a pixel boundary or a face edge.  If `flags` is not `None`,
+    it is a boolean array of the same shape, whose values are copied to the
+    mirrored positions.
+    """
+
+    rows, columns = fundamentalRegion(sizes, mirrors)
+    rows *= sizes.subHeight
+    columns *= sizes.subWidth
+    lastByFace = (sizes.faceSizes() - 1).astype(np.uint16)
+    for imageAxis, span, rayAxis in mirrors:
+        sub = sizes.subHeight if imageAxis == 0 else sizes.subWidth
+        # The number of rows or columns of subsamples to derive.
+        lo = (span // 2) * sub
+        span *= sub
+        # The destination, and the source in mirror-image order.
+        mirrored = slice(lo - 1, None, -1) if lo > 0 else slice(0, 0)
+        if imageAxis == 0:
+            rows = span
+            dst = (slice(span - lo, span), slice(0, columns))
+            src = (mirrored, slice(0, columns))
+        else:
+            columns = span
+            dst = (slice(0, rows), slice(span - lo, span))
+            src = (slice(0, rows), mirrored)
+        faceMap, flipX, flipY = mirrorTables(rayAxis)
+        srcFace = face[src]
+        face[dst] = faceMap[srcFace]
+        # Mirrored faces have the same size.
+        last = lastByFace[srcFace] if sizes.polarCube != sizes.cube else lastByFace[0]
+        for coord, flip in [(xFace, flipX), (yFace, flipY)]:
+            coord[dst] = coord[src]
+            np.subtract(last, coord[src], out=coord[dst], where=flip[srcFace])
+        if flags is not None:
+            flags[dst] = flags[src]
+
+def computeSamplingIndicesSymmetric(sizes, mapToLatLon, mirrors):
+    """
+    Computes the same sampling indices as `computeSamplingIndicesDirect`, but
+    faster, by computing only the `fundamentalRegion` of the final image and
+    deriving the rest with the `mirrors` from `projectionMirrors`.  The rays of
+    mirrored subsamples are mirror images only up to rounding, which could
+    change the derived indices for subsamples on a pixel boundary or a face edge
+    (or within the rounding error of one), so those subsamples are flagged and
+    computed directly, in order, as `cubeIntersection` would.
+    """
+
+    trig = samplingTrigonometry(sizes, mapToLatLon)
+    cosLon, sinLon, sinLat1, cosLat1 = [t.ravel() for t in trig]
+
+    gridShape = (sizes.height * sizes.subHeight, sizes.width * sizes.subWidth)
+    face = np.empty(gridShape, dtype=np.uint8)
+    xFace = np.empty(gridShape, dtype=np.uint16)
+    yFace = np.empty(gridShape, dtype=np.uint16)
+    flags = np.empty(gridShape, dtype=bool)
+
+    # Rounding errors are a few units in the last place of the single-precision
+    # intersection points, so this tolerance (in face image pixels for the pixel
+    # boundaries, and face coordinates for the face edges) has a large margin.
+    tolerance = 2.0**-20
+
+    rows, columns = fundamentalRegion(sizes, mirrors)
+    rows *= sizes.subHeight
+    columns *= sizes.subWidth
+    rowsPerBlock = max(1, 2**20 // columns)
+    for y0 in range(0, rows, rowsPerBlock):
+        y1 = min(y0 + rowsPerBlock, rows)
+        rayX, rayY, rayZ = subsampleRays(cosLon[None, :columns], sinLon[None, :columns],
+                                         sinLat1[y0:y1, None], cosLat1[y0:y1, None])
+        hits, pts = cubeIntersectionHits(rayX.ravel(), rayY.ravel(), rayZ.ravel())
+        # Edges are resolved later, in order.
+        i = np.argmax(hits, axis=0)
+        xInter, yInter = faceCoordinates(sizes, i, np.choose(i, [pt[0] for pt in pts]), np.choose(i, [pt[1] for pt in pts]))
+        x = faceImageCoordinate(sizes, xInter, i)
+        y = faceImageCoordinate(sizes, yInter, i)
+        faceTolerance = tolerance * sizes.faceSizes()[i]
+        flag = (np.count_nonzero(hits, axis=0) > 1) | \
+               (np.abs(xInter) > 1 - tolerance) | (np.abs(yInter) > 1 - tolerance) | \
+               (np.abs(x - np.round(x)) < faceTolerance) | (np.abs(y - np.round(y)) < faceTolerance)
+
+        block = (y1 - y0, columns)
+        face[y0:y1, :columns] = i.reshape(block)
+        xFace[y0:y1, :columns] = x.astype(np.uint16).reshape(block)
+        yFace[y0:y1, :columns] = y.astype(np.uint16).reshape(block)
+        flags[y0:y1, :columns] = flag.reshape(block)
+
+    expandMirrors(sizes, face, xFace, yFace, mirrors, flags)
+
+    face = fromSubsampleGrid(sizes, face)
+    xFace = fromSubsampleGrid(sizes, xFace)
+    yFace = fromSubsampleGrid(sizes, yFace)
+    positions = np.flatnonzero(fromSubsampleGrid(sizes, flags))
+    recomputeSamplingIndices(sizes, trig, positions, face.reshape(-1), xFace.reshape(-1), yFace.reshape(-1))
+    return (face, xFace, yFace)
+
+def recomputeSamplingIndices(sizes, trig, positions, face, xFace, yFace):
+    """
+    Computes directly, and stores in place in the flattened arrays `face`,
+    `xFace`, `yFace`, the sampling indices for the subsamples at the increasing
+    `positions` in those arrays, using the terms `trig` from `samplingTrigonometry`.
+    The values at the other positions must be correct already, since the face
+    chosen for a subsample on a face edge depends on the preceding subsample.
+    """
+
+    cosLon, sinLon, sinLat1, cosLat1 = trig
+    r, c, kr, kc = np.unravel_index(positions, (sizes.height, sizes.width, sizes.subHeight, sizes.subWidth))
+    rayX, rayY, rayZ = subsampleRays(cosLon[c, kc], sinLon[c, kc], sinLat1[r, kr], cosLat1[r, kr])
+    hits, pts = cubeIntersectionHits(rayX, rayY, rayZ)
+
+    i = np.argmax(hits, axis=0)
+    face[positions] = i
+    for j in np.flatnonzero(np.count_nonzero(hits, axis=0) > 1):
+        p = positions[j]
+        prev = face[p - 1] if p > 0 else 0
+        i[j] = resolveEdgeIntersection(hits[:, j], prev)
+        face[p] = i[j]
+
+    xInter, yInter = faceCoordinates(sizes, i, np.choose(i, [pt[0] for pt in pts]), np.choose(i, [pt[1] for pt in pts]))
+    xFace[positions] = faceImageCoordinate(sizes, xInter, i).astype(np.uint16)
+    yFace[positions] = faceImageCoordinate(sizes, yInter, i).astype(np.uint16)
+
+def alignBinaryOffset(offset):
+    """
+    Returns the smallest multiple of `BINARY_ALIGNMENT` that is at least `offset`.
+    """
+
+    return -(-offset // BINARY_ALIGNMENT) * BINARY_ALIGNMENT
+
+def expandSamplingIndices(sizes, mirrors, face, xFace, yFace):
+    """
+    Returns a tuple, (`face`, `xFace`, `yFace`), of the sampling indices for the
+    whole final image, as from `computeSamplingIndices`, derived by `expandMirrors`
+    with the `mirrors` from the arrays `face`, `xFace`, `yFace` for the
+    `fundamentalRegion` in the layout from `toSubsampleGrid`.
+    """
+
+    rows, columns = fundamentalRegion(sizes, mirrors)
+    region = (slice(0, rows * sizes.subHeight), slice(0, columns * sizes.subWidth))
+    gridShape = (sizes.height * sizes.subHeight, sizes.width * sizes.subWidth)
+    result = []
+    for array in [face, xFace, yFace]:
+        grid = np.empty(gridShape, dtype=array.dtype)
+        grid[region] = array
+        result.append(grid)
+    expandMirrors(sizes, *result, mirrors)
+    return tuple([fromSubsampleGrid(sizes, grid) for grid in result])
+
+def toBinary(sizes, projectionTag, samplingIndices, filter="nearest"):
+    """
+    Converts the `SamplingIndices` returned by `createSamplingIndices` into a
+    binary form, appropriate for storing in a cache file.  The binary form
+    starts with a header recording `sizes`, `projectionTag`, `filter` and the
+    data types, and the arrays follow in the native byte order, so `fromBinary`
+    can use them in place.  For the "nearest" filter, if the projection has mirror
+    symmetries, only the indices for the `fundamentalRegion` are stored, with the
+    exceptions to the indices derived from them, which makes the binary form four
+    to eight times smaller.
+    """
+
+    coordDtype = np.dtype(np.uint16)
+    arrays = [samplingIndices.face.astype(np.uint8), samplingIndices.x.astype(coordDtype),
+              samplingIndices.y.astype(coordDtype)]
+    mirrors = binaryMirrors(sizes, projectionTag, filter)
+    if mirrors:
+        rows, columns = fundamentalRegion(sizes, mirrors)
+        region = (slice(0, rows * sizes.subHeight), slice(0, columns * sizes.subWidth))
+        fundamental = [toSubsampleGrid(sizes, array)[region] for array in arrays]
+        derived = expandSamplingIndices(sizes, mirrors, *fundamental)
+        different = np.zeros(arrays[0].shape, dtype=bool)
+        for array, derivedArray in zip(arrays, derived):
+            different |= (array != derivedArray)
+        positions = np.flatnonzero(different).astype(np.uint64)
+        arrays = fundamental + [positions] + [array.reshape(-1)[positions] for array in arrays]
+    else:
+        positions = []
+        if filter != "nearest":
+            arrays.append(samplingIndices.weights.astype(np.float32))
+        if sizes.adaptive:
+            arrays.insert(0, samplingIndices.rowCounts.astype(np.uint32))
+
+    nTaps = 0 if sizes.adaptive else samplingIndices.face.shape[1]
+    header = struct.pack(BINARY_HEADER_FORMAT, BINARY_MAGIC, BINARY_VERSION,
+                         sizes.width, sizes.height, sizes.cube, sizes.subWidth, sizes.subHeight,
+                         projectionTag.encode("ascii"), coordDtype.str.encode("ascii"), len(positions),
+                         filter[:4].encode("ascii"), nTaps, sizes.polarCube, int(sizes.adaptive))
+    ba = bytearray(header)
+    for array in arrays:
+        ba += bytes(alignBinaryOffset(len(ba)) - len(ba))
+        ba += np.ascontiguousarray(array).tobytes()
+    return ba
+
+def binaryMirrors(sizes, projectionTag, filter):
+    """
+    Returns the mirrors (as from `projectionMirrors`) used by `toBinary` for the
+    sampling indices for `sizes`, `projectionTag` and `filter`.  Only the indices
+    for the "nearest" filter, without adaptive sizes, are mirror images of each other.
+    """
+
+    return projectionMirrors(sizes, projectionTag) if filter == "nearest" and not sizes.adaptive else []
+
+def fromBinary(sizes, ba, projectionTag=None, filter="nearest"):
+    """
+    Converts `ba`, the binary form returned by `toBinary`, back into a
+    `SamplingIndices` like that returned by `createSamplingIndices`.  Unless the
+    projection has mirror symmetries, the arrays of the result share memory with
+    `ba`, without copying, so `ba` can be a memory-mapped file.  Raises `ValueError`
+    if `ba` is not in the current binary form, or does not match `sizes`, `filter`
+    (and `projectionTag`, if specified).
+    """
+
+    headerSize = struct.calcsize(BINARY_HEADER_FORMAT)
+    if len(ba) < headerSize:
+        raise ValueError("too short for a header")
+    header = struct.unpack_from(BINARY_HEADER_FORMAT, ba)
+    if header[0] != BINARY_MAGIC or header[1] != BINARY_VERSION:
+        raise ValueError("not in the current binary form (version {})".format(BINARY_VERSION))
+    if header[2:7] + header[12:14] != sizes.key():
+        raise ValueError("sizes do not match")
+    if projectionTag != None and header[7] != projectionTag.encode("ascii"):
+        raise ValueError("projection does not match")
+    coordDtype = np.dtype(header[8].rstrip(b"\0").decode("ascii"))
+    if coordDtype != np.dtype(np.uint16):
+        raise ValueError("unexpected data type '{}'".format(coordDtype.str))
+    nExceptions = header[9]
+    if header[10].rstrip(b"\0") != filter[:4].encode("ascii"):
+        raise ValueError("filter does not match")
+    nTaps = header[11]
+
+    mirrors = binaryMirrors(sizes, header[7].decode("ascii"), filter)
+    if mirrors:
+        rows, columns = fundamentalRegion(sizes, mirrors)
+        shape = (rows * sizes.subHeight, columns * sizes.subWidth)
+    else:
+        shape = (sizes.width * sizes.height, nTaps)
+    if sizes.adaptive:
+        rowCountsDtype = np.dtype(np.uint32)
+        offset = alignBinaryOffset(headerSize)
+        if offset + sizes.height * rowCountsDtype.itemsize > len(ba):
+            raise ValueError("too short for the sampling indices")
+        rowCounts = np.frombuffer(ba, dtype=rowCountsDtype, count=sizes.height, offset=offset)
+        shape = (int(rowCounts.astype(np.int64).sum()) * sizes.width,)
+    layout = [(np.dtype(np.uint8), shape), (coordDtype, shape), (coordDtype, shape)]
+    if filter != "nearest":
+        layout.append((np.dtype(np.float32), shape))
+    if sizes.adaptive:
+        layout.insert(0, (rowCountsDtype, (sizes.height,)))
+    if mirrors:
+        layout += [(np.dtype(np.uint64), (nExceptions,)), (np.dtype(np.uint8), (nExceptions,)),
+                   (coordDtype, (nExceptions,)), (coordDtype, (nExceptions,))]
+
+    offset = headerSize
+    arrays = []
+    for dtype, arrayShape in layout:
+        count = int(np.prod(arrayShape))
+        offset = alignBinaryOffset(offset)
+        if offset + count * dtype.itemsize > len(ba):
+            raise ValueError("too short for the sampling indices")
+        arrays.append(np.frombuffer(ba, dtype=dtype, count=count, offset=offset).reshape(arrayShape))
+        offset += count * dtype.itemsize
+
+    if mirrors:
+        result = expandSamplingIndices(sizes, mirrors, *arrays[0:3])
+        positions = arrays[3]
+        if nExceptions > 0 and positions.max() >= result[0].size:
+            raise ValueError("exception out of range")
+        for array, values in zip(result, arrays[4:7]):
+            array.reshape(-1)[positions] = values
+        return SamplingIndices(*result)
+    if sizes.adaptive:
+        return SamplingIndices(*arrays[1:4], weights=arrays[4] if len(arrays) > 4 else None, rowCounts=arrays[0])
+    return SamplingIndices(*arrays)
+
+def cacheDirectory(cacheDir=None):
+    """
+    Returns the directory for cache files: `cacheDir` if it is not `None`, or
+    else the directory from the environment variable named by `CACHE_DIR_ENV`,
+    if set, or else the directory "samplingIndexCache" next to this source file.
+    """
+
+    if cacheDir != None:
+        return cacheDir
+    if os.environ.get(CACHE_DIR_ENV):
+        return os.environ[CACHE_DIR_ENV]
+    path = os.path.dirname(os.path.realpath(__file__))
+    return os.path.join(path, "samplingIndexCache")
+
+def cacheLimitBytes(cacheLimit=None):
+    """
+    Returns the maximum total size of the cache files in bytes: `cacheLimit`
+    megabytes if it is not `None`, or else the megabytes from the environment
+    variable named by `CACHE_LIMIT_ENV`, if set, or else `DEFAULT_CACHE_LIMIT_MB`.
+    """
+
+    if cacheLimit == None:
+        cacheLimit = float(os.environ.get(CACHE_LIMIT_ENV) or DEFAULT_CACHE_LIMIT_MB)
+    return int(cacheLimit * 1024 * 1024)
+
+def sizesSuffix(sizes):
+    """
+    Returns a string identifying the optional parts of `sizes`, a polar cube size
+    different from the cube size and the adaptive mode, which is empty if neither
+    is used.
+    """
+
+    suffix = ""
+    if sizes.polarCube != sizes.cube:
+        suffix += "_pcu{}".format(sizes.polarCube)
+    if sizes.adaptive:
+        suffix += "_ad"
+    return suffix
+
+def cacheKey(sizes, projectionTag, filter="nearest"):
+    """
+    Returns the key for the cache file for the sampling indices built with the
+    image dimensions in `sizes`, the projection type indicated by `projectionTag`
+    and `filter`: a hash of those parameters, `SAMPLING_ALGORITHM_VERSION` and
+    `BINARY_VERSION`.
+    """
+
+    parameters = "v{}_b{}_w{}_h{}_cu{}_sw{}_sh{}_{}_{}{}".\
+        format(SAMPLING_ALGORITHM_VERSION, BINARY_VERSION, sizes.width, sizes.height, sizes.cube,
+               sizes.subWidth, sizes.subHeight, projectionTag, filter, sizesSuffix(sizes))
+    return hashlib.sha256(parameters.encode("utf-8")).hexdigest()[:16]
+
+def cacheFilePath(sizes, projectionTag, cacheDir=None, filter="nearest"):
+    """
+    Returns the path to a cache file for the sampling indices built with the
+    image dimensions in `sizes`, the projection type indicated by `projectionTag`
+    and `filter`, in the directory from `cacheDirectory(cacheDir)`.  The file
+    name ends with the `cacheKey`, and starts with the parameters for readability.
+    Creates the directory for cache files if it does not exist already.
+    """
+
+    path = cacheDirectory(cacheDir)
+    os.makedirs(path, exist_ok=True)
+    filterTag = "" if filter == "nearest" else filter + "_"
+    file = "samplingIndices_w{}_h{}_cu{}_sw{}_sh{}{}_{}_{}{}".\
+        format(sizes.width, sizes.height, sizes.cube, sizes.subWidth, sizes.subHeight, sizesSuffix(sizes),
+               projectionTag, filterTag, cacheKey(sizes, projectionTag, filter))
+    return os.path.join(path, file)
+
+def evictCacheFiles(cacheDir=None, cacheLimit=None, keepPath=None):
+    """
+    Removes the least recently used cache files in the directory from
+    `cacheDirectory(cacheDir)` until their total size is at most `cacheLimit`
+    megabytes (as in `cacheLimitBytes`), except for the file `keepPath`.
+    A cache file's modification time is its time of last use, as it is updated
+    whenever the file is read.  Returns the list of paths removed.
+    """
+
+    path = cacheDirectory(cacheDir)
+    limit = cacheLimitBytes(cacheLimit)
+    entries = []
+    for entry in os.scandir(path):
+        if entry.is_file() and entry.name.startswith("samplingIndices_") and not entry.name.endswith(".tmp"):
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                # Another process removed the file since the directory was listed.
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum([size for _, size, _ in entries])
+
+    removed = []
+    for _, size, entryPath in sorted(entries):
+        if total <= limit:
+            break
+        if keepPath != None and os.path.realpath(entryPath) == os.path.realpath(keepPath):
+            continue
+        try:
+            os.remove(entryPath)
+            removed.append(entryPath)
+            total -= size
+        except FileNotFoundError:
+            total -= size
+        except OSError as e:
+            print("Warning: cannot remove sampling indices cache '{}': '{}'".format(entryPath, str(e)))
+    return removed
+
+def writeSamplingIndicesToCache(sizes, projectionTag, samplingIndices, cacheDir=None, cacheLimit=None, filter="nearest"):
+    """
+    Converts `samplingIndices` to binary and writes it to a cache file.  The
+    image dimensions from `sizes`, the projection type indicated by
+    `projectionTag` and `filter` are used in the name of the cache file.  The binary is
+    written to a temporary file that then is renamed to the cache file, so
+    processes reading the cache file concurrently never see a partial file,
+    and processes writing it concurrently do not corrupt it.  Then the least
+    recently used cache files are removed if the total size of the cache files
+    exceeds `cacheLimit`, as in `evictCacheFiles`.  Returns the path to the
+    cache file, or `None` if it could not be written.
+    """
+
+    try:
+        path = cacheFilePath(sizes, projectionTag, cacheDir, filter)
+        ba = toBinary(sizes, projectionTag, samplingIndices, filter)
+        fd, tempPath = tempfile.mkstemp(dir=os.path.dirname(path), prefix=os.path.basename(path) + ".", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(ba)
+            # The temporary file is readable only by its owner, unlike a cache file.
+            os.chmod(tempPath, 0o644)
+            os.replace(tempPath, path)
+        except:
+            os.remove(tempPath)
+            raise
+        for removedPath in evictCacheFiles(cacheDir, cacheLimit, path):
+            print("Removed least recently used sampling indices cache '{}'".format(removedPath))
+        return path
+    except Exception as e:
+        print("Warning: cannot write sampling indices cache: '{}'".format(str(e)))
+    return None
+
+def readSamplingIndicesFromCache(sizes, projectionTag, cacheDir=None, filter="nearest"):
+    """
+    Returns the sampling indices read from a cache file indentified by the image
+    dimensions from `sizes`, the projection type indicated by `projectionTag` and
+    `filter`, in the directory from `cacheDirectory(cacheDir)`.  If no matching
+    cache exists, or it is in an older format, returns `None`.  The cache file is
+    memory-mapped read-only, so loading it is fast, and unless `toBinary` used
+    mirror symmetries, concurrent processes using the same cache file share its
+    memory.  The cache file's modification time is updated, to make it the most
+    recently used for `evictCacheFiles`.
+    """
+
+    try:
+        path = cacheFilePath(sizes, projectionTag, cacheDir, filter)
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                print("Reading sampling indices cache '{}'...".format(path))
+                t0 = time.time()
+                ba = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                try:
+                    result = fromBinary(sizes, ba, projectionTag, filter)
+                except ValueError as e:
+                    print("Ignoring sampling indices cache: {}".format(str(e)))
+                    return None
+                t1 = time.time()
+                print("Done, {:.2f} secs".format(t1 - t0))
+            try:
+                os.utime(path)
+            except OSError:
+                # A read-only cache is still usable, but its use is not recorded.
+                pass
+            return result
+    except Exception as e:
+        print("Warning: cannot read sampling indices cache: '{}'".format(str(e)))
+    return None
+
+def flatSamplingIndices(samplingIndices, sizes):
+    """
+    Returns the `samplingIndices` as indices of pixels in the concatenation of the
+    cube images and the blank pixel (i.e., the rows of the array from
+    `getCubePixels`), in an array with one row per subsample and one column per
+    final image pixel.  For adaptive `sizes`, returns a list of such arrays, one for
+    each band of rows from `samplingBands`, in order.  The result is computed once
+    and then reused for each frame.
+    """
+
+    if samplingIndices.flat is None:
+        faceSizes = sizes.faceSizes()
+        faceOffsets = sizes.faceOffsets()
+        nCubePixels = int(faceOffsets[-1])
+        dtype = np.int32 if nCubePixels <= np.iinfo(np.int32).max else np.int64
+        flat = faceOffsets[samplingIndices.face]
+        flat += samplingIndices.y.astype(np.int64) * faceSizes[samplingIndices.face]
+        flat += samplingIndices.x
+        # A coordinate of the face size refers to the first pixel of the next row,
+        # so guard against reading past the last pixel of the last face.
+        np.minimum(flat, faceOffsets[BLANK_FACE] - 1, out=flat, where=samplingIndices.face < BLANK_FACE)
+        flat = flat.astype(dtype)
+        samplingIndices.flat = flatBands(samplingIndices, sizes, flat)
+    return samplingIndices.flat
+
+def faceBounds(samplingIndices, sizes):
+    """
+    Returns a list, indexed by face, of the bounding rectangles of the pixels of
+    each cube image read when resampling with `samplingIndices` (i.e., the pixels
+    indexed by `flatSamplingIndices`).  Each rectangle is a tuple, (`xMin`, `yMin`,
+    `xMax`, `yMax`), with the maximums included, or `None` for a face with no
+    pixels read.  The result is computed once and then reused for each frame.
+    """
+
+    if samplingIndices.bounds is None:
+        flat = flatSamplingIndices(samplingIndices, sizes)
+        bands = flat if isinstance(flat, list) else [flat]
+        faceOffsets = sizes.faceOffsets()
+        faceSizes = sizes.faceSizes()
+        xMin = np.full(6, np.iinfo(np.int64).max)
+        yMin = np.full(6, np.iinfo(np.int64).max)
+        xMax = np.full(6, -1)
+        yMax = np.full(6, -1)
+        for band in bands:
+            for face in range(6):
+                inFace = band[(band >= faceOffsets[face]) & (band < faceOffsets[face + 1])] - faceOffsets[face]
+                if inFace.size > 0:
+                    x = inFace % faceSizes[face]
+                    xMin[face] = min(xMin[face], x.min())
+                    xMax[face] = max(xMax[face], x.max())
+                    yMin[face] = min(yMin[face], inFace.min() // faceSizes[face])
+                    yMax[face] = max(yMax[face], inFace.max() // faceSizes[face])
+        samplingIndices.bounds = [(int(xMin[face]), int(yMin[face]), int(xMax[face]), int(yMax[face]))
+                                  if xMax[face] >= 0 else None for face in range(6)]
+    return samplingIndices.bounds
+
+def flatSamplingWeights(samplingIndices, sizes):
+    """
+    Returns the weights of the `samplingIndices`, in an array (or for adaptive
+    `sizes`, a list of arrays) with the same shape as the result of
+    `flatSamplingIndices`, or `None` for the "nearest" filter, whose subsamples
+    have equal weights.  The subsamples outside the projection's valid region (see
+    `BLANK_FACE`) read the blank pixel, so with or without weights,
+    `resampleCubePixels` gives the pixels with no valid subsamples an alpha of 0.
+    """
+
+    weights = samplingIndices.weights
+    if weights is None:
+        return None
+    return flatBands(samplingIndices, sizes, weights.astype(np.float32))
+
+def flatBands(samplingIndices, sizes, array):
+    """
+    Returns `array`, with the shape of the arrays of `samplingIndices`, transposed
+    to have one row per subsample and one column per final image pixel, or for
+    adaptive `samplingIndices`, a list of those for each of the `samplingBands`.
+    """
+
+    if samplingIndices.rowCounts is None:
+        return np.ascontiguousarray(array.T)
+    return [np.ascontiguousarray(array[start:end].reshape(pixel1 - pixel0, -1).T)
+            for start, end, pixel0, pixel1 in samplingBands(samplingIndices, sizes)]
+
+def resampleCubePixels(cubePixels, flatIndices, out=None, weights=None, eyes=1):
+    """
+    Returns the pixels of the final spherical image, as a flat NumPy float32 array,
+    by gathering the `cubePixels` (an array of the concatenated cube images' pixels,
+    with one row of four channels per pixel) at the `flatIndices` (an array with one
+    row per subsample and one column per final image pixel, of indices of rows
+    of `cubePixels`) and averaging over the subsamples.  If `weights` is specified
+    (as from `flatSamplingWeights`), it has the same shape as `flatIndices`, and
+    the average is weighted.  If `out` is specified, it is a flat float32 array of
+    the correct size to hold the result.  For adaptive sampling indices,
+    `flatIndices` and `weights` are lists, for consecutive bands of final image
+    pixels.  If `eyes` is greater than one, `cubePixels` is that many equal parts,
+    one for each eye (as for stereo, the left eye's first), each resampled with
+    the same `flatIndices` into one part of the final image, with the last eye's
+    image first (the bottom of a top-bottom image, as Blender's images start at
+    the bottom).
+    """
+
+    if eyes > 1:
+        eyeCubePixels = np.split(cubePixels, eyes)
+        if out is None:
+            nPixels = sum([band.shape[1] for band in flatIndices]) if isinstance(flatIndices, list) else flatIndices.shape[1]
+            out = np.empty(eyes * nPixels * cubePixels.shape[1], dtype=np.float32)
+        eyeOut = np.split(out, eyes)
+        for eye in range(eyes):
+            resampleCubePixels(eyeCubePixels[eye], flatIndices, eyeOut[eyes - 1 - eye], weights)
+        return out
+
+    if isinstance(flatIndices, list):
+        nPixels = sum([band.shape[1] for band in flatIndices])
+        if out is None:
+            out = np.empty(nPixels * cubePixels.shape[1], dtype=np.float32)
+        start = 0
+        for k, band in enumerate(flatIndices):
+            end = start + band.shape[1] * cubePixels.shape[1]
+            resampleCubePixels(cubePixels, band, out[start:end], weights[k] if weights is not None else None)
+            start = end
+        return out
+
+    nSub, nPixels = flatIndices.shape
+    ChannelsPerPixel = cubePixels.shape[1]
+
+    # Accumulate in double precision, one subsample at a time, to limit the size
+    # of the intermediate arrays.  Opaque cube images give an alpha of exactly 1,
+    # with or without weights, as floating-point images are not clamped when saved.
+    total = np.zeros((nPixels, ChannelsPerPixel))
+    gathered = np.empty((nPixels, ChannelsPerPixel), dtype=cubePixels.dtype)
+    for k in range(nSub):
+        np.take(cubePixels, flatIndices[k], axis=0, out=gathered)
+        if weights is not None:
+            gathered *= weights[k][:, None]
+        total += gathered
+    if weights is None:
+        total /= nSub
+    if out is None:
+        return total.astype(np.float32).ravel()
+    out[:] = total.ravel()
+    return out